@@ -0,0 +1,545 @@
+'''
+Двухпроходный ассемблер i8080.
+Понимает метки (с двоеточием или без), директивы ORG, EQU, SET, DB, DW, DS, END
+и выражения: числа (10, 0FFH, 0x10, 1010B, 17O, 17Q), символы, $ (адрес текущей
+инструкции), символьные константы ('A'), операции + - * / MOD SHL SHR NOT AND
+OR XOR HIGH LOW (и их знаки % << >> ~ & | ^), скобки.
+
+Коды операций, длины и такты берутся из таблицы opcodes.OPCODES (только
+документированные команды), поэтому ассемблер, дизассемблер и процессор
+используют одно и то же описание системы команд.
+
+Результат - объект Program: сегменты кода, таблица символов и адрес запуска.
+Program.load(memory) записывает программу в memory.Memory.
+'''
+import re
+
+from memory import MEMORY_SIZE
+from opcodes import OPCODES, D8, D16, A16
+
+_OPERAND_NAMES = frozenset(['B', 'C', 'D', 'E', 'H', 'L', 'M', 'A', 'SP', 'PSW'])
+_DIRECTIVES = frozenset(['ORG', 'EQU', 'SET', 'DB', 'DW', 'DS', 'END'])
+
+
+def _build_encodings():
+    '''
+    Строит таблицы кодирования по OPCODES:
+    (мнемоника, операнды) -> код, где операнд с данными заменён на None, и мнемоника -> длина
+    '''
+    encodings = {}
+    lengths = {}
+    for info in OPCODES:
+        if not info.documented:
+            continue
+        if info.mnemonic == 'RST':
+            operands = (None,)
+        else:
+            operands = tuple(None if o in (D8, D16, A16) else o for o in info.operands)
+        encodings.setdefault((info.mnemonic, operands), info.code)
+        lengths[info.mnemonic] = info.length
+    return encodings, lengths
+
+
+_ENCODINGS, _LENGTHS = _build_encodings()
+
+
+class AssemblerError(Exception):
+    '''
+    Ошибка в исходном тексте. line - номер строки (с единицы) или None.
+    '''
+    def __init__(self, message, line=None):
+        Exception.__init__(self, message if line is None else 'line %d: %s' % (line, message))
+        self.line = line
+
+
+_TOKEN = re.compile(r"\s*(?:(?P<num>0[xX][0-9A-Fa-f]+|[0-9][0-9A-Fa-f]*[HhOoQq]?)"
+                    r"|(?P<str>'(?:[^']|'')*')"
+                    r"|(?P<name>[A-Za-z_?@.][A-Za-z0-9_?@.]*)"
+                    r"|(?P<op><<|>>|[-+*/()%&|^~$]))")
+
+_BINARY = [                                 # Бинарные операции по возрастанию приоритета
+    {'OR': lambda a, b: a | b, '|': lambda a, b: a | b, 'XOR': lambda a, b: a ^ b, '^': lambda a, b: a ^ b},
+    {'AND': lambda a, b: a & b, '&': lambda a, b: a & b},
+    None,                                   # Уровень унарного NOT
+    {'+': lambda a, b: a + b, '-': lambda a, b: a - b},
+    {'*': lambda a, b: a * b, '/': lambda a, b: a // b, 'MOD': lambda a, b: a % b, '%': lambda a, b: a % b,
+     'SHL': lambda a, b: a << b, '<<': lambda a, b: a << b, 'SHR': lambda a, b: a >> b, '>>': lambda a, b: a >> b},
+]
+_WORD_OPERATORS = frozenset(['OR', 'XOR', 'AND', 'NOT', 'MOD', 'SHL', 'SHR', 'HIGH', 'LOW'])
+
+
+def _number(text):
+    '''
+    Разбирает числовую константу в нотации Intel
+    '''
+    t = text.upper()
+    if t.startswith('0X'):
+        return int(t[2:], 16)
+    suffix = t[-1]
+    if suffix == 'H':
+        return int(t[:-1], 16)
+    if suffix in 'OQ':
+        return int(t[:-1], 8)
+    if suffix == 'B' and all(c in '01' for c in t[:-1]):
+        return int(t[:-1], 2)
+    if suffix == 'D' and t[:-1].isdigit():
+        return int(t[:-1])
+    return int(t)
+
+
+def _tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if match is None:
+            raise ValueError('unexpected %r' % text[pos:].strip())
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'num':
+            try:
+                tokens.append(('num', _number(value)))
+            except ValueError:
+                raise ValueError('bad number %r' % value)
+        elif kind == 'str':
+            chars = value[1:-1].replace("''", "'")
+            if len(chars) == 1:
+                tokens.append(('num', ord(chars)))
+            elif len(chars) == 2:
+                tokens.append(('num', ord(chars[0]) << 8 | ord(chars[1])))
+            else:
+                raise ValueError('string %s used as a number' % value)
+        elif kind == 'name' and value.upper() in _WORD_OPERATORS:
+            tokens.append(('op', value.upper()))
+        else:
+            tokens.append((kind, value))
+    return tokens
+
+
+class _Expression:
+    '''
+    Вычислитель выражения по списку лексем
+    '''
+    def __init__(self, tokens, symbols, here):
+        self.tokens = tokens
+        self.pos = 0
+        self.symbols = symbols
+        self.here = here
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def parse(self, level=0):
+        if level == 2:
+            if self.peek() in (('op', 'NOT'), ('op', '~')):
+                self.pos += 1
+                return ~self.parse(2)
+            return self.parse(3)
+        if level == len(_BINARY):
+            return self.unary()
+        value = self.parse(level + 1)
+        operators = _BINARY[level]
+        while True:
+            kind, op = self.peek()
+            if kind != 'op' or op not in operators:
+                return value
+            self.pos += 1
+            right = self.parse(level + 1)
+            if op in ('/', 'MOD', '%') and right == 0:
+                raise ValueError('division by zero')
+            value = operators[op](value, right)
+
+    def unary(self):
+        kind, value = self.peek()
+        self.pos += 1
+        if kind == 'num':
+            return value
+        if kind == 'name':
+            name = value.upper()
+            if name not in self.symbols:
+                raise KeyError(value)
+            return self.symbols[name]
+        if kind == 'op':
+            if value == '$':
+                return self.here
+            if value == '-':
+                return -self.unary()
+            if value == '+':
+                return self.unary()
+            if value == 'HIGH':
+                return self.unary() >> 8 & 0xFF
+            if value == 'LOW':
+                return self.unary() & 0xFF
+            if value == '(':
+                result = self.parse()
+                if self.peek() != ('op', ')'):
+                    raise ValueError('missing )')
+                self.pos += 1
+                return result
+        raise ValueError('unexpected %r' % (value if value is not None else 'end of expression'))
+
+
+def evaluate(text, symbols=None, here=0):
+    '''
+    Вычисляет выражение text. symbols - словарь {ИМЯ: значение} (имена в верхнем регистре),
+    here - значение $. Неизвестный символ вызывает KeyError, ошибка синтаксиса - ValueError.
+    '''
+    tokens = text if isinstance(text, list) else _tokenize(text)
+    e = _Expression(tokens, symbols or {}, here)
+    value = e.parse()
+    if e.pos != len(tokens):
+        raise ValueError('unexpected %r' % str(tokens[e.pos][1]))
+    return value
+
+
+def _split_comment(line):
+    '''
+    Отделяет комментарий (после ;), не учитывая ; внутри кавычек
+    '''
+    quoted = False
+    for i, c in enumerate(line):
+        if c == "'":
+            quoted = not quoted
+        elif c == ';' and not quoted:
+            return line[:i]
+    return line
+
+
+def _split_operands(text):
+    '''
+    Разделяет поле операндов по запятым вне кавычек
+    '''
+    operands = []
+    quoted = False
+    start = 0
+    for i, c in enumerate(text):
+        if c == "'":
+            quoted = not quoted
+        elif c == ',' and not quoted:
+            operands.append(text[start:i].strip())
+            start = i + 1
+    last = text[start:].strip()
+    if last or operands:
+        operands.append(last)
+    return operands
+
+
+class _Statement:
+    __slots__ = ('line', 'source', 'label', 'op', 'operands', 'address', 'size', 'value')
+
+    def __init__(self, line, source, label, op, operands):
+        self.line = line
+        self.source = source
+        self.label = label
+        self.op = op
+        self.operands = operands
+        self.address = 0
+        self.size = 0
+        self.value = None   # Значение имени EQU/SET на момент этой строки
+
+
+def _parse_line(number, source):
+    '''
+    Разбирает строку на метку, операцию и операнды
+    '''
+    text = _split_comment(source).rstrip()
+    if not text.strip():
+        return None
+    label = None
+    if not text[0].isspace():
+        parts = text.split(None, 1)
+        head = parts[0]
+        if head.endswith(':'):
+            label = head[:-1]
+            text = parts[1] if len(parts) > 1 else ''
+        elif head.upper() not in _LENGTHS and head.upper() not in _DIRECTIVES:
+            label = head
+            text = parts[1] if len(parts) > 1 else ''
+    else:
+        # Метка с двоеточием и имя перед EQU/SET могут стоять и не с начала строки
+        parts = text.split(None, 2)
+        if parts[0].endswith(':'):
+            label = parts[0][:-1]
+            text = text.strip()[len(parts[0]):]
+        elif len(parts) > 1 and parts[1].upper() in ('EQU', 'SET'):
+            label = parts[0]
+            text = text.strip()[len(parts[0]):]
+    if label is not None and not re.match(r'[A-Za-z_?@.][A-Za-z0-9_?@.]*$', label):
+        raise AssemblerError('bad label %r' % label, number)
+    if label is not None and label.upper() in _OPERAND_NAMES:
+        raise AssemblerError('register name %s cannot be a label' % label, number)
+    parts = text.split(None, 1)
+    op = parts[0].upper() if parts else None
+    operands = _split_operands(parts[1]) if len(parts) > 1 else []
+    return _Statement(number, source, label, op, operands)
+
+
+class Program:
+    '''
+    Результат ассемблирования.
+    '''
+    def __init__(self, segments, symbols, entry, statements):
+        '''
+        :param segments: Список (адрес, bytes) в порядке следования в исходном тексте
+        :param symbols: Таблица символов {ИМЯ: значение}
+        :param entry: Адрес запуска (операнд END или адрес первого байта кода)
+        '''
+        self.segments = segments
+        self.symbols = symbols
+        self.entry = entry
+        self._statements = statements
+
+    @property
+    def origin(self):
+        '''
+        Наименьший адрес программы
+        '''
+        return min((a for a, data in self.segments if data), default=0)
+
+    @property
+    def image(self):
+        '''
+        Непрерывный образ от origin до последнего байта программы (промежутки заполнены нулями)
+        '''
+        origin = self.origin
+        end = max((a + len(data) for a, data in self.segments if data), default=origin)
+        image = bytearray(end - origin)
+        for addr, data in self.segments:
+            image[addr - origin:addr - origin + len(data)] = data
+        return bytes(image)
+
+    def load(self, memory):
+        '''
+        Записывает сегменты программы в память memory (memory.Memory), не трогая промежутки
+        '''
+        for addr, data in self.segments:
+            if data:
+                memory.load(data, addr)
+
+    def listing(self):
+        '''
+        Возвращает листинг: адрес, байты, такты и исходная строка
+        '''
+        lines = []
+        for statement, data in self._statements:
+            code = ' '.join('%02X' % b for b in data[:4])
+            cycles = ''
+            if statement.op in _LENGTHS and data:
+                info = OPCODES[data[0]]
+                cycles = str(info.cycles) if info.cycles == info.cycles_taken else '%d/%d' % (info.cycles, info.cycles_taken)
+            lines.append('%04X  %-12s %5s  %s' % (statement.address, code, cycles, statement.source.rstrip()))
+        return lines
+
+
+def assemble(source, origin=0):
+    '''
+    Ассемблирует исходный текст source (строка или список строк).
+    origin - начальный адрес, если в тексте нет ORG. Возвращает Program.
+    Ошибки сообщаются исключением AssemblerError.
+    '''
+    lines = source.splitlines() if isinstance(source, str) else list(source)
+    symbols = {}
+    statements = []
+    pc = origin
+    entry = None
+    variables = set()       # Имена, заданные SET
+    # Первый проход: адреса меток и размеры
+    for number, text in enumerate(lines, 1):
+        statement = _parse_line(number, text)
+        if statement is None:
+            continue
+        op = statement.op
+        statement.address = pc
+        if statement.label is not None and op not in ('EQU', 'SET'):
+            _define(symbols, statement.label, pc, number)
+        if op is None:
+            continue
+        statements.append(statement)
+        try:
+            if op in _LENGTHS:
+                statement.size = _LENGTHS[op]
+            elif op == 'DB':
+                statement.size = sum(_db_length(o) for o in statement.operands)
+            elif op == 'DW':
+                statement.size = 2 * len(statement.operands)
+            elif op == 'DS':
+                statement.size = _single(statement, symbols, pc)
+                if statement.size < 0:
+                    raise ValueError('DS count must not be negative')
+            elif op == 'ORG':
+                pc = statement.address = _single(statement, symbols, pc) & 0xFFFF
+            elif op in ('EQU', 'SET'):
+                if statement.label is None:
+                    raise AssemblerError('%s without a name' % op, number)
+                value = statement.value = _single(statement, symbols, pc)
+                if op == 'EQU':
+                    _define(symbols, statement.label, value, number)
+                else:
+                    symbols[statement.label.upper()] = value
+                    variables.add(statement.label.upper())
+            elif op == 'END':
+                break
+            else:
+                raise AssemblerError('unknown instruction %r' % statement.op, number)
+        except KeyError as e:
+            raise AssemblerError('symbol %s must be defined before use here' % e.args[0], number)
+        except ValueError as e:
+            raise AssemblerError(str(e), number)
+        pc += statement.size
+        if pc > MEMORY_SIZE:
+            raise AssemblerError('program does not fit into 64 KB', number)
+    # Второй проход: кодирование. Имена SET получают значения заново по порядку строк,
+    # поэтому каждое использование видит значение, заданное последним SET перед ним
+    for name in variables:
+        del symbols[name]
+    segments = []
+    encoded = []
+    current = None
+    for statement in statements:
+        op = statement.op
+        if op == 'ORG' or current is None:
+            current = [statement.address, bytearray()]
+            segments.append(current)
+        if op == 'SET':
+            symbols[statement.label.upper()] = statement.value
+        try:
+            if op == 'END':
+                if statement.operands:
+                    entry = _single(statement, symbols, statement.address) & 0xFFFF
+                break
+            data = _encode(statement, symbols)
+        except KeyError as e:
+            raise AssemblerError('undefined symbol %s' % e.args[0], statement.line)
+        except ValueError as e:
+            raise AssemblerError(str(e), statement.line)
+        if op == 'DS':
+            current = [statement.address + statement.size, bytearray()]
+            segments.append(current)
+        else:
+            current[1] += data
+        encoded.append((statement, data))
+    segments = [(addr, bytes(data)) for addr, data in segments if data]
+    if entry is None:
+        entry = segments[0][0] if segments else origin
+    return Program(segments, symbols, entry, encoded)
+
+
+def _define(symbols, name, value, line):
+    key = name.upper()
+    if key in symbols:
+        raise AssemblerError('symbol %s is already defined' % name, line)
+    symbols[key] = value
+
+
+def _db_length(operand):
+    if len(operand) > 2 and operand[0] == "'" and operand[-1] == "'":
+        return len(operand[1:-1].replace("''", "'"))
+    return 1
+
+
+def _single(statement, symbols, here):
+    if len(statement.operands) != 1:
+        raise ValueError('%s takes one operand' % statement.op)
+    return evaluate(statement.operands[0], symbols, here)
+
+
+def _byte(value):
+    if not -0x100 <= value <= 0xFF:
+        raise ValueError('value %d does not fit into a byte' % value)
+    return value & 0xFF
+
+
+def _word(value):
+    if not -0x10000 <= value <= 0xFFFF:
+        raise ValueError('value %d does not fit into a word' % value)
+    return value & 0xFFFF
+
+
+def _encode(statement, symbols):
+    '''
+    Возвращает байты, соответствующие команде или директиве данных
+    '''
+    op = statement.op
+    here = statement.address
+    operands = statement.operands
+    if op == 'DB':
+        data = bytearray()
+        for o in operands:
+            if len(o) > 2 and o[0] == "'" and o[-1] == "'":
+                data += o[1:-1].replace("''", "'").encode('latin-1')
+            else:
+                data.append(_byte(evaluate(o, symbols, here)))
+        return bytes(data)
+    if op == 'DW':
+        data = bytearray()
+        for o in operands:
+            v = _word(evaluate(o, symbols, here))
+            data += bytes([v & 0xFF, v >> 8])
+        return bytes(data)
+    if op not in _LENGTHS:
+        return b''
+    if op == 'RST':
+        n = _single(statement, symbols, here)
+        if not 0 <= n <= 7:
+            raise ValueError('RST number must be 0..7')
+        return bytes([0xC7 | n << 3])
+    key = tuple(o.upper() if o.upper() in _OPERAND_NAMES else None for o in operands)
+    code = _ENCODINGS.get((op, key))
+    if code is None:
+        raise ValueError('bad operands for %s: %s' % (op, ', '.join(operands) or 'none'))
+    length = _LENGTHS[op]
+    if length == 1:
+        return bytes([code])
+    value = evaluate(operands[key.index(None)], symbols, here)
+    if length == 2:
+        return bytes([code, _byte(value)])
+    value = _word(value)
+    return bytes([code, value & 0xFF, value >> 8])
+
+
+def main():
+    import sys
+    import time
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            program = assemble(f.read())
+        print('\n'.join(program.listing()))
+        print()
+        for name, value in sorted(program.symbols.items()):
+            print('%-16s %04X' % (name, value & 0xFFFF))
+        if len(sys.argv) > 2:
+            with open(sys.argv[2], 'wb') as f:
+                f.write(program.image)
+        return
+    source = '''
+            ORG 100H
+    COUNT   EQU 10
+    START:  LXI SP, STACK
+            MVI B, COUNT
+            LXI H, DATA
+    LOOP:   MOV A, M        ; A = *HL
+            ADI 'A' - 1
+            MOV M, A
+            INX H
+            DCR B
+            JNZ LOOP
+            HLT
+    DATA:   DB 1, 2, 3, 'xy', LOW(START), HIGH START
+            DW START, $ + 2
+            DS 16
+    STACK:
+            END START
+    '''
+    program = assemble(source)
+    print('\n'.join(program.listing()))
+    t = time.perf_counter()
+    n = 1000
+    for i in range(n):
+        assemble(source)
+    print('%.0f programs/s' % (n / (time.perf_counter() - t)))
+
+
+if __name__ == '__main__':
+    main()
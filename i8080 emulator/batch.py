@@ -0,0 +1,218 @@
+'''
+Пакетное выполнение множества независимых программ i8080 в нескольких процессах.
+Задания (Job) распределяются по процессам ProcessPoolExecutor пачками; в каждом
+процессе один раз создаётся процессор с памятью, который затем используется для
+всех заданий этого процесса. Каждое задание выполняется, пока программа не
+выполнит HLT или не истратит свой бюджет тактов. Результаты (регистры, хэш памяти,
+такты, причина остановки) возвращаются по мере готовности, а не в порядке заданий.
+
+Задания берутся из каталога (файлы *.com, *.bin, *.rom, как в bench) или из
+манифеста JSON - списка (или {"jobs": [...]}) описаний вида
+    {"name": "t1", "image": "t1.bin", "at": "0x100", "pc": "0x100", "sp": "0xF000",
+     "registers": {"A": 1, "HL": "0x2000"}, "memory": {"0x2000": [1, 2, 3]}, "cycles": 100000}
+Пути образов отсчитываются от каталога манифеста; *.com загружаются как программы CP/M.
+'''
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from bench import load_workload, find_workloads
+from cpu import CPU
+from memory import Memory, MEMORY_SIZE
+from translator import BlockCache
+
+DEFAULT_CYCLES = 10000000    # Бюджет тактов задания по умолчанию
+DEFAULT_CHUNK_SIZE = 16      # Число заданий, передаваемых процессу за один раз
+TIERS = ('interpreter', 'blocks')
+_EMPTY = bytes(MEMORY_SIZE)
+
+
+def _number(v):
+    return int(v, 0) if isinstance(v, str) else int(v)
+
+
+class Job:
+    '''
+    Задание: нагрузка (bench.Workload), начальные значения регистров,
+    дополнительное содержимое памяти и бюджет тактов.
+    '''
+    def __init__(self, workload, registers=None, memory=None, cycles=None):
+        '''
+        :param workload: bench.Workload - образ программы, адрес загрузки, PC и SP
+        :param registers: Словарь {имя: значение}; имена - регистры B, C, D, E, H, L, F, A,
+                          пары BC, DE, HL, PSW, а также SP и PC
+        :param memory: Словарь {адрес: байты}, записываемый в память после загрузки образа
+        :param cycles: Бюджет тактов (по умолчанию - заданный для всего пакета)
+        '''
+        self.workload = workload
+        self.registers = dict(registers or {})
+        self.memory = dict(memory or {})
+        self.cycles = cycles
+
+    @property
+    def name(self):
+        return self.workload.name
+
+    def setup(self, p):
+        '''
+        Подготавливает процессор p (и его память) к выполнению задания
+        '''
+        p.reset()
+        m = p._m
+        m.load(_EMPTY)
+        self.workload.load_into(m)
+        for addr, data in self.memory.items():
+            m.load(data, addr)
+        p.pc = self.workload.pc
+        p.sp = self.workload.sp
+        for name, value in self.registers.items():
+            name = name.upper()
+            if name in CPU.ALL_REGISTERS:
+                p.r[CPU.ALL_REGISTERS.index(name)] = value & 0xFF
+            elif name in ('SP', 'PC', 'BC', 'DE', 'HL', 'PSW'):
+                setattr(p, name.lower(), value & 0xFFFF)
+            else:
+                raise ValueError('unknown register %r' % name)
+
+
+def load_manifest(path):
+    '''
+    Читает манифест JSON и возвращает список заданий
+    '''
+    with open(path) as f:
+        entries = json.load(f)
+    if isinstance(entries, dict):
+        entries = entries['jobs']
+    base = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    for entry in entries:
+        workload = load_workload(os.path.join(base, entry['image']))
+        if 'name' in entry:
+            workload.name = entry['name']
+        if 'at' in entry:
+            workload.at = _number(entry['at'])
+            workload.pc = workload.at
+        if 'pc' in entry:
+            workload.pc = _number(entry['pc'])
+        if 'sp' in entry:
+            workload.sp = _number(entry['sp'])
+        registers = {name: _number(v) for name, v in entry.get('registers', {}).items()}
+        memory = {}
+        for addr, data in entry.get('memory', {}).items():
+            memory[_number(addr)] = bytes.fromhex(data) if isinstance(data, str) else bytes(data)
+        cycles = _number(entry['cycles']) if 'cycles' in entry else None
+        jobs.append(Job(workload, registers, memory, cycles))
+    return jobs
+
+
+def find_jobs(path):
+    '''
+    Возвращает задания из манифеста (файл *.json) или из каталога либо файла программы
+    '''
+    if os.path.isfile(path) and path.lower().endswith('.json'):
+        return load_manifest(path)
+    return [Job(w) for w in find_workloads([path])]
+
+
+# Процессор процесса-исполнителя, создаётся один раз в _init_worker
+_worker_cpu = None
+_worker_runner = None
+
+
+def _init_worker(tier):
+    global _worker_cpu, _worker_runner
+    _worker_cpu = CPU(Memory())
+    _worker_runner = BlockCache(_worker_cpu) if tier == 'blocks' else _worker_cpu
+
+
+def run_job(job, p, runner, cycles=DEFAULT_CYCLES):
+    '''
+    Выполняет задание job на процессоре p (runner - p или BlockCache над p)
+    и возвращает словарь с результатом. Блоки прошлого задания сбрасываются до
+    загрузки нового образа.
+    '''
+    t = time.perf_counter()
+    try:
+        if runner is not p:
+            runner.invalidate()
+        job.setup(p)
+        result = runner.run_for(cycles=job.cycles or cycles)
+    except Exception as e:
+        return {'name': job.name, 'error': '%s: %s' % (type(e).__name__, e)}
+    return {
+        'name': job.name,
+        'reason': result.reason,
+        'instructions': result.instructions,
+        'cycles': result.cycles,
+        'seconds': time.perf_counter() - t,
+        'registers': {name: p.r[i] for i, name in enumerate(CPU.ALL_REGISTERS)},
+        'sp': p.sp,
+        'pc': p.pc,
+        'halted': p.halted,
+        'memory_sha256': hashlib.sha256(p._m.dump()).hexdigest(),
+    }
+
+
+def _run_chunk(jobs, cycles):
+    return [run_job(job, _worker_cpu, _worker_runner, cycles) for job in jobs]
+
+
+def run_batch(jobs, workers=None, cycles=DEFAULT_CYCLES, chunk_size=DEFAULT_CHUNK_SIZE, tier='interpreter'):
+    '''
+    Выполняет задания jobs в workers процессах (по умолчанию - по числу ядер)
+    и возвращает генератор результатов в порядке их готовности.
+    При workers == 1 задания выполняются в текущем процессе.
+    '''
+    if tier not in TIERS:
+        raise ValueError('unknown tier %r' % tier)
+    jobs = list(jobs)
+    if workers == 1:
+        _init_worker(tier)
+        for job in jobs:
+            yield run_job(job, _worker_cpu, _worker_runner, cycles)
+        return
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(tier,)) as pool:
+        futures = [pool.submit(_run_chunk, jobs[i:i + chunk_size], cycles)
+                   for i in range(0, len(jobs), chunk_size)]
+        for future in as_completed(futures):
+            for result in future.result():
+                yield result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run many i8080 programs in parallel')
+    parser.add_argument('path', help='directory of programs, a program file or a JSON manifest')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: CPU count)')
+    parser.add_argument('--cycles', type=int, default=DEFAULT_CYCLES, help='default cycle limit per job')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='jobs sent to a worker at once')
+    parser.add_argument('--tier', choices=TIERS, default='interpreter', help='execution tier')
+    parser.add_argument('--output', help='write results as JSON lines to this file instead of stdout')
+    args = parser.parse_args()
+
+    jobs = find_jobs(args.path)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    t = time.perf_counter()
+    count = 0
+    instructions = 0
+    errors = 0
+    try:
+        for result in run_batch(jobs, args.workers, args.cycles, args.chunk_size, args.tier):
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+            count += 1
+            instructions += result.get('instructions', 0)
+            errors += 'error' in result
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    dt = time.perf_counter() - t
+    sys.stderr.write('%d jobs (%d errors), %d instructions in %.2f s, %.3f MIPS\n'
+                     % (count, errors, instructions, dt, instructions / dt / 1e6 if dt else 0))
+
+
+if __name__ == '__main__':
+    main()
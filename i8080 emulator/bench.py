@@ -0,0 +1,321 @@
+'''
+Набор тестов производительности эмулятора.
+Каждая нагрузка (программа i8080) выполняется заданное число тактов на каждом
+уровне выполнения: 'interpreter' (CPU.run_for) и 'blocks' (translator.BlockCache).
+Для каждого запуска измеряются инструкции в секунду, такты в секунду и
+эмулируемая частота по сравнению с настоящим процессором на 2 МГц, а также
+пик выделенной памяти. Отдельно измеряется скорость выполнения команд каждой
+группы (opcodes.GROUPS) на коротких циклах из команд этой группы.
+
+Кроме встроенных нагрузок можно передать файлы программ: *.com загружаются
+как программы CP/M по адресу 0x100 (с заглушкой BDOS, вывод отбрасывается,
+выход в CP/M останавливает процессор), остальные файлы - образы с адреса 0.
+
+Результаты печатаются и могут быть записаны в JSON, чтобы сравнивать их между
+версиями: python bench.py --json new.json --compare old.json
+'''
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import iobus
+from cpu import CPU
+from memory import Memory
+from opcodes import OPCODES, GROUPS, GROUP_TRANSFER, GROUP_ARITHMETIC, GROUP_LOGICAL, GROUP_BRANCH, GROUP_CONTROL
+from translator import BlockCache
+
+REFERENCE_HZ = 2000000      # Тактовая частота настоящего i8080
+DEFAULT_CYCLES = 2000000    # Бюджет тактов на один запуск - секунда работы настоящего процессора
+DEFAULT_REPEAT = 3          # Число повторов; в отчёт идёт лучший результат
+TIERS = ('interpreter', 'blocks')
+
+WORKLOAD_EXTENSIONS = ('.com', '.bin', '.rom')
+
+
+class Workload:
+    '''
+    Нагрузка: образ памяти и начальные значения PC и SP.
+    '''
+    def __init__(self, name, image, at=0, pc=0, sp=0, cpm=False):
+        '''
+        :param name: Имя нагрузки в отчёте
+        :param image: Байты программы
+        :param at: Адрес загрузки
+        :param pc: Начальный PC
+        :param sp: Начальный SP
+        :param cpm: Подготовить нулевую страницу CP/M (выход по адресу 0, BDOS по адресу 5)
+        '''
+        self.name = name
+        self.image = bytes(image)
+        self.at = at
+        self.pc = pc
+        self.sp = sp
+        self.cpm = cpm
+
+    def memory(self):
+        '''
+        Создаёт новую память с загруженной нагрузкой
+        '''
+        m = Memory()
+        self.load_into(m)
+        return m
+
+    def load_into(self, m):
+        '''
+        Загружает нагрузку в память m (остальное содержимое памяти не меняется)
+        '''
+        if self.cpm:
+            iobus.setup_cpm(m, port=None)
+        m.load(self.image, self.at)
+
+    def cpu(self):
+        '''
+        Создаёт новый процессор с загруженной нагрузкой
+        '''
+        p = CPU(self.memory())
+        p.pc = self.pc
+        p.sp = self.sp
+        return p
+
+
+def load_workload(path):
+    '''
+    Загружает нагрузку из файла path
+    '''
+    with open(path, 'rb') as f:
+        image = f.read()
+    name = os.path.basename(path)
+    if name.lower().endswith('.com'):
+        return Workload(name, image, iobus.CPM_START, iobus.CPM_START, iobus.CPM_STACK, cpm=True)
+    return Workload(name, image)
+
+
+def find_workloads(paths):
+    '''
+    Возвращает нагрузки из файлов paths; каталоги просматриваются на файлы *.com, *.bin, *.rom
+    '''
+    result = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(WORKLOAD_EXTENSIONS):
+                    result.append(load_workload(os.path.join(path, name)))
+        else:
+            result.append(load_workload(path))
+    return result
+
+
+def _loop(name, setup, body, copies=32):
+    '''
+    Строит нагрузку: setup, затем copies копий body и JMP на первую копию.
+    body - байты или функция body(addr), возвращающая байты для адреса addr.
+    '''
+    image = bytearray(setup)
+    start = len(image)
+    for i in range(copies):
+        image += body(len(image)) if callable(body) else body
+    image += bytes([0xC3, start & 0xFF, start >> 8])    # JMP start
+    return Workload(name, image, sp=0xF000)
+
+
+def _branches(addr):
+    # JMP, JNC и CALL на следующую команду; подпрограмма по адресу 0x0008 - RET
+    return bytes([0xC3, (addr + 3) & 0xFF, (addr + 3) >> 8,
+                  0xD2, (addr + 6) & 0xFF, (addr + 6) >> 8,
+                  0xCD, 0x08, 0x00])
+
+
+BUILTIN_WORKLOADS = [
+    Workload('arith-loop', [0x21, 0x00, 0x00,       # LXI H, 0
+                            0x11, 0x07, 0x01,       # LXI D, 0107H
+                            0x06, 0x00,             # MVI B, 0
+                            0x78, 0x83, 0x8A,       # loop: MOV A, B; ADD E; ADC D
+                            0x27, 0x47, 0x19,       # DAA; MOV B, A; DAD D
+                            0x0C, 0x15, 0x14,       # INR C; DCR D; INR D
+                            0xC2, 0x08, 0x00]),     # JNZ loop
+    Workload('memcopy', [0x21, 0x00, 0x10,          # start: LXI H, 1000H
+                         0x11, 0x00, 0x20,          # LXI D, 2000H
+                         0x01, 0x00, 0x10,          # LXI B, 1000H
+                         0x7E, 0x12, 0x23,          # loop: MOV A, M; STAX D; INX H
+                         0x13, 0x0B, 0x78,          # INX D; DCX B; MOV A, B
+                         0xB1, 0xC2, 0x09, 0x00,    # ORA C; JNZ loop
+                         0xC3, 0x00, 0x00]),        # JMP start
+    Workload('call-stack', [0x31, 0x00, 0xF0,       # LXI SP, 0F000H
+                            0xCD, 0x0A, 0x00,       # loop: CALL sub
+                            0xC3, 0x03, 0x00,       # JMP loop
+                            0x00,                   # NOP
+                            0xC5, 0xD5, 0xE5,       # sub: PUSH B; PUSH D; PUSH H
+                            0xE1, 0xD1, 0xC1,       # POP H; POP D; POP B
+                            0xC9]),                 # RET
+]
+
+# Короткие циклы из команд одной группы для измерения скорости по группам
+GROUP_WORKLOADS = {
+    GROUP_TRANSFER: _loop('group-transfer', [0x21, 0x00, 0x30],             # LXI H, 3000H
+                      bytes([0x41, 0x53, 0x3E, 0x05, 0x77, 0x7E,       # MOV B, C; MOV D, E; MVI A, 5; MOV M, A; MOV A, M
+                             0xEB, 0xEB, 0x32, 0x01, 0x30,             # XCHG; XCHG; STA 3001H
+                             0x3A, 0x01, 0x30])),                      # LDA 3001H
+    GROUP_ARITHMETIC: _loop('group-arithmetic', [],
+                        bytes([0x80, 0x89, 0x92, 0x9B, 0x04, 0x0D,     # ADD B; ADC C; SUB D; SBB E; INR B; DCR C
+                               0x13, 0x09, 0xC6, 0x01, 0x27])),        # INX D; DAD B; ADI 1; DAA
+    GROUP_LOGICAL: _loop('group-logical', [],
+                     bytes([0xA0, 0xA9, 0xB2, 0xBB, 0x07, 0x1F,        # ANA B; XRA C; ORA D; CMP E; RLC; RAR
+                            0x2F, 0xE6, 0x0F, 0x3F])),                 # CMA; ANI 0FH; CMC
+    GROUP_BRANCH: _loop('group-branch', [0xC3, 0x09, 0x00, 0, 0, 0, 0, 0,  # JMP 0009H; sub по адресу 0008H: RET
+                                     0xC9], _branches),
+    GROUP_CONTROL: _loop('group-control', [],
+                     bytes([0xC5, 0xC1, 0xF5, 0xF1, 0xE3, 0xE3,        # PUSH B; POP B; PUSH PSW; POP PSW; XTHL; XTHL
+                            0x00, 0xF3, 0xFB])),                       # NOP; DI; EI
+}
+
+
+def _runner(p, tier):
+    return p if tier == 'interpreter' else BlockCache(p)
+
+
+def run_workload(workload, tier, cycles=DEFAULT_CYCLES, repeat=DEFAULT_REPEAT):
+    '''
+    Выполняет нагрузку repeat раз на уровне tier и возвращает словарь с результатами
+    лучшего запуска и пиком выделенной памяти
+    '''
+    best = None
+    for i in range(repeat):
+        runner = _runner(workload.cpu(), tier)
+        t = time.perf_counter()
+        result = runner.run_for(cycles=cycles)
+        dt = time.perf_counter() - t
+        if best is None or dt < best[0]:
+            best = (dt, result)
+    dt, result = best
+    # Память измеряется отдельным запуском: tracemalloc сильно замедляет выполнение
+    tracemalloc.start()
+    runner = _runner(workload.cpu(), tier)
+    runner.run_for(cycles=cycles)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    ips = result.instructions / dt
+    cps = result.cycles / dt
+    return {
+        'workload': workload.name,
+        'tier': tier,
+        'instructions': result.instructions,
+        'cycles': result.cycles,
+        'reason': result.reason,
+        'seconds': dt,
+        'instructions_per_sec': ips,
+        'mips': ips / 1e6,
+        'cycles_per_sec': cps,
+        'emulated_mhz': cps / 1e6,
+        'speed_vs_reference': cps / REFERENCE_HZ,
+        'peak_alloc_bytes': peak,
+    }
+
+
+def _max_rss():
+    '''
+    Возвращает максимальный размер резидентной памяти процесса в байтах (None, если неизвестен)
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def run_suite(workloads, tiers=TIERS, cycles=DEFAULT_CYCLES, repeat=DEFAULT_REPEAT, report=None):
+    '''
+    Выполняет все нагрузки и циклы групп команд на всех уровнях.
+    Для каждого результата вызывается report(result), если он задан.
+    Возвращает словарь, пригодный для записи в JSON.
+    '''
+    results = []
+    for workload in workloads:
+        for tier in tiers:
+            results.append(run_workload(workload, tier, cycles, repeat))
+            if report is not None:
+                report(results[-1])
+    groups = {}
+    for group in GROUPS:
+        groups[group] = {}
+        for tier in tiers:
+            result = run_workload(GROUP_WORKLOADS[group], tier, cycles, repeat)
+            groups[group][tier] = result
+            if report is not None:
+                report(result)
+    return {
+        'python': platform.python_implementation() + ' ' + platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'reference_hz': REFERENCE_HZ,
+        'cycles_per_run': cycles,
+        'repeat': repeat,
+        'results': results,
+        'groups': groups,
+        'opcodes_per_group': {g: sum(1 for o in OPCODES if o.group == g) for g in GROUPS},
+        'max_rss_bytes': _max_rss(),
+    }
+
+
+def format_result(result):
+    return '%-20s %-12s %9.3f MIPS %8.3f MHz (x%.2f) %10d instr  peak %7.1f KB  %s' % (
+        result['workload'], result['tier'], result['mips'], result['emulated_mhz'],
+        result['speed_vs_reference'], result['instructions'], result['peak_alloc_bytes'] / 1024,
+        result['reason'])
+
+
+def compare(old, new):
+    '''
+    Сравнивает два результата run_suite() и возвращает строки отчёта:
+    отношение инструкций в секунду для каждой пары (нагрузка, уровень), есть в обоих
+    '''
+    def index(suite):
+        items = list(suite['results'])
+        for tiers in suite['groups'].values():
+            items += tiers.values()
+        return {(r['workload'], r['tier']): r for r in items}
+    before = index(old)
+    lines = []
+    for key, result in sorted(index(new).items()):
+        if key in before:
+            ratio = result['instructions_per_sec'] / before[key]['instructions_per_sec']
+            lines.append('%-20s %-12s %6.2fx' % (key[0], key[1], ratio))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='i8080 emulator benchmarks')
+    parser.add_argument('paths', nargs='*', help='workload files (*.com - CP/M programs) or directories')
+    parser.add_argument('--cycles', type=int, default=DEFAULT_CYCLES, help='cycle budget per run')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='runs per measurement (best is kept)')
+    parser.add_argument('--tiers', default=','.join(TIERS), help='comma-separated tiers to run')
+    parser.add_argument('--no-builtin', action='store_true', help='skip the built-in workloads')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='compare with results previously written by --json')
+    args = parser.parse_args()
+
+    workloads = ([] if args.no_builtin else list(BUILTIN_WORKLOADS)) + find_workloads(args.paths)
+    tiers = [t for t in args.tiers.split(',') if t]
+    for tier in tiers:
+        if tier not in TIERS:
+            parser.error('unknown tier %r' % tier)
+    suite = run_suite(workloads, tiers, args.cycles, args.repeat, lambda r: print(format_result(r)))
+    if suite['max_rss_bytes'] is not None:
+        print('max RSS: %.1f MB' % (suite['max_rss_bytes'] / 1048576))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(suite, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print('speed relative to %s:' % args.compare)
+        for line in compare(old, suite):
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,113 +1,363 @@
 from memory import Memory
 import instructions
+import dispatch
+import tracing
+import snapshot
+import assembler
+from dispatch import StopExecution, STOP_CYCLES, STOP_INSTRUCTIONS, STOP_PREDICATE, STOP_BREAKPOINT, STOP_WAIT
 
-class Register:
+FLAG_S = 0b10000000     # Знак
+FLAG_Z = 0b01000000     # Ноль
+FLAG_A = 0b00010000     # Вспомогательный перенос
+FLAG_P = 0b00000100     # Чётность
+FLAG_C = 0b00000001     # Перенос
+FLAG_NAMES = {'S': FLAG_S, 'Z': FLAG_Z, 'A': FLAG_A, 'P': FLAG_P, 'C': FLAG_C}
+
+
+def _no_input(port):
+    return 0xFF
+
+
+def _no_output(port, value):
+    pass
+
+
+class RunResult:
     '''
-    8-битный регистр.
-    Хранит значение и обеспечивает доступ к нему через свойство value.
+    Итог пакетного выполнения: число выполненных инструкций, затраченных тактов
+    и причина остановки (одна из констант STOP_*).
     '''
-    def __init__(self):
-        self._value = 0
+    __slots__ = ('instructions', 'cycles', 'reason')
 
-    @property
-    def value(self):
-        return self._value
+    def __init__(self, instructions, cycles, reason):
+        self.instructions = instructions
+        self.cycles = cycles
+        self.reason = reason
 
-    @value.setter
-    def value(self, x):
-        self._value = x & 0xFF
+    def __repr__(self):
+        return 'RunResult(instructions=%d, cycles=%d, reason=%r)' % (self.instructions, self.cycles, self.reason)
 
 
-class RegisterPair:
+def _flag_property(mask):
     '''
-    Регистровая пара.
-    Обеспечивает работу с двумя 8-битными регистрами как с одним 16-битным числом.
-    Доступ к значению производится через свойство value.
+    Свойство для чтения и записи одного флага регистра F
     '''
-    def __init__(self, h, l):
-        '''
-        Параметры:
-        h - старший регистр пары;
-        l - младший регистр пары.
+    def getter(self):
+        return 1 if self.r[6] & mask else 0
 
-        Запомнинает h и l в переменных объекта
-        '''
-        self._h = h
-        self._l = l
+    def setter(self, v):
+        if v:
+            self.r[6] |= mask
+        else:
+            self.r[6] &= ~mask & 0xFF
+    return property(getter, setter)
 
-    @property
-    def value(self):
-        '''
-        Вычисляет и возвращает значение пары
-        '''
-        return self._h.value * 0x100 + self._l.value
 
-    @value.setter
-    def value(self, v):
-        '''
-        Разделяет 16-битное значение v на младший и старший байты и
-        записывает их в соответствющие регистры пары
-        '''
-        self._h.value = v // 0x100
-        self._l.value = v & 0x00FF
-        
+def _pair_property(h, l):
+    '''
+    Свойство для чтения и записи регистровой пары как 16-битного числа
+    '''
+    def getter(self):
+        return self.r[h] << 8 | self.r[l]
+
+    def setter(self, v):
+        self.r[h] = (v >> 8) & 0xFF
+        self.r[l] = v & 0xFF
+    return property(getter, setter)
+
 
 class CPU:
     '''
     Центральный процессор.
     Хранит регистры, обеспечивает доступ к ним.
+    Всё состояние процессора хранится в самом объекте, поэтому в одном процессе
+    может работать сколько угодно независимых процессоров.
+    Регистры хранятся в списке r в порядке кодирования в инструкциях: B, C, D, E, H, L, F, A
+    (на месте M, кода 0b110, хранится регистр флагов F).
     '''
-    ALL_REGISTERS = 'BCDEHLFASP'    # Имена всех регистров процессора
+    ALL_REGISTERS = 'BCDEHLFA'      # Имена 8-битных регистров процессора в порядке хранения в r
     REGISTER_NAMES = 'BCDEHLMA'     # Имена регистров, используемых в командах с регистровыми аргументами
     PAIR_NAMES_1 = ['BC', 'DE', 'HL', 'SP']    # Имена регистров, использующихся в командах работы с парами, первый тип
     PAIR_NAMES_2 = ['BC', 'DE', 'HL', 'AF']    # Имена регистров, использующихся в командах работы с парами, второй тип
-    registers = [Register() for r in ALL_REGISTERS]
-    pairs_1 = []
-    for p in PAIR_NAMES_1:
-        pairs_1.append(RegisterPair(registers[ALL_REGISTERS.index(p[0])], registers[ALL_REGISTERS.index(p[1])]))
-    pairs_2 = []
-    for p in PAIR_NAMES_2:
-        pairs_2.append(RegisterPair(registers[ALL_REGISTERS.index(p[0])], registers[ALL_REGISTERS.index(p[1])]))
-    pc = 0
-    registers[6].value = 0b00000010   #Flag register (F) bits: S, Z, 0, A, 0, P, 1, C
-    go = 0
-    
-    
+
+    __slots__ = ('_m', 'r', 'sp', 'pc', 'go', 'halted', 'inte', 'cycles', 'port_in', 'port_out',
+                 '_ei_pc', '_handlers', '_base_handlers', '_handler_hooks', '_trace_sink', '_profiler', '_recorder')
+
     def __init__(self, memory):
         '''
         Инициализирует необходимые переменные
         '''
         self._m = memory
-        self._S = (CPU.registers[6].value & 0b10000000) // 0b10000000
-        self._Z = (CPU.registers[6].value & 0b01000000) // 0b1000000
-        self._A = (CPU.registers[6].value & 0b00010000) // 0b10000
-        self._P = (CPU.registers[6].value & 0b00000100) // 0b100
-        self._C = (CPU.registers[6].value & 0b00000001) // 0b1
+        self.r = [0, 0, 0, 0, 0, 0, 0b00000010, 0]    #Flag register (F) bits: S, Z, 0, A, 0, P, 1, C
+        self.sp = 0
+        self.pc = 0
+        self.go = 0
+        self.halted = False     # Процессор остановлен инструкцией HLT (до прерывания или продолжения выполнения)
+        self.inte = 0           # Триггер разрешения прерываний
+        self._ei_pc = None      # Адрес команды после EI, до выполнения которой прерывание не принимается
+        self.cycles = 0         # Счётчик тактов с момента создания процессора
+        self.port_in = _no_input        # port_in(port) - чтение из порта (инструкция IN)
+        self.port_out = _no_output      # port_out(port, value) - запись в порт (инструкция OUT)
+        self._handlers = dispatch.HANDLERS
+        self._base_handlers = dispatch.HANDLERS     # Таблица без обёрток (обычная или трассировки)
+        self._handler_hooks = []    # Обёртки таблицы: (владелец, wrap, outermost)
+        self._trace_sink = None
+        self._profiler = None
+        self._recorder = None
+
+    def reset(self):
+        '''
+        Возвращает процессор в начальное состояние: регистры, SP, PC и счётчик тактов
+        обнуляются, признаки HLT и разрешения прерываний сбрасываются. Память не меняется.
+        '''
+        self.r[:] = [0, 0, 0, 0, 0, 0, 0b00000010, 0]
+        self.sp = 0
+        self.pc = 0
+        self.halted = False
+        self.inte = 0
+        self._ei_pc = None
+        self.cycles = 0
+        if self._recorder is not None:
+            self._recorder.sync()
+
+    def interrupt(self, vector):
+        '''
+        Запрос прерывания: процессор выполняет команду RST vector (0..7), поступившую
+        с шины данных. Запрос принимается, только если прерывания разрешены (EI)
+        и после EI уже выполнена следующая команда, как у настоящего i8080 (поэтому
+        EI; RET успевает вернуться до прерывания); при этом прерывания запрещаются,
+        а остановка по HLT снимается. В стек помещается
+        текущий PC, то есть адрес команды, которая выполнилась бы следующей.
+        Возвращает True, если прерывание принято.
+        '''
+        if not 0 <= vector <= 7:
+            raise ValueError('RST vector must be 0..7')
+        if not self.inte or self.pc == self._ei_pc:
+            return False
+        self.inte = 0
+        self.halted = False
+        self.sp = (self.sp - 2) & 0xFFFF
+        self._m[self.sp + 1] = self.pc >> 8
+        self._m[self.sp] = self.pc & 0xFF
+        self.pc = vector << 3
+        self.cycles += 11
+        return True
+
+    bc = _pair_property(0, 1)
+    de = _pair_property(2, 3)
+    hl = _pair_property(4, 5)
+    psw = _pair_property(7, 6)
+
+    flag_S = _flag_property(FLAG_S)
+    flag_Z = _flag_property(FLAG_Z)
+    flag_A = _flag_property(FLAG_A)
+    flag_P = _flag_property(FLAG_P)
+    flag_C = _flag_property(FLAG_C)
 
     def step(self):
         '''
-        Выполняет один шаг работы процессора
-        '''
-        print(CPU.pc)
-        opcode = self._m[CPU.pc]
-        print('opcode =', hex(opcode))
-        print('opcode =', bin(opcode))
-        instr = self.decode(opcode)
-        CPU.pc += 1
-        instr._length
-        instr.execute()
-        CPU.pc += instr._length - 1
-        
+        Выполняет один шаг работы процессора.
+        Обработчик инструкции берётся из таблицы диспетчеризации по коду операции.
+        Возвращает число затраченных тактов.
+        '''
+        self._ei_pc = None
+        self.halted = False
+        cycles = self._handlers[self._m.read(self.pc)](self)
+        self.cycles += cycles
+        return cycles
 
     def run(self):
         '''
-        Бесконечный цикл в котором выполняется step()
+        Цикл в котором выполняется step(), пока программа не выполнит HLT
+        или флаг go не будет сброшен извне.
+        '''
+        self.go = 1
+        try:
+            while self.go:
+                self.step()
+        except StopExecution as e:
+            self.cycles += e.cycles
+        self.go = 0
+
+    def run_for(self, cycles=None, instructions=None):
+        '''
+        Выполняет программу, пока не будет затрачено не меньше cycles тактов
+        и/или не выполнено instructions инструкций (что наступит раньше).
+        Последняя инструкция всегда выполняется целиком, поэтому бюджет тактов
+        может быть превышен на время её выполнения. Процессор, остановленный по HLT,
+        продолжает работу с команды после неё (признак halted сбрасывается).
+        Возвращает RunResult.
+        '''
+        if cycles is None and instructions is None:
+            raise ValueError('run_for() requires cycles or instructions')
+        self._ei_pc = None
+        self.halted = False
+        handlers = self._handlers
+        read = self._m.read
+        n = 0
+        c = 0
+        try:
+            if instructions is None:
+                reason = STOP_CYCLES
+                while c < cycles:
+                    c += handlers[read(self.pc)](self)
+                    n += 1
+            elif cycles is None:
+                reason = STOP_INSTRUCTIONS
+                while n < instructions:
+                    c += handlers[read(self.pc)](self)
+                    n += 1
+            else:
+                while c < cycles and n < instructions:
+                    c += handlers[read(self.pc)](self)
+                    n += 1
+                reason = STOP_CYCLES if c >= cycles else STOP_INSTRUCTIONS
+        except StopExecution as e:
+            if e.reason != STOP_WAIT:
+                n += 1
+            c += e.cycles
+            reason = e.reason
+        self.cycles += c
+        return RunResult(n, c, reason)
+
+    def run_until(self, predicate=None, breakpoints=(), cycles=None, instructions=None):
+        '''
+        Выполняет программу до тех пор, пока predicate(cpu) не вернёт истину
+        или PC не окажется в одном из адресов breakpoints.
+        Условия проверяются после каждой инструкции. cycles и instructions,
+        если заданы, ограничивают выполнение так же, как в run_for().
+        Возвращает RunResult.
+        '''
+        self._ei_pc = None
+        self.halted = False
+        handlers = self._handlers
+        read = self._m.read
+        stops = frozenset(breakpoints)
+        max_cycles = float('inf') if cycles is None else cycles
+        max_instructions = float('inf') if instructions is None else instructions
+        n = 0
+        c = 0
+        reason = None
+        try:
+            while c < max_cycles and n < max_instructions:
+                c += handlers[read(self.pc)](self)
+                n += 1
+                if self.pc in stops:
+                    reason = STOP_BREAKPOINT
+                    break
+                if predicate is not None and predicate(self):
+                    reason = STOP_PREDICATE
+                    break
+            else:
+                reason = STOP_CYCLES if c >= max_cycles else STOP_INSTRUCTIONS
+        except StopExecution as e:
+            if e.reason != STOP_WAIT:
+                n += 1
+            c += e.cycles
+            reason = e.reason
+        self.cycles += c
+        return RunResult(n, c, reason)
+
+    def set_trace(self, level, sink=None):
+        '''
+        Включает трассировку уровня level (tracing.TRACE_OFF, TRACE_INSTRUCTION, TRACE_STATE)
+        Строки трассы передаются в sink (по умолчанию - в стандартный вывод).
+        При уровне TRACE_OFF процессор возвращается к обычной таблице обработчиков.
+        '''
+        if self._trace_sink is not None:
+            self._trace_sink.flush()
+        if level == tracing.TRACE_OFF:
+            self._base_handlers = dispatch.HANDLERS
+            self._trace_sink = None
+        else:
+            if sink is None:
+                sink = tracing.StdoutSink()
+            self._base_handlers = tracing.traced_handlers(dispatch.HANDLERS, level, sink)
+            self._trace_sink = sink
+        self._update_handlers()
+
+    def hook_handlers(self, owner, wrap, outermost=False):
+        '''
+        Ставит обёртку таблицы обработчиков: wrap(handlers) возвращает таблицу-обёртку
+        над handlers. Обёртки применяются поверх трассировки в порядке установки,
+        обёртки с outermost - после остальных. Таблица перестраивается при каждой
+        установке и снятии, поэтому снимать обёртки можно в любом порядке.
+        Повторный вызов с тем же owner заменяет его обёртку.
+        '''
+        self._handler_hooks = [hook for hook in self._handler_hooks if hook[0] is not owner]
+        self._handler_hooks.append((owner, wrap, outermost))
+        self._update_handlers()
+
+    def unhook_handlers(self, owner):
+        '''
+        Снимает обёртку, поставленную hook_handlers(owner, ...)
         '''
-        CPU.go = 1
-        while CPU.go:
-            self.step()
-            print(self)
+        self._handler_hooks = [hook for hook in self._handler_hooks if hook[0] is not owner]
+        self._update_handlers()
 
+    def _update_handlers(self):
+        handlers = self._base_handlers
+        for _, wrap, _ in sorted(self._handler_hooks, key=lambda hook: hook[2]):
+            handlers = wrap(handlers)
+        self._handlers = handlers
+
+    def set_profiler(self, profiler):
+        '''
+        Включает профилирование профилировщиком profiler (profiling.Profiler)
+        или выключает его, если profiler - None.
+        '''
+        if self._profiler is not None:
+            self._profiler.detach()
+        self._profiler = profiler
+        if profiler is not None:
+            profiler.attach(self)
+
+    def set_recorder(self, recorder):
+        '''
+        Включает запись двоичной трассы регистратором recorder (recording.RingRecorder
+        или recording.FileRecorder) или выключает её, если recorder - None.
+        '''
+        if self._recorder is not None:
+            self._recorder.detach()
+        self._recorder = recorder
+        if recorder is not None:
+            recorder.attach(self)
+
+    def snapshot(self, base=None, dirty=None):
+        '''
+        Возвращает снимок состояния процессора и памяти (snapshot.Snapshot).
+        Если задан предыдущий снимок base, неизменившиеся страницы памяти разделяются с ним;
+        dirty - страницы, изменённые после base (см. Snapshot.capture).
+        '''
+        return snapshot.Snapshot.capture(self, base, dirty)
+
+    def restore(self, state):
+        '''
+        Восстанавливает состояние из снимка state (Snapshot или двоичный блок Snapshot.to_bytes())
+        '''
+        if not isinstance(state, snapshot.Snapshot):
+            state = snapshot.Snapshot.from_bytes(state)
+        state.apply(self)
+        if self._recorder is not None:
+            self._recorder.sync()
+
+    def fork(self):
+        '''
+        Возвращает новый процессор с копией состояния и памяти этого процессора.
+        Порты ввода-вывода и устройства памяти остаются общими; трассировка,
+        профилирование и наблюдатели за записью не копируются.
+        '''
+        p = CPU(self._m.copy())
+        p.r[:] = self.r
+        p.sp = self.sp
+        p.pc = self.pc
+        p.cycles = self.cycles
+        p.halted = self.halted
+        p.inte = self.inte
+        p._ei_pc = self._ei_pc
+        p.port_in = self.port_in
+        p.port_out = self.port_out
+        return p
 
     def split_opcode(self, opcode):
         '''
@@ -120,54 +370,19 @@ class CPU:
         return XX, YYY, ZZZ
         
 
-    def decode(self, opcode):
-        '''
-        Декодирует инструкцию c кодом opcode
-        Эта функция по opcode возвращает объект Instruction, реализующий соответствующую инструкцию
-        Для разбора опкода используется split_opcode()
-        '''
-        xx, yyy, zzz = self.split_opcode(opcode)
-        if xx == 0b00:
-            if yyy == 0b000 and zzz == 0b000:  #Инструкция NOP
-                CPU.go = 0
-                return instructions.InstructionNOP(self, xx, yyy, zzz)
-            elif (yyy == 0b000 or yyy == 0b010) and zzz == 0b010:  #Инструкция STAX
-                return instructions.InstructionSTAX(self, xx, yyy, zzz)
-            elif yyy&0b001 == 0 and zzz == 0b001:  #Инструкция LXI
-                return instructions.InstructionLXI(self, xx, yyy, zzz)
-            elif zzz == 0b110:  #Инструкция MVI
-                return instructions.InstructionMVI(self, xx, yyy, zzz)
-            elif (yyy == 0b001 or yyy == 0b011) and zzz == 0b010:  #Инструкция LDAX
-                return instructions.InstructionLDAX(self, xx, yyy, zzz)
-            elif yyy == 0b100 and zzz == 0b010:  #Инструкция SHLD
-                return instructions.InstructionSHLD(self, xx, yyy, zzz)
-            elif yyy == 0b101 and zzz == 0b010:  #Инструкция LHLD
-                return instructions.InstructionLHLD(self, xx, yyy, zzz)
-            elif yyy == 0b110 and zzz == 0b010:  #Инструкция STA
-                return instructions.InstructionSTA(self, xx, yyy, zzz)
-            elif yyy == 0b111 and zzz == 0b010:  #Инструкция LDA
-                return instructions.InstructionLDA(self, xx, yyy, zzz)
-        if xx == 0b01:
-            if yyy == 0b110 and zzz == 0b110:
-                print('HLT?')
-            else:  #Инструкция MOV
-                return instructions.InstructionMOV(self, xx, yyy, zzz)
-        if xx == 0b10:
-            if yyy == 0b000:  #Инструкция ADD
-                return instructions.InstructionADD(self, xx, yyy, zzz)
-            elif yyy == 0b001:  #Инструкция ADC
-                return instructions.InstructionADC(self, xx, yyy, zzz)
-            elif yyy == 0b010:  #Инструкция SUB
-                return instructions.InstructionSUB(self, xx, yyy, zzz)
-        if xx == 0b11:
-            if yyy == 0b101 and zzz == 0b001:  #Инструкция PCHL
-                return instructions.InstructionPCHL(self, xx, yyy, zzz)
-            elif yyy == 0b101 and zzz == 0b011:  #Инструкция XCHG
-                return instructions.InstructionXCHG(self, xx, yyy, zzz)
-            elif yyy == 0b111 and zzz == 0b001:  #Инструкция SPHL
-                return instructions.InstructionSPHL(self, xx, yyy, zzz)
-        else:  #Инструкция Error
-            return instructions.InstructionNotImplemented(self, xx, yyy, zzz)
+    def decode(self, addr=None):
+        '''
+        Декодирует инструкцию по адресу addr (по умолчанию - по адресу PC)
+        Возвращает объект Instruction. Декодирование не читает и не изменяет регистры,
+        поэтому результат берётся из общего кэша по ключу (адрес, байты инструкции).
+        '''
+        return instructions.DECODE_CACHE.decode(self._m, self.pc if addr is None else addr)
+
+    def table_entry(self, opcode):
+        '''
+        Возвращает запись таблицы диспетчеризации для opcode: (handler, length, cycles)
+        '''
+        return dispatch.TABLE[opcode]
 
 
     def get_register(self, rrr):
@@ -176,24 +391,68 @@ class CPU:
         Если индекс равен 0b110, возвращает значение из ячейки памяти с адресом, записанном в паре HL
         '''
         if rrr == 0b110:
-            return self._m[CPU.pairs_1[2].value]
-        return CPU.registers[rrr].value
+            return self._m[self.hl]
+        return self.r[rrr]
+
+    def set_register(self, rrr, v):
+        '''
+        Записывает значение v в регистр с индеком rrr
+        Если индекс равен 0b110, записывает значение v в ячейку памяти, с адресом, записанном в паре HL
+        '''
+        if rrr == 0b110:
+            self._m[self.hl] = v & 0xFF
+        else:
+            self.r[rrr] = v & 0xFF
 
     def get_pair1(self, DD):
         '''
         Возвращает значение регистровой пары с индеком DD (Первый тип)
         '''
-        return CPU.pairs_1[DD].value
+        if DD == 0b11:
+            return self.sp
+        return self.r[DD * 2] << 8 | self.r[DD * 2 + 1]
 
-    def set_register(self, rrr, v):
+    def set_pair1(self, DD, v):
         '''
-        Записывает значение v в регистр с индеком rrr
-        Если индекс равен 0b110, записывает значение v в ячейку памяти, с адресом, записанном в паре HL
+        Записывает значение v в регистровую пару с индеком DD (Первый тип)
         '''
-        if rrr == 0b110:
-            self._m[CPU.pairs_1[2].value] = v
+        if DD == 0b11:
+            self.sp = v & 0xFFFF
         else:
-            CPU.registers[rrr].value = v
+            self.r[DD * 2] = (v >> 8) & 0xFF
+            self.r[DD * 2 + 1] = v & 0xFF
+
+    def get_pair2(self, DD):
+        '''
+        Возвращает значение регистровой пары с индеком DD (Второй тип, 0b11 - PSW)
+        '''
+        if DD == 0b11:
+            return self.psw
+        return self.get_pair1(DD)
+
+    def set_pair2(self, DD, v):
+        '''
+        Записывает значение v в регистровую пару с индеком DD (Второй тип, 0b11 - PSW)
+        '''
+        if DD == 0b11:
+            self.psw = v
+        else:
+            self.set_pair1(DD, v)
+
+    def get_flag(self, name):
+        '''
+        Возвращает значение флага с именем name ('S', 'Z', 'A', 'P' или 'C')
+        '''
+        return 1 if self.r[6] & FLAG_NAMES[name] else 0
+
+    def set_flag(self, name, v):
+        '''
+        Устанавливает (v истинно) или сбрасывает флаг с именем name
+        '''
+        if v:
+            self.r[6] |= FLAG_NAMES[name]
+        else:
+            self.r[6] &= ~FLAG_NAMES[name] & 0xFF
 
     def __str__(self):
         '''
@@ -202,32 +461,36 @@ class CPU:
         '''
         s = ''
         for i in range(len(CPU.ALL_REGISTERS)):
-            s += CPU.ALL_REGISTERS[i] + '=' + str(CPU.registers[i].value) + '; '
-        s += 'PC=' + str(CPU.pc) + '; '
-        s += 'SP=' + str(self.get_pair1(0b11)) + '; '
-        s += 'Flag_S=' + str(self._S) + '; '
-        s += 'Flag_Z=' +str(self._Z) + '; '
-        s += 'Flag_A=' +str(self._A) + '; '
-        s += 'Flag_P=' +str(self._P) + '; '
-        s += 'Flag_C=' +str(self._C)
+            s += CPU.ALL_REGISTERS[i] + '=' + str(self.r[i]) + '; '
+        s += 'PC=' + str(self.pc) + '; '
+        s += 'SP=' + str(self.sp) + '; '
+        s += 'Flag_S=' + str(self.flag_S) + '; '
+        s += 'Flag_Z=' + str(self.flag_Z) + '; '
+        s += 'Flag_A=' + str(self.flag_A) + '; '
+        s += 'Flag_P=' + str(self.flag_P) + '; '
+        s += 'Flag_C=' + str(self.flag_C)
         return s
 
 
-
 def main():
     p = CPU(Memory())
+    p.set_trace(tracing.TRACE_STATE)
     print(p)
     
     p.set_register(0b001, 75)
     p.set_register(0b111, 255)
     p.set_register(0b000, 2)
-    p._m[0] = 0x51
-    p.pairs_1[2].value = 0x30
-    print('HL =', p.pairs_1[2].value)
-    p._m[p.pairs_1[2].value] = 6
-    p._m[1] = 0x5E
-    p._m[2] = 0x80
-    p.run()  #MOV D,C; MOV E,M; ADD B
+    program = assembler.assemble('''
+            MOV D, C
+            MOV E, M
+            ADD B
+            HLT
+    VALUE:  DB 6
+    ''')
+    program.load(p._m)
+    p.hl = program.symbols['VALUE']
+    print('HL =', p.hl)
+    p.run()
     print()
 
 if __name__ == '__main__':
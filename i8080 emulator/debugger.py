@@ -0,0 +1,869 @@
+'''
+Отладчик программ i8080.
+Debugger управляет выполнением одного процессора: точки останова (в том числе
+условные), точки наблюдения за чтением и записью памяти, пошаговое выполнение
+(step, next, finish), просмотр и изменение регистров и памяти.
+
+Отладчик подключает к процессору собственную таблицу обработчиков и меняет её
+на месте. Точка останова подменяет только обработчик кода операции, стоящего по
+её адресу, поэтому остальные инструкции выполняются без проверок; без точек
+таблица совпадает с обычной, и выполнение идёт так же быстро, как без отладчика.
+Срабатывание точки наблюдения (и interrupt()) заменяет все обработчики
+останавливающими, и выполнение прекращается перед следующей инструкцией.
+Запись в наблюдаемые страницы отслеживается через Memory.watch_writes(), чтение -
+обёрткой memory.read (Memory.hook_access, как в профилировщике); чтение кода тоже
+считается чтением.
+Трансляция блоков выполняется мимо таблицы обработчиков, поэтому отладчик
+работает с интерпретатором.
+
+GDBServer - сервер протокола удалённой отладки GDB (remote serial protocol) по TCP.
+
+Запуск как программы открывает интерактивный отладчик:
+    python debugger.py program.asm|program.com|image.bin [--gdb PORT]
+'''
+import argparse
+import cmd
+import select
+import socket
+from itertools import islice
+
+from cpu import CPU, RunResult
+from disasm import disassemble, format_line
+from dispatch import StopExecution, STOP_BREAKPOINT, STOP_CYCLES, STOP_INSTRUCTIONS
+from memory import PAGE_SHIFT, PAGE_COUNT
+from opcodes import OPCODES, GROUP_BRANCH
+
+STOP_WATCHPOINT = 'watchpoint'      # Сработала точка наблюдения
+STOP_FINISH = 'finish'              # Выполнен возврат из текущей подпрограммы
+STOP_INTERRUPTED = 'interrupted'    # Выполнение прервано вызовом interrupt()
+
+WATCH_READ = 1
+WATCH_WRITE = 2
+WATCH_ACCESS = WATCH_READ | WATCH_WRITE
+
+REGISTERS = ('a', 'f', 'b', 'c', 'd', 'e', 'h', 'l', 'sp', 'pc')   # Порядок регистров в протоколе GDB
+_INDEX = {name: CPU.ALL_REGISTERS.index(name.upper()) for name in REGISTERS[:8]}
+_RETURNS = [op for op, info in enumerate(OPCODES)
+            if info.group == GROUP_BRANCH and info.mnemonic[0] == 'R' and info.mnemonic not in ('RST',)]
+
+
+class Breakpoint:
+    '''
+    Точка останова.
+    '''
+    __slots__ = ('address', 'condition', 'temporary', 'hits')
+
+    def __init__(self, address, condition=None, temporary=False):
+        '''
+        :param address: Адрес инструкции
+        :param condition: Функция condition(cpu); останов происходит, только если она вернула истину
+        :param temporary: Удалить точку после первого срабатывания
+        '''
+        self.address = address
+        self.condition = condition
+        self.temporary = temporary
+        self.hits = 0
+
+    def __repr__(self):
+        return 'Breakpoint(%04X%s, hits=%d)' % (self.address, ', conditional' if self.condition else '', self.hits)
+
+
+class Watchpoint:
+    '''
+    Точка наблюдения за областью памяти [start, end).
+    '''
+    __slots__ = ('start', 'end', 'kind', 'hits')
+
+    def __init__(self, start, end, kind=WATCH_WRITE):
+        '''
+        :param kind: WATCH_READ, WATCH_WRITE или WATCH_ACCESS
+        '''
+        self.start = start
+        self.end = end
+        self.kind = kind
+        self.hits = 0
+
+    def __contains__(self, addr):
+        return self.start <= addr < self.end
+
+    def pages(self):
+        return range(self.start >> PAGE_SHIFT, ((self.end - 1) >> PAGE_SHIFT) + 1)
+
+    def __repr__(self):
+        kind = {WATCH_READ: 'read', WATCH_WRITE: 'write', WATCH_ACCESS: 'access'}[self.kind]
+        return 'Watchpoint(%04X-%04X, %s, hits=%d)' % (self.start, self.end - 1, kind, self.hits)
+
+
+class Debugger:
+    '''
+    Отладчик одного процессора.
+    '''
+    def __init__(self, cpu, symbols=None):
+        '''
+        :param cpu: Процессор; отладчик подключается к нему сразу
+        :param symbols: Словарь {имя: адрес} (например Program.symbols ассемблера)
+        '''
+        self.cpu = cpu
+        self.symbols = dict(symbols or {})
+        self.breakpoints = {}       # Адрес -> Breakpoint
+        self.watchpoints = []
+        self.stop_info = None       # Причина последней остановки: (STOP_*, Breakpoint/Watchpoint/None, адрес)
+        self._plain = cpu._handlers
+        self._table = list(self._plain)     # Таблица отладчика - внешняя обёртка (CPU.hook_handlers)
+        self._finish_sp = None      # SP, выше которого останавливает finish()
+        self._pending = None        # Остановка, запрошенная во время выполнения
+        self._running = False
+        self._read_pages = bytearray(PAGE_COUNT)
+        self._write_pages = bytearray(PAGE_COUNT)
+        self._watched = False
+        cpu.hook_handlers(self, self._wrap, outermost=True)
+
+    def detach(self):
+        '''
+        Отключает отладчик: процессор возвращается к таблице обработчиков без отладчика
+        '''
+        self.breakpoints.clear()
+        self.watchpoints = []
+        self._update_watch()
+        self.cpu.unhook_handlers(self)
+
+    # Точки останова и наблюдения
+
+    def add_breakpoint(self, address, condition=None, temporary=False):
+        '''
+        Ставит точку останова по адресу address и возвращает Breakpoint
+        '''
+        bp = Breakpoint(address & 0xFFFF, condition, temporary)
+        self.breakpoints[bp.address] = bp
+        self._update_watch()
+        self._update_table()
+        return bp
+
+    def remove_breakpoint(self, address):
+        '''
+        Удаляет точку останова по адресу address; возвращает ложь, если её не было
+        '''
+        if self.breakpoints.pop(address & 0xFFFF, None) is None:
+            return False
+        self._update_watch()
+        self._update_table()
+        return True
+
+    def add_watchpoint(self, start, length=1, kind=WATCH_WRITE):
+        '''
+        Ставит точку наблюдения за length байтами с адреса start и возвращает Watchpoint
+        '''
+        wp = Watchpoint(start & 0xFFFF, min((start & 0xFFFF) + length, 0x10000), kind)
+        self.watchpoints.append(wp)
+        self._update_watch()
+        return wp
+
+    def remove_watchpoint(self, wp):
+        if wp not in self.watchpoints:
+            return False
+        self.watchpoints.remove(wp)
+        self._update_watch()
+        return True
+
+    def condition(self, text):
+        '''
+        Компилирует условие на Python, например 'a == 5 and mem[hl] != 0'.
+        В условии доступны регистры (a, f, b, c, d, e, h, l, bc, de, hl, sp, pc) и память mem.
+        '''
+        code = compile(text, '<condition>', 'eval')
+
+        def check(cpu):
+            names = self.registers()
+            names.update(bc=cpu.bc, de=cpu.de, hl=cpu.hl, mem=cpu._m)
+            return eval(code, {'__builtins__': {}}, names)
+        return check
+
+    def _wrap(self, handlers):
+        '''
+        Таблица отладчика над handlers; вызывается процессором при смене обёрток
+        '''
+        self._plain = handlers
+        self._update_table()
+        return self._table
+
+    def _update_table(self):
+        '''
+        Перестраивает таблицу обработчиков по точкам останова и текущему режиму
+        '''
+        table = self._table
+        if self._pending is not None:
+            table[:] = [self._stop] * 256
+            return
+        table[:] = self._plain
+        m = self.cpu._m
+        for op in set(m[addr] for addr in self.breakpoints):
+            table[op] = self._trap(self._plain[op])
+        if self._finish_sp is not None:
+            for op in _RETURNS:
+                table[op] = self._return_trap(table[op])
+
+    def _trap(self, handler):
+        breakpoints = self.breakpoints
+        debugger = self
+
+        def trap(cpu):
+            bp = breakpoints.get(cpu.pc)
+            if bp is not None and debugger._hit(bp):
+                raise StopExecution(STOP_BREAKPOINT, 0)
+            return handler(cpu)
+        return trap
+
+    def _return_trap(self, handler):
+        debugger = self
+
+        def trap(cpu):
+            cycles = handler(cpu)
+            if cpu.sp > debugger._finish_sp:
+                raise StopExecution(STOP_FINISH, cycles)
+            return cycles
+        return trap
+
+    def _stop(self, cpu):
+        raise StopExecution(self._pending, 0)
+
+    def _hit(self, bp):
+        if bp.condition is not None and not bp.condition(self.cpu):
+            return False
+        bp.hits += 1
+        self.stop_info = (STOP_BREAKPOINT, bp, bp.address)
+        if bp.temporary:
+            del self.breakpoints[bp.address]
+        return True
+
+    def interrupt(self):
+        '''
+        Останавливает выполнение перед следующей инструкцией (можно вызывать из
+        обработчика сигнала, другого потока или устройства)
+        '''
+        self.stop_info = (STOP_INTERRUPTED, None, None)
+        self._pending = STOP_INTERRUPTED
+        self._table[:] = [self._stop] * 256
+
+    def _update_watch(self):
+        '''
+        Перестраивает наблюдение за памятью: страницы кода с точками останова и точки наблюдения
+        '''
+        m = self.cpu._m
+        read_pages = self._read_pages
+        write_pages = self._write_pages
+        read_pages[:] = bytes(PAGE_COUNT)
+        write_pages[:] = bytes(PAGE_COUNT)
+        for wp in self.watchpoints:
+            for page in wp.pages():
+                if wp.kind & WATCH_READ:
+                    read_pages[page] = 1
+                if wp.kind & WATCH_WRITE:
+                    write_pages[page] = 1
+        pages = set(addr >> PAGE_SHIFT for addr in self.breakpoints)
+        pages.update(page for page in range(PAGE_COUNT) if write_pages[page])
+        if self._watched:
+            m.unwatch_writes(self._on_write)
+            self._watched = False
+        if pages:
+            m.watch_writes(pages, self._on_write)
+            self._watched = True
+        if any(read_pages):
+            debugger = self
+
+            def wrap_read(read):
+                def watched_read(addr):
+                    value = read(addr)
+                    if read_pages[addr >> PAGE_SHIFT]:
+                        debugger._on_access(addr, value, WATCH_READ)
+                    return value
+                return watched_read
+            m.hook_access(self, read=wrap_read)
+        else:
+            m.unhook_access(self)
+
+    def _on_write(self, addr):
+        if addr in self.breakpoints:
+            self._update_table()    # Код по адресу точки останова изменился
+        if self._write_pages[addr >> PAGE_SHIFT]:
+            self._on_access(addr, self.cpu._m.dump()[addr], WATCH_WRITE)
+
+    def _on_access(self, addr, value, kind):
+        if not self._running:
+            return
+        for wp in self.watchpoints:
+            if wp.kind & kind and addr in wp:
+                wp.hits += 1
+                self.stop_info = (STOP_WATCHPOINT, wp, addr)
+                self._pending = STOP_WATCHPOINT
+                self._table[:] = [self._stop] * 256
+                return
+
+    # Выполнение
+
+    def _begin(self):
+        if self._pending is not None:   # interrupt() после остановки
+            self._pending = None
+            self._update_table()
+        self.stop_info = None
+
+    def _execute(self, cycles=None, instructions=None):
+        '''
+        Выполняет cpu.run_for(); возвращает (инструкции, такты, причина остановки)
+        '''
+        self._running = True
+        try:
+            result = self.cpu.run_for(cycles=cycles, instructions=instructions)
+        finally:
+            self._running = False
+        n = result.instructions
+        reason = result.reason
+        if reason in (STOP_BREAKPOINT, STOP_WATCHPOINT, STOP_INTERRUPTED):
+            n -= 1      # Останавливающий обработчик не выполнил инструкцию
+        if self._pending is not None:
+            reason = self._pending
+            self._pending = None
+            self._update_table()
+        return n, result.cycles, reason
+
+    def _result(self, n, c, reason):
+        if self.stop_info is None:
+            self.stop_info = (reason, None, None)
+        return RunResult(n, c, reason)
+
+    def _run(self, cycles=None, instructions=None, step_over=True):
+        '''
+        Выполняет программу до остановки. Если step_over истинно, инструкция по текущему
+        адресу выполняется, даже если на нём стоит точка останова.
+        '''
+        cpu = self.cpu
+        self._begin()
+        n = c = 0
+        if step_over and cpu.pc in self.breakpoints:
+            self._table[:] = self._plain
+            try:
+                n, c, reason = self._execute(instructions=1)
+            finally:
+                self._update_table()
+            if reason != STOP_INSTRUCTIONS:
+                return self._result(n, c, reason)
+            if cycles is not None:
+                cycles -= c
+                if cycles <= 0:
+                    return self._result(n, c, STOP_CYCLES)
+            if instructions is not None:
+                instructions -= 1
+                if instructions == 0:
+                    return self._result(n, c, STOP_INSTRUCTIONS)
+        if cycles is None and instructions is None:
+            cycles = float('inf')
+        i, k, reason = self._execute(cycles, instructions)
+        return self._result(n + i, c + k, reason)
+
+    def cont(self, cycles=None):
+        '''
+        Продолжает выполнение до точки останова, точки наблюдения, HLT, interrupt()
+        или исчерпания cycles тактов (если заданы). Возвращает RunResult.
+        '''
+        return self._run(cycles=cycles)
+
+    def step(self, count=1):
+        '''
+        Выполняет count инструкций (точки останова на них не срабатывают)
+        '''
+        self._begin()
+        self._table[:] = self._plain
+        try:
+            n, c, reason = self._execute(instructions=count)
+        finally:
+            self._update_table()
+        return self._result(n, c, reason)
+
+    def next(self):
+        '''
+        Выполняет одну инструкцию; подпрограмму (CALL, RST) выполняет целиком
+        '''
+        cpu = self.cpu
+        info = OPCODES[cpu._m[cpu.pc]]
+        if not (info.group == GROUP_BRANCH and (info.mnemonic == 'RST' or info.mnemonic[0] == 'C')):
+            return self.step()
+        address = (cpu.pc + info.length) & 0xFFFF
+        sp = cpu.sp
+        saved = self.breakpoints.get(address)
+        bp = self.add_breakpoint(address, lambda p: p.sp >= sp, temporary=True)
+        try:
+            result = self._run()
+            if self.stop_info[1] is bp:
+                self.stop_info = (STOP_INSTRUCTIONS, None, None)
+                result.reason = STOP_INSTRUCTIONS
+            return result
+        finally:
+            if saved is not None:
+                self.breakpoints[address] = saved
+            else:
+                self.breakpoints.pop(address, None)
+            self._update_watch()
+            self._update_table()
+
+    def finish(self):
+        '''
+        Выполняет программу до возврата из текущей подпрограммы
+        '''
+        self._finish_sp = self.cpu.sp
+        self._update_table()
+        try:
+            return self._run()
+        finally:
+            self._finish_sp = None
+            self._update_table()
+
+    # Просмотр и изменение состояния
+
+    def registers(self):
+        '''
+        Возвращает словарь значений регистров REGISTERS
+        '''
+        cpu = self.cpu
+        state = {name: cpu.r[_INDEX[name]] for name in REGISTERS[:8]}
+        state['sp'] = cpu.sp
+        state['pc'] = cpu.pc
+        return state
+
+    def set_register(self, name, value):
+        '''
+        Устанавливает регистр name (a, f, b, c, d, e, h, l, bc, de, hl, psw, sp, pc)
+        '''
+        name = name.lower()
+        cpu = self.cpu
+        if name in _INDEX:
+            cpu.r[_INDEX[name]] = value & 0xFF
+        elif name in ('bc', 'de', 'hl', 'psw', 'sp', 'pc'):
+            setattr(cpu, name, value & 0xFFFF)
+        else:
+            raise ValueError('unknown register %s' % name)
+
+    def read_memory(self, address, length):
+        m = self.cpu._m
+        return bytes(m[address + i] for i in range(length))
+
+    def write_memory(self, address, data):
+        m = self.cpu._m
+        for i, value in enumerate(data):
+            m[address + i] = value
+
+    def disassemble(self, address=None, count=8):
+        '''
+        Возвращает count инструкций (DisassembledInstruction) начиная с address (по умолчанию с PC)
+        '''
+        address = self.cpu.pc if address is None else address
+        return list(islice(disassemble(self.cpu._m, address), count))
+
+    def address(self, text):
+        '''
+        Переводит текст в адрес: символ, число (0x1F, 1FH, 31) или выражение ассемблера
+        '''
+        import assembler
+        return assembler.evaluate(text, self.symbols, self.cpu.pc) & 0xFFFF
+
+    def describe(self):
+        '''
+        Возвращает строку с причиной последней остановки и текущей инструкцией
+        '''
+        line = format_line(self.disassemble(count=1)[0])
+        if self.stop_info is None:
+            return line
+        reason, point, addr = self.stop_info
+        if reason == STOP_WATCHPOINT:
+            return 'watchpoint %r at %04X\n%s' % (point, addr, line)
+        if reason == STOP_BREAKPOINT:
+            return 'breakpoint %04X\n%s' % (addr, line)
+        return '%s\n%s' % (reason, line)
+
+
+class GDBServer:
+    '''
+    Сервер протокола удалённой отладки GDB по TCP для отладчика debugger.
+    Регистры передаются в порядке REGISTERS: A, F, B, C, D, E, H, L по байту, SP и PC по два
+    байта (младший первым); описание регистров выдаётся через qXfer:features:read.
+    Поддерживаются пакеты ?, g, G, p, P, m, M, c, s, Z0-Z4, z0-z4, D, k и прерывание (^C).
+    '''
+    SLICE = 100000      # Тактов между проверками прерывания от клиента
+    TARGET_XML = ('<?xml version="1.0"?><!DOCTYPE target SYSTEM "gdb-target.dtd"><target>'
+                  '<feature name="org.i8080.core">' +
+                  ''.join('<reg name="%s" bitsize="8" type="int"/>' % name for name in REGISTERS[:8]) +
+                  '<reg name="sp" bitsize="16" type="data_ptr"/><reg name="pc" bitsize="16" type="code_ptr"/>'
+                  '</feature></target>')
+
+    def __init__(self, debugger, port=1234, host='127.0.0.1'):
+        self.debugger = debugger
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((host, port))
+        self._listener.listen(1)
+        self.port = self._listener.getsockname()[1]
+        self._socket = None
+        self._buffer = b''
+        self._ack = True
+
+    def close(self):
+        self._listener.close()
+
+    def serve(self, once=True):
+        '''
+        Принимает подключения и обслуживает их; если once истинно - только одно
+        '''
+        while True:
+            self._socket, address = self._listener.accept()
+            self._buffer = b''
+            self._ack = True
+            try:
+                self._session()
+            finally:
+                self._socket.close()
+                self._socket = None
+            if once:
+                return
+
+    def _session(self):
+        while True:
+            packet = self._receive()
+            if packet is None:
+                return
+            reply = self._handle(packet)
+            if reply is None:
+                return
+            self._send(reply)
+            if packet == 'QStartNoAckMode':
+                self._ack = False
+
+    def _read(self):
+        data = self._socket.recv(4096)
+        if not data:
+            raise EOFError
+        self._buffer += data
+
+    def _receive(self):
+        '''
+        Возвращает тело следующего пакета (без $ и контрольной суммы) или None при отключении
+        '''
+        try:
+            while True:
+                buffer = self._buffer
+                start = buffer.find(b'$')
+                end = buffer.find(b'#', start)
+                if start >= 0 and end >= 0 and len(buffer) >= end + 3:
+                    body = buffer[start + 1:end]
+                    self._buffer = buffer[end + 3:]
+                    if self._ack:
+                        checksum = int(buffer[end + 1:end + 3], 16)
+                        self._socket.sendall(b'+' if checksum == sum(body) & 0xFF else b'-')
+                        if checksum != sum(body) & 0xFF:
+                            continue
+                    return body.decode('latin-1')
+                if start < 0:
+                    self._buffer = b''
+                self._read()
+        except (EOFError, ConnectionError):
+            return None
+
+    def _send(self, reply):
+        data = reply.encode('latin-1')
+        self._socket.sendall(b'$%s#%02x' % (data, sum(data) & 0xFF))
+        if self._ack:
+            while True:     # Ожидание подтверждения
+                if b'+' in self._buffer:
+                    self._buffer = self._buffer[self._buffer.index(b'+') + 1:]
+                    return
+                self._read()
+
+    def _interrupted(self):
+        '''
+        Проверяет, не прислал ли клиент прерывание (^C)
+        '''
+        if select.select([self._socket], [], [], 0)[0]:
+            self._read()
+        if b'\x03' in self._buffer:
+            self._buffer = self._buffer.replace(b'\x03', b'')
+            return True
+        return False
+
+    def _resume(self, step):
+        debugger = self.debugger
+        if step:
+            debugger.step()
+        else:
+            step_over = True
+            while True:
+                result = debugger._run(cycles=self.SLICE, step_over=step_over)
+                step_over = False
+                if result.reason != STOP_CYCLES:
+                    break
+                if self._interrupted():
+                    return 'S02'
+        reason, point, addr = debugger.stop_info
+        if reason == STOP_WATCHPOINT:
+            name = {WATCH_READ: 'rwatch', WATCH_WRITE: 'watch', WATCH_ACCESS: 'awatch'}[point.kind]
+            return 'T05%s:%04x;' % (name, addr)
+        if reason == STOP_INTERRUPTED:
+            return 'S02'
+        return 'S05'
+
+    def _registers(self):
+        state = self.debugger.registers()
+        return ''.join('%02x' % state[name] for name in REGISTERS[:8]) + \
+            ''.join('%02x%02x' % (state[name] & 0xFF, state[name] >> 8) for name in REGISTERS[8:])
+
+    def _set_registers(self, data):
+        values = bytes.fromhex(data)
+        for i, name in enumerate(REGISTERS[:8]):
+            self.debugger.set_register(name, values[i])
+        self.debugger.set_register('sp', values[8] | values[9] << 8)
+        self.debugger.set_register('pc', values[10] | values[11] << 8)
+
+    def _handle(self, packet):
+        '''
+        Обрабатывает пакет и возвращает ответ ('' - пакет не поддерживается) или None для завершения
+        '''
+        debugger = self.debugger
+        command = packet[:1]
+        args = packet[1:]
+        if command == '?':
+            return 'S05'
+        if command == 'g':
+            return self._registers()
+        if command == 'G':
+            self._set_registers(args)
+            return 'OK'
+        if command == 'p':
+            n = int(args, 16)
+            if n >= len(REGISTERS):
+                return 'E01'
+            return self._registers()[n * 2:n * 2 + 2] if n < 8 else self._registers()[16 + (n - 8) * 4:20 + (n - 8) * 4]
+        if command == 'P':
+            n, value = args.split('=')
+            n = int(n, 16)
+            if n >= len(REGISTERS):
+                return 'E01'
+            data = bytes.fromhex(value)
+            debugger.set_register(REGISTERS[n], data[0] if n < 8 else data[0] | data[1] << 8)
+            return 'OK'
+        if command == 'm':
+            addr, length = (int(v, 16) for v in args.split(','))
+            return debugger.read_memory(addr, length).hex()
+        if command == 'M':
+            location, data = args.split(':')
+            addr, length = (int(v, 16) for v in location.split(','))
+            debugger.write_memory(addr, bytes.fromhex(data)[:length])
+            return 'OK'
+        if command in ('c', 's'):
+            if args:
+                debugger.set_register('pc', int(args, 16))
+            return self._resume(command == 's')
+        if command in ('Z', 'z'):
+            kind, addr, length = args.split(',')[:3]
+            addr = int(addr, 16)
+            if kind in ('0', '1'):
+                if command == 'Z':
+                    debugger.add_breakpoint(addr)
+                else:
+                    debugger.remove_breakpoint(addr)
+                return 'OK'
+            if kind in ('2', '3', '4'):
+                watch = {'2': WATCH_WRITE, '3': WATCH_READ, '4': WATCH_ACCESS}[kind]
+                if command == 'Z':
+                    debugger.add_watchpoint(addr, int(length, 16), watch)
+                else:
+                    for wp in list(debugger.watchpoints):
+                        if wp.start == addr and wp.kind == watch:
+                            debugger.remove_watchpoint(wp)
+                return 'OK'
+            return ''
+        if command == 'D':
+            self._send('OK')
+            return None
+        if command == 'k':
+            return None
+        if command == 'H':
+            return 'OK'
+        if packet.startswith('qSupported'):
+            return 'PacketSize=4000;qXfer:features:read+;QStartNoAckMode+'
+        if packet == 'QStartNoAckMode':
+            return 'OK'
+        if packet.startswith('qXfer:features:read:target.xml:'):
+            offset, length = (int(v, 16) for v in packet.rsplit(':', 1)[1].split(','))
+            chunk = self.TARGET_XML[offset:offset + length]
+            return ('m' if offset + length < len(self.TARGET_XML) else 'l') + chunk
+        if packet == 'qAttached':
+            return '1'
+        if packet == 'qC':
+            return 'QC1'
+        if packet == 'qfThreadInfo':
+            return 'm1'
+        if packet == 'qsThreadInfo':
+            return 'l'
+        return ''
+
+
+class DebuggerShell(cmd.Cmd):
+    '''
+    Интерактивный отладчик с командами в духе GDB.
+    '''
+    intro = 'i8080 debugger. Type help or ? to list commands.'
+    prompt = '(i8080) '
+
+    def __init__(self, debugger):
+        cmd.Cmd.__init__(self)
+        self.debugger = debugger
+
+    def onecmd(self, line):
+        try:
+            return cmd.Cmd.onecmd(self, line)
+        except Exception as e:
+            print('Error: %s' % e)
+
+    def emptyline(self):
+        pass
+
+    def _show(self, result=None):
+        if result is not None:
+            print(result)
+        print(self.debugger.describe())
+
+    def _run(self, action, *args):
+        try:
+            result = action(*args)
+        except KeyboardInterrupt:
+            self.debugger.interrupt()
+            result = None
+        self._show(result)
+
+    def do_break(self, arg):
+        'break ADDR [if CONDITION]: set a breakpoint (condition in Python, e.g. a == 5)'
+        address, _, condition = arg.partition(' if ')
+        d = self.debugger
+        bp = d.add_breakpoint(d.address(address), d.condition(condition) if condition else None)
+        print(bp)
+
+    def do_delete(self, arg):
+        'delete [ADDR]: delete the breakpoint at ADDR or all breakpoints and watchpoints'
+        d = self.debugger
+        if arg:
+            d.remove_breakpoint(d.address(arg))
+            return
+        for addr in list(d.breakpoints):
+            d.remove_breakpoint(addr)
+        for wp in list(d.watchpoints):
+            d.remove_watchpoint(wp)
+
+    def _watch(self, arg, kind):
+        args = arg.split()
+        d = self.debugger
+        print(d.add_watchpoint(d.address(args[0]), d.address(args[1]) if len(args) > 1 else 1, kind))
+
+    def do_watch(self, arg):
+        'watch ADDR [LENGTH]: stop after a write to memory'
+        self._watch(arg, WATCH_WRITE)
+
+    def do_rwatch(self, arg):
+        'rwatch ADDR [LENGTH]: stop after a read from memory'
+        self._watch(arg, WATCH_READ)
+
+    def do_awatch(self, arg):
+        'awatch ADDR [LENGTH]: stop after a read or a write'
+        self._watch(arg, WATCH_ACCESS)
+
+    def do_info(self, arg):
+        'info breakpoints|registers: list breakpoints and watchpoints or show registers'
+        if arg.startswith('r'):
+            return self.do_registers('')
+        for bp in self.debugger.breakpoints.values():
+            print(bp)
+        for wp in self.debugger.watchpoints:
+            print(wp)
+
+    def do_registers(self, arg):
+        'registers: show registers and flags'
+        print(self.debugger.cpu)
+
+    def do_step(self, arg):
+        'step [N]: execute N instructions'
+        self._run(self.debugger.step, int(arg) if arg else 1)
+
+    def do_next(self, arg):
+        'next: execute one instruction, stepping over calls'
+        self._run(self.debugger.next)
+
+    def do_finish(self, arg):
+        'finish: run until the current subroutine returns'
+        self._run(self.debugger.finish)
+
+    def do_continue(self, arg):
+        'continue: run until a breakpoint, a watchpoint or HLT (Ctrl-C interrupts)'
+        self._run(self.debugger.cont)
+
+    def do_x(self, arg):
+        'x ADDR [LENGTH]: dump memory'
+        args = arg.split()
+        d = self.debugger
+        addr = d.address(args[0])
+        data = d.read_memory(addr, d.address(args[1]) if len(args) > 1 else 64)
+        for i in range(0, len(data), 16):
+            print('%04X  %s' % ((addr + i) & 0xFFFF, ' '.join('%02X' % b for b in data[i:i + 16])))
+
+    def do_disassemble(self, arg):
+        'disassemble [ADDR] [COUNT]: list instructions (default: from PC)'
+        args = arg.split()
+        d = self.debugger
+        for instruction in d.disassemble(d.address(args[0]) if args else None,
+                                         int(args[1]) if len(args) > 1 else 8):
+            print(format_line(instruction))
+
+    def do_set(self, arg):
+        'set REGISTER VALUE: change a register (a, b, ..., bc, de, hl, psw, sp, pc)'
+        name, value = arg.split()
+        self.debugger.set_register(name, self.debugger.address(value))
+
+    def do_quit(self, arg):
+        'quit: leave the debugger'
+        return True
+
+    do_b = do_break
+    do_s = do_step
+    do_n = do_next
+    do_c = do_continue
+    do_q = do_quit
+    do_EOF = do_quit
+
+
+def main():
+    import bench
+    parser = argparse.ArgumentParser(description='i8080 debugger')
+    parser.add_argument('path', help='program: assembler source (.asm), CP/M program (.com) or memory image')
+    parser.add_argument('--gdb', type=int, metavar='PORT', help='serve the GDB remote protocol on this port')
+    args = parser.parse_args()
+    symbols = {}
+    if args.path.lower().endswith('.asm'):
+        import assembler
+        from memory import Memory
+        with open(args.path) as f:
+            program = assembler.assemble(f.read())
+        m = Memory()
+        program.load(m)
+        p = CPU(m)
+        p.pc = program.entry
+        symbols = program.symbols
+    else:
+        p = bench.load_workload(args.path).cpu()
+    debugger = Debugger(p, symbols)
+    if args.gdb is not None:
+        server = GDBServer(debugger, args.gdb)
+        print('Waiting for GDB on port %d' % server.port)
+        try:
+            server.serve()
+        finally:
+            server.close()
+        return
+    DebuggerShell(debugger).cmdloop()
+
+
+if __name__ == '__main__':
+    main()
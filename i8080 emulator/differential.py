@@ -0,0 +1,367 @@
+'''
+Дифференциальное тестирование уровней выполнения.
+Проверяемый уровень (по умолчанию translator.BlockCache) выполняется в ногу с
+эталоном - интерпретатором CPU.run_for() или записанной трассой (recording) -
+пачками по interval инструкций. После каждой пачки сравнивается полное состояние:
+регистры, SP, PC, счётчик тактов, признаки HLT и INTE и вся память (для трассы -
+поля записи). При расхождении выполнение повторяется от последней совпавшей
+контрольной точки с делением пополам, пока не будет найдена первая неверно
+выполненная инструкция; отчёт (Divergence) содержит эту инструкцию и
+отличающиеся регистры и адреса памяти.
+
+Уровень и эталон выполняются на копиях процессора (CPU.fork()), исходный
+процессор не меняется. Порты ввода-вывода у копий общие, поэтому программа
+должна быть детерминированной: устройства с побочными эффектами сработают
+на каждой копии. Транслятор выполняет блок, только если он целиком помещается в
+бюджет инструкций, поэтому ошибка внутри блока видна только в конце блока;
+чтобы найти саму инструкцию, уровень запускается с инструкций внутри блока.
+
+Запуск как программы сравнивает интерпретатор и трансляцию блоков на встроенных
+нагрузках bench или на файлах программ:
+    python differential.py [program.com ...] [--instructions N] [--interval N] [--trace file]
+'''
+import argparse
+import sys
+
+from dispatch import STOP_INSTRUCTIONS
+from disasm import disassemble
+from memory import PAGE_SHIFT, PAGE_SIZE, PAGE_COUNT
+
+DEFAULT_INTERVAL = 1000             # Инструкций между сравнениями
+DEFAULT_INSTRUCTIONS = 1000000      # Инструкций на одну проверку
+REGISTERS = ('b', 'c', 'd', 'e', 'h', 'l', 'f', 'a')    # Порядок CPU.r
+STATE_FIELDS = REGISTERS + ('sp', 'pc', 'cycles', 'halted', 'inte')
+MAX_ADDRESSES = 16                  # Отличающихся адресов памяти в отчёте
+
+
+def state_of(cpu):
+    '''
+    Возвращает состояние процессора cpu (без памяти) в виде словаря полей STATE_FIELDS
+    '''
+    state = dict(zip(REGISTERS, cpu.r))
+    state['sp'] = cpu.sp
+    state['pc'] = cpu.pc
+    state['cycles'] = cpu.cycles
+    state['halted'] = cpu.halted
+    state['inte'] = cpu.inte
+    return state
+
+
+def state_of_record(record, next_record=None):
+    '''
+    Возвращает ожидаемое состояние после инструкции из записи трассы record.
+    PC берётся из следующей записи next_record, если она есть.
+    '''
+    state = {'b': record.bc >> 8, 'c': record.bc & 0xFF, 'd': record.de >> 8, 'e': record.de & 0xFF,
+             'h': record.hl >> 8, 'l': record.hl & 0xFF, 'f': record.f, 'a': record.a,
+             'sp': record.sp, 'cycles': record.cycles}
+    if next_record is not None:
+        state['pc'] = next_record.pc
+    return state
+
+
+def memory_differences(a, b):
+    '''
+    Возвращает список адресов, по которым различаются памяти a и b (не более MAX_ADDRESSES)
+    '''
+    x = bytes(a.dump())
+    y = bytes(b.dump())
+    if x == y:
+        return []
+    addresses = []
+    for page in range(PAGE_COUNT):
+        s = page << PAGE_SHIFT
+        if x[s:s + PAGE_SIZE] == y[s:s + PAGE_SIZE]:
+            continue
+        for addr in range(s, s + PAGE_SIZE):
+            if x[addr] != y[addr]:
+                addresses.append(addr)
+                if len(addresses) >= MAX_ADDRESSES:
+                    return addresses
+    return addresses
+
+
+class Divergence:
+    '''
+    Первое расхождение проверяемого уровня с эталоном.
+    '''
+    __slots__ = ('index', 'observed', 'pc', 'opcode', 'text', 'fields', 'expected', 'actual', 'memory')
+
+    def __init__(self, index, observed, pc, opcode, text, fields, expected, actual, memory):
+        '''
+        :param index: Номер первой неверно выполненной инструкции (с нуля от начала проверки)
+        :param observed: Число инструкций от начала проверки, после которого сравнивались состояния
+                         (index + 1 или конец блока, в котором выполнялась инструкция)
+        :param pc: Адрес этой инструкции
+        :param opcode: Код операции
+        :param text: Текст инструкции
+        :param fields: Список отличающихся полей состояния (STATE_FIELDS и 'memory')
+        :param expected: Состояние эталона (словарь)
+        :param actual: Состояние проверяемого уровня (словарь)
+        :param memory: Список (адрес, байт эталона, байт уровня) отличающихся ячеек памяти
+        '''
+        self.index = index
+        self.observed = observed
+        self.pc = pc
+        self.opcode = opcode
+        self.text = text
+        self.fields = fields
+        self.expected = expected
+        self.actual = actual
+        self.memory = memory
+
+    def __str__(self):
+        lines = ['first divergence at instruction %d: %04X  %s' % (self.index, self.pc, self.text)]
+        if self.observed != self.index + 1:
+            lines.append('  state compared after instruction %d' % (self.observed - 1))
+        for name in self.fields:
+            if name != 'memory':
+                lines.append('  %-6s expected %s, got %s' % (name.upper(), _format(name, self.expected[name]),
+                                                            _format(name, self.actual[name])))
+        for addr, expected, actual in self.memory:
+            lines.append('  [%04X] expected %02X, got %02X' % (addr, expected, actual))
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return 'Divergence(index=%d, pc=%04X, fields=%r)' % (self.index, self.pc, self.fields)
+
+
+def _format(name, value):
+    if name in REGISTERS:
+        return '%02X' % value
+    if name in ('sp', 'pc'):
+        return '%04X' % value
+    return str(value)
+
+
+def _compare(expected, actual):
+    '''
+    Возвращает список полей expected, отличающихся в actual
+    '''
+    return [name for name in expected if expected[name] != actual[name]]
+
+
+def _interpreter(cpu):
+    return cpu
+
+
+def _default_tier(cpu):
+    from translator import BlockCache
+    return BlockCache(cpu)
+
+
+def _advance(checkpoint, factory, count):
+    '''
+    Выполняет count инструкций на копии checkpoint уровнем factory.
+    Возвращает (копия процессора, RunResult).
+    '''
+    p = checkpoint.fork()
+    if count == 0:
+        return p, None
+    return p, factory(p).run_for(instructions=count)
+
+
+def _instruction(cpu):
+    '''
+    Возвращает (адрес, код операции, текст) инструкции по адресу cpu.pc
+    '''
+    instruction = next(disassemble(cpu._m, cpu.pc, cpu.pc + 1))
+    return cpu.pc, instruction.code[0], instruction.text()
+
+
+class _Reference:
+    '''
+    Эталон - выполнение другим уровнем (по умолчанию интерпретатором)
+    '''
+    compares_memory = True
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def start(self, cpu):
+        self.cpu = cpu.fork()
+        self.runner = self.factory(self.cpu)
+
+    def run(self, count):
+        '''
+        Выполняет count инструкций эталона. Если эталон остановился раньше (HLT),
+        возвращает число выполненных инструкций, иначе None
+        '''
+        result = self.runner.run_for(instructions=count)
+        return result.instructions if result.reason != STOP_INSTRUCTIONS else None
+
+    def state(self):
+        return state_of(self.cpu)
+
+    def state_at(self, checkpoint, done, count):
+        p, result = _advance(checkpoint, self.factory, count)
+        return state_of(p), p
+
+
+class _TraceReference:
+    '''
+    Эталон - записанная трасса: последовательность recording.TraceRecord
+    '''
+    compares_memory = False
+
+    def __init__(self, trace):
+        self.trace = trace
+        self.done = 0
+
+    def start(self, cpu):
+        self.done = 0
+
+    def run(self, count):
+        available = len(self.trace) - self.done
+        self.done += min(count, available)
+        return available if available < count else None
+
+    def state(self):
+        return self._state(self.done)
+
+    def _state(self, done):
+        trace = self.trace
+        return state_of_record(trace[done - 1], trace[done] if done < len(trace) else None)
+
+    def state_at(self, checkpoint, done, count):
+        return self._state(done + count), None
+
+
+def _diverges(reference, checkpoint, tier, done, count, start=0):
+    '''
+    Выполняет уровнем tier count инструкций от контрольной точки (если start > 0 - сначала
+    start инструкций, затем остальные новым запуском уровня) и возвращает
+    (отличающиеся поля, отличающиеся адреса, состояние эталона, процессор эталона, процессор уровня)
+    '''
+    expected, p = reference.state_at(checkpoint, done, count)
+    if start:
+        actual, result = _advance(checkpoint, tier, start)
+        actual, result = _advance(actual, tier, count - start)
+    else:
+        actual, result = _advance(checkpoint, tier, count)
+    fields = _compare(expected, state_of(actual))
+    addresses = memory_differences(p._m, actual._m) if p is not None else []
+    return fields, addresses, expected, p, actual
+
+
+def _report(reference, checkpoint, tier, done, count):
+    '''
+    Находит первую инструкцию окна [done, done + count), на которой состояние уровня tier
+    расходится с эталоном, и строит Divergence.
+    Сначала делением пополам ищется наименьшее число инструкций high, после которого
+    состояния различаются. Уровень может выполнять инструкции группами (блоками),
+    поэтому затем ищется последняя инструкция перед high, при запуске уровня с которой
+    (от совпадающего состояния) расхождение ещё воспроизводится.
+    '''
+    low = 0         # После low инструкций от контрольной точки состояния совпадают
+    high = count    # После high - различаются
+    while high - low > 1:
+        middle = (low + high) // 2
+        fields, addresses, expected, p, actual = _diverges(reference, checkpoint, tier, done, middle)
+        if fields or addresses:
+            high = middle
+        else:
+            low = middle
+    first = 0       # Запуск уровня с инструкции first воспроизводит расхождение
+    last = high     # Запуск с инструкции last - нет
+    while last - first > 1:
+        middle = (first + last) // 2
+        fields, addresses, expected, p, actual = _diverges(reference, checkpoint, tier, done, high, middle)
+        if fields or addresses:
+            first = middle
+        else:
+            last = middle
+    fields, addresses, expected, p, actual = _diverges(reference, checkpoint, tier, done, high)
+    actual_state = state_of(actual)
+    memory = [(addr, p._m[addr], actual._m[addr]) for addr in addresses]
+    if memory:
+        fields.append('memory')
+    before, result = _advance(checkpoint, tier, first)
+    pc, opcode, text = _instruction(before)
+    return Divergence(done + first, done + high, pc, opcode, text, fields,
+                      dict((name, expected[name]) for name in fields if name != 'memory'),
+                      dict((name, actual_state[name]) for name in fields if name != 'memory'), memory)
+
+
+def _lockstep(cpu, reference, tier, instructions, interval):
+    tier = _default_tier if tier is None else tier
+    checkpoint = cpu.fork()
+    reference.start(cpu)
+    p = cpu.fork()
+    runner = tier(p)
+    done = 0
+    while done < instructions:
+        count = min(interval, instructions - done)
+        stopped = reference.run(count)
+        if stopped is not None:
+            count = stopped
+        if count == 0:
+            break
+        runner.run_for(instructions=count)
+        different = _compare(reference.state(), state_of(p))
+        if not different and reference.compares_memory:
+            different = memory_differences(reference.cpu._m, p._m)
+        if different:
+            return _report(reference, checkpoint, tier, done, count)
+        done += count
+        if stopped is not None:
+            break
+        checkpoint = p.fork()
+    return None
+
+
+def run_lockstep(cpu, tier=None, reference=None, instructions=DEFAULT_INSTRUCTIONS, interval=DEFAULT_INTERVAL):
+    '''
+    Выполняет instructions инструкций от состояния cpu уровнем tier и эталонным
+    уровнем reference, сравнивая полное состояние и память каждые interval инструкций.
+    tier и reference - функции factory(cpu), возвращающие объект с методом run_for()
+    (например translator.BlockCache); по умолчанию tier - трансляция блоков,
+    reference - интерпретатор. Проверка заканчивается раньше, если эталон остановился (HLT).
+    Возвращает None, если расхождений нет, иначе Divergence.
+    '''
+    return _lockstep(cpu, _Reference(_interpreter if reference is None else reference), tier,
+                     instructions, interval)
+
+
+def check_trace(cpu, trace, tier=None, interval=DEFAULT_INTERVAL):
+    '''
+    Выполняет программу от состояния cpu уровнем tier (по умолчанию - интерпретатором)
+    и сравнивает её с трассой trace (recording.TraceReader или список TraceRecord),
+    записанной от того же состояния, каждые interval инструкций.
+    Память в трассе не записывается, поэтому сравниваются регистры, SP, PC и такты.
+    Возвращает None, если расхождений нет, иначе Divergence.
+    '''
+    return _lockstep(cpu, _TraceReference(trace), _interpreter if tier is None else tier,
+                     len(trace), interval)
+
+
+def main():
+    import bench
+    parser = argparse.ArgumentParser(description='Run the interpreter and translated blocks in lockstep')
+    parser.add_argument('paths', nargs='*', help='programs to check (default: built-in bench workloads)')
+    parser.add_argument('--instructions', type=int, default=DEFAULT_INSTRUCTIONS, help='instructions per program')
+    parser.add_argument('--interval', type=int, default=DEFAULT_INTERVAL, help='instructions between comparisons')
+    parser.add_argument('--trace', help='compare one program with a recorded trace instead')
+    args = parser.parse_args()
+    workloads = bench.find_workloads(args.paths) if args.paths else \
+        bench.BUILTIN_WORKLOADS + list(bench.GROUP_WORKLOADS.values())
+    failed = 0
+    for workload in workloads:
+        if args.trace:
+            from recording import TraceReader
+            trace = TraceReader.open(args.trace)
+            divergence = check_trace(workload.cpu(), trace, interval=args.interval)
+        else:
+            divergence = run_lockstep(workload.cpu(), instructions=args.instructions, interval=args.interval)
+        if divergence is None:
+            print('%-20s ok' % workload.name)
+        else:
+            failed += 1
+            print('%-20s FAILED\n%s' % (workload.name, divergence))
+        if args.trace:
+            break
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
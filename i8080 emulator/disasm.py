@@ -0,0 +1,151 @@
+'''
+Дизассемблер i8080.
+Последовательно (linear sweep) декодирует буфер байтов или память Memory
+и выдаёт генератором записи DisassembledInstruction: адрес, байты, мнемонику,
+операнды, длину и время выполнения. Мнемоники, длины и такты берутся из той же
+таблицы opcodes.OPCODES, по которой работает процессор.
+
+Запуск как программы печатает листинг файла:
+    python disasm.py rom.bin [--origin 0x100] [--start 0x100] [--end 0x200]
+'''
+import argparse
+import time
+
+from memory import Memory, MEMORY_SIZE
+from opcodes import OPCODES, D8, D16, A16, hex_number
+
+_HEX8 = [hex_number(v, 2) for v in range(256)]
+
+
+class DisassembledInstruction:
+    '''
+    Одна дизассемблированная инструкция.
+    '''
+    __slots__ = ('address', 'code', 'mnemonic', 'operands', 'length', 'cycles')
+
+    def __init__(self, address, code, mnemonic, operands, length, cycles):
+        '''
+        :param address: Адрес инструкции
+        :param code: Байты инструкции (bytes)
+        :param mnemonic: Мнемоника
+        :param operands: Кортеж операндов в виде строк
+        :param length: Длина в байтах
+        :param cycles: Время выполнения в тактах (для условных CALL и RET - при невыполненном условии)
+        '''
+        self.address = address
+        self.code = code
+        self.mnemonic = mnemonic
+        self.operands = operands
+        self.length = length
+        self.cycles = cycles
+
+    def text(self):
+        '''
+        Возвращает инструкцию в виде текста, например 'MVI A, 0FFH'
+        '''
+        if not self.operands:
+            return self.mnemonic
+        return '%s %s' % (self.mnemonic, ', '.join(self.operands))
+
+    def __iter__(self):
+        return iter((self.address, self.code, self.mnemonic, self.operands, self.length, self.cycles))
+
+    def __repr__(self):
+        return 'DisassembledInstruction(%s, %r)' % (hex(self.address), self.text())
+
+
+def _entry(info):
+    '''
+    Готовит описание кода операции для быстрого декодирования:
+    (мнемоника, операнды, длина, такты, номер операнда с данными или -1)
+    '''
+    data = -1
+    for i, o in enumerate(info.operands):
+        if o in (D8, D16, A16):
+            data = i
+    return info.mnemonic, info.operands, info.length, info.cycles, data
+
+
+_ENTRIES = [_entry(info) for info in OPCODES]
+
+
+def disassemble(source, start=0, end=None, origin=0):
+    '''
+    Генератор записей DisassembledInstruction.
+    source - Memory или буфер байтов (bytes, bytearray, memoryview).
+    Для Memory start и end - адреса; инструкция, выходящая за 0xFFFF, продолжается
+    с начала памяти, как у процессора. Память читается напрямую, минуя карту страниц.
+    Для буфера start и end - смещения, а адрес инструкции равен origin + смещение;
+    неполная инструкция в конце буфера выдаётся как DB.
+    '''
+    if isinstance(source, Memory):
+        data = bytes(source.dump())
+        data += data[:2]
+        size = MEMORY_SIZE
+        origin = 0
+    else:
+        data = bytes(source)
+        size = len(data)
+    if end is None or end > size:
+        end = size
+    entries = _ENTRIES
+    hex8 = _HEX8
+    offset = start
+    while offset < end:
+        mnemonic, operands, length, cycles, arg = entries[data[offset]]
+        code = data[offset:offset + length]
+        if len(code) < length:
+            yield DisassembledInstruction((origin + offset) & 0xFFFF, code, 'DB',
+                                          tuple(hex8[b] for b in code), len(code), 0)
+            return
+        if arg >= 0:
+            operands = list(operands)
+            if length == 2:
+                operands[arg] = hex8[code[1]]
+            else:
+                operands[arg] = hex_number(code[1] | code[2] << 8, 4)
+            operands = tuple(operands)
+        yield DisassembledInstruction((origin + offset) & 0xFFFF, code, mnemonic, operands, length, cycles)
+        offset += length
+
+
+def format_line(instruction):
+    '''
+    Возвращает строку листинга: адрес, байты и текст инструкции
+    '''
+    return '%04X  %-8s  %s' % (instruction.address, ' '.join('%02X' % b for b in instruction.code),
+                               instruction.text())
+
+
+def listing(source, start=0, end=None, origin=0):
+    '''
+    Генератор строк листинга (см. disassemble() и format_line())
+    '''
+    for instruction in disassemble(source, start, end, origin):
+        yield format_line(instruction)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='i8080 disassembler')
+    parser.add_argument('path', nargs='?', help='binary image to list (without it, a timing demo is run)')
+    parser.add_argument('--origin', type=lambda v: int(v, 0), default=0, help='address of the first byte of the image')
+    parser.add_argument('--start', type=lambda v: int(v, 0), default=None, help='first address to list')
+    parser.add_argument('--end', type=lambda v: int(v, 0), default=None, help='address to stop at')
+    args = parser.parse_args()
+    if args.path is None:
+        import random
+        m = Memory(bytes(random.randrange(256) for i in range(MEMORY_SIZE)))
+        t = time.perf_counter()
+        count = sum(1 for i in disassemble(m))
+        print('%d instructions from 64 KB in %.3f s' % (count, time.perf_counter() - t))
+        return
+    with open(args.path, 'rb') as f:
+        image = f.read()
+    start = 0 if args.start is None else args.start - args.origin
+    end = None if args.end is None else args.end - args.origin
+    for line in listing(image, start, end, args.origin):
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+'''
+Таблица диспетчеризации инструкций.
+Для каждого из 256 кодов операций один раз, при запуске, генерируется
+специализированная функция-обработчик: номера регистров, длина и время
+выполнения подставляются в её текст как константы, поэтому во время
+работы не нужны ни разбор опкода, ни создание объектов.
+
+Обработчик вызывается как handler(cpu), выполняет инструкцию, начинающуюся
+по адресу PC, сам продвигает PC и возвращает число затраченных тактов.
+Таблица не зависит от конкретного процессора и общая для всех объектов CPU.
+'''
+import re
+
+import flags
+from opcodes import OPCODES, split_opcode
+
+STOP_CYCLES = 'cycles'              # Исчерпан бюджет тактов
+STOP_INSTRUCTIONS = 'instructions'  # Исчерпан бюджет инструкций
+STOP_PREDICATE = 'predicate'        # Выполнилось условие остановки
+STOP_BREAKPOINT = 'breakpoint'      # PC достиг точки останова
+STOP_HALT = 'halt'                  # Выполнена инструкция HLT
+STOP_WAIT = 'wait'                  # Устройство ввода не готово, IN не выполнена
+
+
+class StopExecution(Exception):
+    '''
+    Выбрасывается обработчиком инструкции, после которой выполнение должно остановиться.
+    PC к этому моменту уже указывает на следующую инструкцию.
+    Исключение - STOP_WAIT: его выбрасывает port_in() неготового устройства, инструкция
+    IN не выполняется и не учитывается, PC указывает на неё саму, cycles равно 0.
+    '''
+    def __init__(self, reason, cycles):
+        '''
+        :param reason: Причина остановки (одна из констант STOP_*)
+        :param cycles: Такты, затраченные обработчиком (или блоком) вместе с остановившей инструкцией
+        '''
+        Exception.__init__(self, reason, cycles)
+        self.reason = reason
+        self.cycles = cycles
+
+
+def _reg(r):
+    '''
+    Выражение для чтения регистра с индексом r (0b110 - ячейка памяти по адресу HL)
+    '''
+    if r == 0b110:
+        return 'm.read(%s)' % _pair(2)
+    return 'r[%d]' % r
+
+
+def _pair(dd):
+    '''
+    Выражение для чтения регистровой пары с индексом dd (первый тип)
+    '''
+    if dd == 0b11:
+        return 'cpu.sp'
+    return '(r[%d] << 8 | r[%d])' % (dd * 2, dd * 2 + 1)
+
+
+def _set_reg(r, v):
+    '''
+    Оператор записи значения v (байта) в регистр с индексом r
+    '''
+    if r == 0b110:
+        return 'm.write(%s, %s)' % (_pair(2), v)
+    return '%s = %s' % (_reg(r), v)
+
+
+def _set_pair(dd, v):
+    '''
+    Операторы записи значения v (16-битного числа) в регистровую пару с индексом dd
+    '''
+    if dd == 0b11:
+        return 'cpu.sp = %s' % v
+    return 'w = %s\nr[%d] = w >> 8\nr[%d] = w & 0xFF' % (v, dd * 2, dd * 2 + 1)
+
+
+def _alu(yyy, operand):
+    '''
+    Операторы арифметико-логической операции с номером yyy (ADD, ADC, SUB, SBB, ANA, XRA, ORA, CMP)
+    над A и operand. Флаги устанавливаются одним обращением к таблице из flags.
+    '''
+    lines = ['a = r[7]', 'b = %s' % operand]
+    if yyy == 0b000:
+        lines += ['r[7] = (a + b) & 0xFF', 'r[6] = ADD_FLAGS[a << 8 | b]']
+    elif yyy == 0b001:
+        lines += ['c = r[6] & 1', 'r[7] = (a + b + c) & 0xFF', 'r[6] = ADD_FLAGS[c << 16 | a << 8 | b]']
+    elif yyy == 0b010:
+        lines += ['r[7] = (a - b) & 0xFF', 'r[6] = SUB_FLAGS[a << 8 | b]']
+    elif yyy == 0b011:
+        lines += ['c = r[6] & 1', 'r[7] = (a - b - c) & 0xFF', 'r[6] = SUB_FLAGS[c << 16 | a << 8 | b]']
+    elif yyy == 0b100:
+        lines += ['r[7] = a & b', 'r[6] = AND_FLAGS[a << 8 | b]']
+    elif yyy == 0b101:
+        lines += ['t = a ^ b', 'r[7] = t', 'r[6] = SZP[t]']
+    elif yyy == 0b110:
+        lines += ['t = a | b', 'r[7] = t', 'r[6] = SZP[t]']
+    else:
+        lines += ['r[6] = SUB_FLAGS[a << 8 | b]']
+    return lines
+
+
+_CONDITIONS = ['not r[6] & 0x40', 'r[6] & 0x40', 'not r[6] & 0x01', 'r[6] & 0x01',
+               'not r[6] & 0x04', 'r[6] & 0x04', 'not r[6] & 0x80', 'r[6] & 0x80']   # NZ, Z, NC, C, PO, PE, P, M
+
+
+def _push(v):
+    '''
+    Операторы помещения 16-битного значения v в стек
+    '''
+    return ['v = %s' % v,
+            's = (cpu.sp - 2) & 0xFFFF',
+            'cpu.sp = s',
+            'm.write((s + 1) & 0xFFFF, v >> 8)',
+            'm.write(s, v & 0xFF)']
+
+
+def _pop():
+    '''
+    Операторы извлечения 16-битного значения из стека в переменную v
+    '''
+    return ['s = cpu.sp',
+            'v = m.read(s) | m.read((s + 1) & 0xFFFF) << 8',
+            'cpu.sp = (s + 2) & 0xFFFF']
+
+
+def _indent(lines):
+    return ['    ' + line for line in lines]
+
+
+def _semantics(op):
+    '''
+    Возвращает описание работы инструкции с кодом op в виде пары (lines, jumps):
+    lines - список строк на Python с подстановками {d8}, {d16}, {next}, {base};
+    jumps - True, если инструкция сама устанавливает PC. Такая инструкция завершает блок;
+    если её время выполнения зависит от условия, она может вернуть {base} + такты сама,
+    иначе время берётся из таблицы кодов операций.
+    '''
+    xx, yyy, zzz = split_opcode(op)
+    if xx == 0b00:
+        if zzz == 0b000:  #Инструкция NOP (и недокументированные дубли)
+            return [], False
+        if zzz == 0b001:
+            if yyy & 1 == 0:  #Инструкция LXI
+                return [_set_pair(yyy >> 1, '{d16}')], False
+            return ['t = %s + %s' % (_pair(2), _pair(yyy >> 1)),  #Инструкция DAD
+                    _set_pair(2, 't & 0xFFFF'),
+                    'r[6] = r[6] & 0b11111110 | t >> 16'], False
+        if zzz == 0b010:
+            if yyy == 0b000 or yyy == 0b010:  #Инструкция STAX
+                return ['m.write(%s, %s)' % (_pair(yyy >> 1), _reg(7))], False
+            if yyy == 0b001 or yyy == 0b011:  #Инструкция LDAX
+                return [_set_reg(7, 'm.read(%s)' % _pair(yyy >> 1))], False
+            if yyy == 0b100:  #Инструкция SHLD
+                return ['a = {d16}', 'm.write(a, %s)' % _reg(5), 'm.write((a + 1) & 0xFFFF, %s)' % _reg(4)], False
+            if yyy == 0b101:  #Инструкция LHLD
+                return ['a = {d16}', _set_reg(5, 'm.read(a)'), _set_reg(4, 'm.read((a + 1) & 0xFFFF)')], False
+            if yyy == 0b110:  #Инструкция STA
+                return ['m.write({d16}, %s)' % _reg(7)], False
+            return [_set_reg(7, 'm.read({d16})')], False  #Инструкция LDA
+        if zzz == 0b011:  #Инструкции INX, DCX
+            return [_set_pair(yyy >> 1, '(%s %s 1) & 0xFFFF' % (_pair(yyy >> 1), '-' if yyy & 1 else '+'))], False
+        if zzz == 0b100:  #Инструкция INR
+            return ['t = (%s + 1) & 0xFF' % _reg(yyy), _set_reg(yyy, 't'),
+                    'r[6] = r[6] & 1 | INR_FLAGS[t]'], False
+        if zzz == 0b101:  #Инструкция DCR
+            return ['t = (%s - 1) & 0xFF' % _reg(yyy), _set_reg(yyy, 't'),
+                    'r[6] = r[6] & 1 | DCR_FLAGS[t]'], False
+        if zzz == 0b110:  #Инструкция MVI
+            return [_set_reg(yyy, '{d8}')], False
+        if yyy == 0b000:  #Инструкция RLC
+            return ['a = r[7]', 'c = a >> 7', 'r[7] = (a << 1 | c) & 0xFF', 'r[6] = r[6] & 0b11111110 | c'], False
+        if yyy == 0b001:  #Инструкция RRC
+            return ['a = r[7]', 'c = a & 1', 'r[7] = a >> 1 | c << 7', 'r[6] = r[6] & 0b11111110 | c'], False
+        if yyy == 0b010:  #Инструкция RAL
+            return ['a = r[7]', 'r[7] = (a << 1 | r[6] & 1) & 0xFF', 'r[6] = r[6] & 0b11111110 | a >> 7'], False
+        if yyy == 0b011:  #Инструкция RAR
+            return ['a = r[7]', 'r[7] = a >> 1 | (r[6] & 1) << 7', 'r[6] = r[6] & 0b11111110 | a & 1'], False
+        if yyy == 0b100:  #Инструкция DAA
+            return ['t = DAA_TABLE[r[7] | (r[6] & 1) << 8 | (r[6] & 0x10) << 5]',
+                    'r[7] = t >> 8', 'r[6] = t & 0xFF'], False
+        if yyy == 0b101:  #Инструкция CMA
+            return ['r[7] ^= 0xFF'], False
+        if yyy == 0b110:  #Инструкция STC
+            return ['r[6] |= 1'], False
+        return ['r[6] ^= 1'], False  #Инструкция CMC
+    if xx == 0b01:
+        if op == 0x76:  #Инструкция HLT
+            return ['cpu.pc = {next}', 'cpu.halted = True',
+                    'raise StopExecution(STOP_HALT, {base} + %d)' % OPCODES[op].cycles], True
+        return [_set_reg(yyy, _reg(zzz))], False  #Инструкция MOV
+    if xx == 0b10:  #Инструкции ADD, ADC, SUB, SBB, ANA, XRA, ORA, CMP
+        return _alu(yyy, _reg(zzz)), False
+    if zzz == 0b000:  #Инструкции Rcc
+        return (['if %s:' % _CONDITIONS[yyy]] +
+                _indent(_pop() + ['cpu.pc = v', 'return {base} + %d' % OPCODES[op].cycles_taken]) +
+                ['cpu.pc = {next}']), True
+    if zzz == 0b001:
+        if yyy & 1 == 0:  #Инструкция POP
+            if yyy == 0b110:
+                return _pop() + ['r[7] = v >> 8', 'r[6] = v & 0b11010111 | 0b00000010'], False
+            return _pop() + [_set_pair(yyy >> 1, 'v')], False
+        if yyy == 0b001 or yyy == 0b011:  #Инструкция RET
+            return _pop() + ['cpu.pc = v'], True
+        if yyy == 0b101:  #Инструкция PCHL
+            return ['cpu.pc = %s' % _pair(2)], True
+        return [_set_pair(3, _pair(2))], False  #Инструкция SPHL
+    if zzz == 0b010:  #Инструкции Jcc
+        return ['cpu.pc = {d16} if %s else {next}' % _CONDITIONS[yyy]], True
+    if zzz == 0b011:
+        if yyy <= 0b001:  #Инструкция JMP
+            return ['cpu.pc = {d16}'], True
+        if yyy == 0b010:  #Инструкция OUT
+            return ['cpu.pc = {next}', 'cpu.port_out({d8}, r[7])'], True
+        if yyy == 0b011:  #Инструкция IN
+            return ['cpu.pc = {next}', 'r[7] = cpu.port_in({d8}) & 0xFF'], True
+        if yyy == 0b100:  #Инструкция XTHL
+            return ['s = cpu.sp',
+                    'v = m.read(s) | m.read((s + 1) & 0xFFFF) << 8',
+                    'm.write(s, r[5])',
+                    'm.write((s + 1) & 0xFFFF, r[4])',
+                    'r[4] = v >> 8',
+                    'r[5] = v & 0xFF'], False
+        if yyy == 0b101:  #Инструкция XCHG
+            return ['t = %s' % _pair(1), _set_pair(1, _pair(2)), _set_pair(2, 't')], False
+        if yyy == 0b110:  #Инструкция DI
+            return ['cpu.pc = {next}', 'cpu.inte = 0'], True
+        return ['cpu.pc = {next}', 'cpu.inte = 1', 'cpu._ei_pc = {next}'], True  #Инструкция EI
+    if zzz == 0b100:  #Инструкции Ccc
+        return (['if %s:' % _CONDITIONS[yyy]] +
+                _indent(_push('{next}') + ['cpu.pc = {d16}', 'return {base} + %d' % OPCODES[op].cycles_taken]) +
+                ['cpu.pc = {next}']), True
+    if zzz == 0b101:
+        if yyy & 1 == 0:  #Инструкция PUSH
+            if yyy == 0b110:
+                return _push('r[7] << 8 | r[6]'), False
+            return _push(_pair(yyy >> 1)), False
+        return _push('{next}') + ['cpu.pc = {d16}'], True  #Инструкция CALL
+    if zzz == 0b110:  #Инструкции ADI, ACI, SUI, SBI, ANI, XRI, ORI, CPI
+        return _alu(yyy, '{d8}'), False
+    return _push('{next}') + ['cpu.pc = 0x%04X' % (yyy * 8)], True  #Инструкция RST
+
+
+ENV = {'StopExecution': StopExecution, 'STOP_HALT': STOP_HALT,      # Глобальные имена сгенерированного кода
+       'SZP': flags.SZP, 'ADD_FLAGS': flags.ADD_FLAGS, 'SUB_FLAGS': flags.SUB_FLAGS, 'AND_FLAGS': flags.AND_FLAGS,
+       'INR_FLAGS': flags.INR_FLAGS, 'DCR_FLAGS': flags.DCR_FLAGS, 'DAA_TABLE': flags.DAA_TABLE}
+
+
+def instruction_source(op, pc=None, data=0, base=0):
+    '''
+    Возвращает текст инструкции с кодом op в виде пары (lines, jumps).
+    Если pc не задан, операнды читаются из памяти во время выполнения (режим обработчика).
+    Если pc задан, инструкция считается расположенной по адресу pc с операндом data,
+    и адреса и операнды подставляются в текст как константы (режим трансляции блоков).
+    base - число тактов, затраченных предыдущими инструкциями блока.
+    '''
+    lines, jumps = _semantics(op)
+    length = OPCODES[op].length
+    if pc is None:
+        fields = {'d8': 'm.read((pc + 1) & 0xFFFF)',
+                  'd16': '(m.read((pc + 1) & 0xFFFF) | m.read((pc + 2) & 0xFFFF) << 8)',
+                  'next': '((pc + %d) & 0xFFFF)' % length,
+                  'base': 0}
+    else:
+        fields = {'d8': '0x%02X' % (data & 0xFF),
+                  'd16': '0x%04X' % (data & 0xFFFF),
+                  'next': '0x%04X' % ((pc + length) & 0xFFFF),
+                  'base': base}
+    return '\n'.join(lines).format(**fields).split('\n'), jumps
+
+
+def prologue(lines):
+    '''
+    Возвращает строки, загружающие в локальные переменные то, что используется в lines
+    '''
+    body = '\n'.join(lines)
+    src = []
+    if re.search(r'\br\[', body):
+        src.append('r = cpu.r')
+    if re.search(r'\bm\.', body):
+        src.append('m = cpu._m')
+    if re.search(r'(?<!\.)\bpc\b', body):
+        src.append('pc = cpu.pc')
+    return src
+
+
+def compile_function(name, lines, env=None):
+    '''
+    Компилирует функцию name(cpu) с телом lines.
+    env - дополнительные глобальные имена для сгенерированного кода.
+    '''
+    src = 'def %s(cpu):\n' % name + '\n'.join('    ' + line for line in lines)
+    namespace = dict(ENV)
+    if env:
+        namespace.update(env)
+    exec(src, namespace)
+    return namespace[name]
+
+
+def _compile_handler(op):
+    '''
+    Генерирует функцию-обработчик для кода op
+    '''
+    info = OPCODES[op]
+    lines, jumps = instruction_source(op)
+    if not jumps:
+        lines = lines + ['cpu.pc = (pc + %d) & 0xFFFF' % info.length]
+    lines = prologue(lines) + lines + ['return %d' % info.cycles]
+    return compile_function('op_%02x' % op, lines)
+
+
+def build_table():
+    '''
+    Строит таблицу диспетчеризации: список из 256 кортежей (handler, length, cycles)
+    '''
+    return [(_compile_handler(op), OPCODES[op].length, OPCODES[op].cycles) for op in range(256)]
+
+
+TABLE = build_table()
+HANDLERS = [entry[0] for entry in TABLE]    # Обработчики, общие для всех процессоров
@@ -0,0 +1,76 @@
+'''
+Таблицы для вычисления флагов i8080.
+Все таблицы строятся один раз при импорте модуля, после чего значение регистра
+флагов F для любой арифметической или логической операции получается одним
+обращением к таблице. Значения уже содержат единицу в бите 1, как в настоящем F.
+
+SZP[v]                      - флаги S, Z, P для результата v
+ADD_FLAGS[c << 16 | a << 8 | b] - F после a + b + c (флаги S, Z, A, P, C)
+SUB_FLAGS[c << 16 | a << 8 | b] - F после a - b - c
+AND_FLAGS[a << 8 | b]       - F после a & b (A - ИЛИ битов 3 операндов, как у i8080)
+INR_FLAGS[v], DCR_FLAGS[v]  - флаги S, Z, A, P после INR/DCR с результатом v (без C)
+DAA_TABLE[ac << 9 | c << 8 | a] - (новое значение A << 8) | F после DAA
+'''
+FLAG_S = 0b10000000
+FLAG_Z = 0b01000000
+FLAG_A = 0b00010000
+FLAG_P = 0b00000100
+FLAG_ONE = 0b00000010   # Бит 1 регистра F всегда равен единице
+FLAG_C = 0b00000001
+
+
+def _szp(v):
+    f = FLAG_ONE | (v & FLAG_S)
+    if v == 0:
+        f |= FLAG_Z
+    if bin(v).count('1') % 2 == 0:
+        f |= FLAG_P
+    return f
+
+
+SZP = bytes(_szp(v) for v in range(256))
+
+
+def _add(a, b, c):
+    t = a + b + c
+    f = SZP[t & 0xFF] | (t >> 8)
+    if (a & 0xF) + (b & 0xF) + c > 0xF:
+        f |= FLAG_A
+    return f
+
+
+def _sub(a, b, c):
+    # i8080 вычитает, прибавляя дополнение: a + ~b + !c; C - отсутствие переноса,
+    # A - перенос из бита 3 этого сложения
+    t = a - b - c
+    f = SZP[t & 0xFF] | (1 if t < 0 else 0)
+    if (a & 0xF) + (~b & 0xF) + (1 - c) > 0xF:
+        f |= FLAG_A
+    return f
+
+
+def _table(function):
+    return bytes(function(a, b, c) for c in (0, 1) for a in range(256) for b in range(256))
+
+
+ADD_FLAGS = _table(_add)
+SUB_FLAGS = _table(_sub)
+AND_FLAGS = bytes(SZP[a & b] | ((a | b) & 0x08) << 1 for a in range(256) for b in range(256))
+INR_FLAGS = bytes(SZP[v] | (FLAG_A if v & 0xF == 0 else 0) for v in range(256))
+DCR_FLAGS = bytes(SZP[v] | (0 if v & 0xF == 0xF else FLAG_A) for v in range(256))
+
+
+def _daa(a, c, ac):
+    correction = 0
+    carry = c
+    if ac or a & 0xF > 9:
+        correction = 0x06
+    if c or a >> 4 > 9 or (a >> 4 >= 9 and a & 0xF > 9):
+        correction |= 0x60
+        carry = 1
+    t = a + correction
+    f = _add(a, correction, 0) & ~FLAG_C | carry
+    return (t & 0xFF) << 8 | f
+
+
+DAA_TABLE = [_daa(a, c, ac) for ac in (0, 1) for c in (0, 1) for a in range(256)]
@@ -0,0 +1,331 @@
+'''
+Выполнение эмулятора внутри asyncio.
+Machine выполняет программу срезами по slice_cycles тактов (run_for процессора
+или транслятора блоков) и между срезами уступает управление циклу событий,
+поэтому один цикл событий обслуживает сотни машин: каждая после своего среза
+встаёт в конец очереди готовых задач.
+
+Устройства подключаются к шине IOBus машины. Если устройство ввода не готово,
+его обработчик выбрасывает NotReady с будущим (asyncio.Future), которое
+завершится, когда появятся данные. Машина возвращает PC на команду IN, прерывает
+срез (StopExecution с причиной STOP_WAIT) и ждёт это будущее, не занимая
+процессор; затем IN выполняется заново. Такты за время ожидания не идут.
+
+stop(), pause() и resume() можно вызывать из других задач; они действуют на
+границе среза или прерывают ожидание ввода. Поэтому slice_cycles задаёт
+компромисс между накладными расходами и задержкой реакции.
+
+Устройства:
+AsyncInput  - ввод из очереди байтов, пополняемой feed() из других задач;
+AsyncOutput - вывод, который другие задачи читают через await read().
+
+Запуск как программы выполняет много машин в одном цикле событий:
+    python host.py [--machines N] [--slice N]
+'''
+import argparse
+import asyncio
+
+from cpu import RunResult
+from dispatch import StopExecution, STOP_CYCLES, STOP_WAIT
+from iobus import IOBus, CPM_EOF
+
+DEFAULT_SLICE = 20000           # Тактов в срезе (10 мс при 2 МГц)
+STOP_REQUESTED = 'stopped'      # Причина остановки: вызван Machine.stop()
+
+
+class NotReady(Exception):
+    '''
+    Выбрасывается обработчиком IN, если у устройства нет данных.
+    '''
+    def __init__(self, waiter):
+        '''
+        :param waiter: asyncio.Future, завершающееся, когда устройство станет готово
+        '''
+        Exception.__init__(self, waiter)
+        self.waiter = waiter
+
+
+class AsyncInput:
+    '''
+    Ввод из очереди байтов. Пока очередь пуста, чтение приостанавливает машину;
+    после close() и исчерпания данных читается значение eof.
+    '''
+    def __init__(self, eof=CPM_EOF):
+        self._data = bytearray()
+        self._eof = eof
+        self._closed = False
+        self._waiters = []
+
+    def feed(self, data):
+        '''
+        Добавляет байты data в очередь и будит ждущие машины
+        '''
+        self._data += bytes(data)
+        self._wake()
+
+    def close(self):
+        '''
+        Отмечает конец ввода
+        '''
+        self._closed = True
+        self._wake()
+
+    def _wake(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+    def available(self):
+        return len(self._data) > 0
+
+    def wait(self):
+        '''
+        Возвращает будущее, завершающееся при появлении данных или при close()
+        '''
+        waiter = asyncio.get_running_loop().create_future()
+        if self._data or self._closed:
+            waiter.set_result(None)
+        else:
+            self._waiters.append(waiter)
+        return waiter
+
+    def read(self, port):
+        '''
+        Обработчик IN: следующий байт; если данных нет - NotReady
+        '''
+        if self._data:
+            value = self._data[0]
+            del self._data[0]
+            return value
+        if self._closed:
+            return self._eof
+        raise NotReady(self.wait())
+
+    def status(self, port):
+        '''
+        Обработчик IN для порта состояния: 0FFH, если есть данные, иначе 0 (не приостанавливает)
+        '''
+        return 0xFF if self._data else 0
+
+
+class AsyncOutput:
+    '''
+    Вывод, накапливаемый в буфере; другие задачи забирают его через await read().
+    '''
+    def __init__(self):
+        self._buffer = bytearray()
+        self._waiters = []
+
+    def write(self, port, value):
+        '''
+        Обработчик OUT: добавляет байт value
+        '''
+        self._buffer.append(value)
+        if self._waiters:
+            for waiter in self._waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+            self._waiters.clear()
+
+    async def read(self):
+        '''
+        Возвращает накопленный вывод; если он пуст - ждёт его появления
+        '''
+        while not self._buffer:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+    def getvalue(self):
+        '''
+        Возвращает накопленный вывод без ожидания
+        '''
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class Machine:
+    '''
+    Процессор с шиной ввода-вывода, выполняемый в цикле событий asyncio.
+    '''
+    def __init__(self, cpu, runner=None, bus=None):
+        '''
+        :param cpu: Процессор
+        :param runner: Объект с методом run_for(cycles) - сам cpu (по умолчанию) или translator.BlockCache
+        :param bus: IOBus (по умолчанию создаётся новая); подключается к процессору
+        '''
+        self.cpu = cpu
+        self.runner = cpu if runner is None else runner
+        self.bus = IOBus() if bus is None else bus
+        self.bus.attach(cpu)
+        read = cpu.port_in
+        machine = self
+
+        def port_in(port):
+            try:
+                return read(port)
+            except NotReady as e:
+                cpu.pc = (cpu.pc - 2) & 0xFFFF     # IN будет выполнена заново
+                machine._waiter = e.waiter
+                machine.waiting_port = port
+                raise StopExecution(STOP_WAIT, 0)
+        cpu.port_in = port_in
+        self.waiting_port = None    # Порт, ввода с которого ждёт машина
+        self._waiter = None
+        self._stop = False
+        self._resumed = None
+        self.running = False
+
+    @property
+    def paused(self):
+        return self._resumed is not None
+
+    def stop(self):
+        '''
+        Завершает run_async() на границе среза (или прерывает ожидание ввода)
+        '''
+        self._stop = True
+        self._interrupt_wait()
+        if self._resumed is not None:
+            self.resume()
+
+    def pause(self):
+        '''
+        Приостанавливает run_async() на границе среза до resume()
+        '''
+        if self._resumed is None:
+            self._resumed = asyncio.get_running_loop().create_future()
+            self._interrupt_wait()
+
+    def resume(self):
+        resumed = self._resumed
+        self._resumed = None
+        if resumed is not None and not resumed.done():
+            resumed.set_result(None)
+
+    def _interrupt_wait(self):
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def run_async(self, slice_cycles=DEFAULT_SLICE, cycles=None):
+        '''
+        Выполняет программу срезами по slice_cycles тактов, пока не будет затрачено
+        cycles тактов (по умолчанию - без ограничения), не вызван stop() или процессор
+        не остановится (HLT и т. п.). Между срезами уступает управление циклу событий,
+        пока устройство ввода не готово - ждёт его. Возвращает RunResult; причина -
+        STOP_CYCLES, STOP_REQUESTED или причина, с которой остановился процессор.
+        '''
+        if self.running:
+            raise RuntimeError('machine is already running')
+        cpu = self.cpu
+        run_for = self.runner.run_for
+        start = cpu.cycles
+        end = float('inf') if cycles is None else start + cycles
+        instructions = 0
+        self._stop = False
+        self.running = True
+        try:
+            while True:
+                if self._stop:
+                    reason = STOP_REQUESTED
+                    break
+                if self._resumed is not None:
+                    await self._resumed
+                    continue
+                if cpu.cycles >= end:
+                    reason = STOP_CYCLES
+                    break
+                result = run_for(cycles=min(slice_cycles, end - cpu.cycles))
+                instructions += result.instructions
+                if result.reason == STOP_WAIT:
+                    await self._waiter
+                    self._waiter = None
+                    self.waiting_port = None
+                elif result.reason == STOP_CYCLES:
+                    await asyncio.sleep(0)
+                else:
+                    reason = result.reason
+                    break
+        finally:
+            self.running = False
+            self._waiter = None
+            self.waiting_port = None
+        return RunResult(instructions, cpu.cycles - start, reason)
+
+
+def main():
+    '''
+    Много машин в одном цикле событий: каждая программа переводит ввод в верхний
+    регистр, пока не прочитает ^Z; ввод подаётся порциями из отдельной задачи
+    '''
+    import time
+    import assembler
+    from cpu import CPU
+    from memory import Memory
+    parser = argparse.ArgumentParser(description='Run many emulated machines on one asyncio loop')
+    parser.add_argument('--machines', type=int, default=200, help='number of machines')
+    parser.add_argument('--slice', type=int, default=DEFAULT_SLICE, help='cycles per slice')
+    args = parser.parse_args()
+    program = assembler.assemble('''
+            LXI SP, 1000H
+    NEXT:   IN 0
+            CPI 1AH
+            JZ DONE
+            CPI 'a'
+            JC PUT
+            CPI 'z' + 1
+            JNC PUT
+            SUI 20H
+    PUT:    OUT 1
+            LXI B, 200      ; Немного работы на каждый символ
+    BUSY:   DCX B
+            MOV A, B
+            ORA C
+            JNZ BUSY
+            JMP NEXT
+    DONE:   HLT
+    ''')
+    text = b'hello, asyncio world\n'
+
+    async def feeder(device, index):
+        for i in range(0, len(text), 4):
+            device.feed(text[i:i + 4])
+            await asyncio.sleep(0.001 * (index % 5))
+        device.close()
+
+    async def run_all():
+        machines = []
+        tasks = []
+        for i in range(args.machines):
+            m = Memory()
+            program.load(m)
+            p = CPU(m)
+            p.pc = program.entry
+            machine = Machine(p)
+            device = AsyncInput()
+            output = AsyncOutput()
+            machine.bus.register(0, read=device.read)
+            machine.bus.register(1, write=output.write)
+            machines.append((machine, output))
+            tasks.append(asyncio.ensure_future(machine.run_async(args.slice)))
+            tasks.append(asyncio.ensure_future(feeder(device, i)))
+        t = time.perf_counter()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - t
+        results = [task.result() for task in tasks[::2]]
+        correct = sum(output.getvalue() == text.upper() for machine, output in machines)
+        instructions = sum(result.instructions for result in results)
+        print('%d machines: %d instructions in %.2f s (%.2f MIPS), %d correct outputs'
+              % (len(machines), instructions, elapsed, instructions / elapsed / 1e6, correct))
+
+    asyncio.run(run_all())
+
+
+if __name__ == '__main__':
+    main()
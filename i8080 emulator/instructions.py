@@ -1,38 +1,63 @@
+import dispatch
+from opcodes import OPCODES
+
+
 class Instruction:
     '''
-    Базовый класс для всех инструкций.
-    Объявляет методы инструкции и обеспечивает релизацию для простых случаев.
+    Декодированная инструкция.
+    Описывает инструкцию, расположенную по адресу address и состоящую из байтов code.
+    Объект не хранит и не читает состояние процессора: при декодировании ничего не
+    вычисляется и не изменяется, а при выполнении регистры, флаги и память берутся
+    из процессора в момент вызова execute(). Поэтому один объект можно выполнять
+    сколько угодно раз и хранить в кэше по ключу (адрес, байты).
     '''
-    def __init__(self, cpu, length, cycles = 4):
+    __slots__ = ('address', 'code', 'opcode', '_length', '_cycles', '_mnemonic', '_argument', '_function')
+
+    def __init__(self, address, code):
         '''
-        :param cpu: Процессор (класс CPU)
-        :param opcode: Код инструкции
-        :param length: Длина инструкции в байтах
-        :param cycles: Время выполнения инструкции в циклах
+        :param address: Адрес инструкции
+        :param code: Байты инструкции (код операции и непосредственные операнды)
         '''
-        self._cpu = cpu
-        self._length = length
-        self._cycles = cycles
+        info = OPCODES[code[0]]
+        self.address = address
+        self.code = bytes(code)
+        self.opcode = code[0]
+        self._length = info.length
+        self._cycles = info.cycles
+        self._mnemonic = info.mnemonic
+        text = info.text(self.data())
+        self._argument = text[len(info.mnemonic) + 1:] if info.operands else None   # Аргументы, если есть. None - аргументов нет.
+        self._function = None
+
+    def data(self):
         '''
-        Следующие две переменные класса устанавливаются конструкторами дочерних классов
-        чтобы обеспечить вывод инструкции в текстовом виде.
+        Возвращает значение непосредственного операнда (0, если его нет)
         '''
-        self._mnemonic = None
-        self._argument = None   # Аргумент (аргументы), если есть. None - аргументов нет.
+        if self._length == 3:
+            return self.code[1] | self.code[2] << 8
+        if self._length == 2:
+            return self.code[1]
+        return 0
 
-    def execute(self):
+    def execute(self, cpu):
         '''
-        Выполняет команду
+        Выполняет команду на процессоре cpu.
+        Возвращает число затраченных тактов.
         '''
-        print(self._mnemonic)
-        self.instruction_logic()
+        if self._function is None:
+            self._function = self._compile()
+        return self._function(cpu)
 
-    def instruction_logic(self):
+    def _compile(self):
         '''
-        Дочерние классы переопределяют эту функцию и реализовывают
-        в ней логику работы инструкции.
+        Компилирует функцию, выполняющую эту инструкцию по её адресу.
+        Текст берётся из dispatch, поэтому семантика совпадает с обработчиками процессора.
         '''
-        pass
+        lines, jumps = dispatch.instruction_source(self.opcode, self.address, self.data())
+        if not jumps:
+            lines = lines + ['cpu.pc = 0x%04X' % ((self.address + self._length) & 0xFFFF)]
+        lines = dispatch.prologue(lines) + lines + ['return %d' % self._cycles]
+        return dispatch.compile_function('instruction_%04x' % self.address, lines)
 
     def byte_len(self):
         '''
@@ -43,6 +68,7 @@ class Instruction:
     def cycle_count(self):
         '''
         Возвращает время работы инструкции в циклах.
+        Для условных CALL и RET - время при невыполненном условии.
         '''
         return self._cycles
 
@@ -54,306 +80,37 @@ class Instruction:
             return self._mnemonic
         return '%s %s' % (self._mnemonic, self._argument)
 
+    def __repr__(self):
+        return 'Instruction(%s, %r)' % (hex(self.address), self.mnemonic())
 
-class InstructionNotImplemented(Instruction):
-    '''
-    Объект для неподдерживаемой инструкции.
-    Выбрасывает исключение при попытке выполнения.
-    '''
-    def __init__(self, cpu, xx, yyy, zzz):
-        Instruction.__init__(self, cpu, 1)
-        self._opcode = xx * 0b1000000 + yyy * 0b1000 + zzz
-        self._mnemonic = 'Invalid opcode %s' % hex(self._opcode)  # Мнемоника команды.
-
-    def instruction_logic(self):
-        raise Exception('Invalid instruction opcode:', self._opcode)
-
-
-class InstructionNOP(Instruction):
-    '''
-    Интструкция NOP - ничего не делать.
-    '''
-    def __init__(self, cpu, xx, yyy, zzz):
-        Instruction.__init__(self, cpu, 1)
-        self._mnemonic = 'NOP'
-
-    def instruction_logic(self):
-        print('Инстр. NOP Выполнена')
-
-
-class InstructionMOV(Instruction):
-    '''
-    Инструкция MOV - передача данных между регистрами или между регистрами и памятью, адресуемой HL.
-    '''
-    def __init__(self, cpu, xx, yyy, zzz):
-        Instruction.__init__(self, cpu, 1, 5)
-        self.dst, self.src = yyy, zzz
-        self._mnemonic = 'MOV'
-        self._argument = '%s, %s' % (self._cpu.REGISTER_NAMES[self.dst], self._cpu.REGISTER_NAMES[self.src])
-
-    def instruction_logic(self):
-        if self.dst == 0b110 or self.src == 0b110:
-            self._cycles = 7
-        self._cpu.set_register(self.dst, self._cpu.get_register(self.src))
-        print('Инстр. MOV Выполнена')
-
-
-class InstructionMVI(Instruction):
-    '''
-    Инструкция MVI - передача данных между регистрами и памятью (8 бит)
-    '''
-    def __init__(self, cpu, xx, yyy, zzz):
-        Instruction.__init__(self, cpu, 2, 7)
-        self.dst = yyy
-        self.scr = self._cpu._m[self._cpu.pc + 1]
-        self._mnemonic = 'MVI'
-        self._argument = '%s, %s' % (self._cpu.REGISTER_NAMES[self.dst], self.src)
-
-    def instruction_logic(self):
-        if self.dst == 0b110:
-            self._cycles = 10
-        self._cpu.set_register(self.dst, self.src)
-        print('Инстр. MVI Выполнена')
-
-
-class InstructionLDA(Instruction):
-    '''
-    Инструкция LDA - передача данных между регистром A и памятью (16 бит)
-    '''
-    def __init__(self, cpu, xx, yyy, zzz):
-        Instruction.__init__(self, cpu, 3, 13)
-        self.dst = 0b111
-        addr = self._cpu._m[self._cpu.pc + 1] + self._cpu._m[self._cpu.pc + 2] * 0x100
-        self.src = self._cpu._m[addr]
-        self._mnemonic = 'LDA'
-        self._argument = '%s, %s' % (self._cpu.REGISTER_NAMES[7], self.src)
-
-    def instruction_logic(self):
-        self._cpu.set_register(self.dst, self.src)
-        print('Инстр. LDA Выполнена')
-
-
-class InstructionSTA(Instruction):
-    '''
-    Инструкция STA - передача данных между памятью и регистром A (16 бит)
-    '''
-    def __init__(self, cpu, xx, yyy, zzz):
-        Instruction.__init__(self, cpu, 3, 13)
-        self.addr = self._cpu._m[self._cpu.pc + 1] + self._cpu._m[self._cpu.pc + 2] * 0x100
-        self.src = self._cpu.get_register(0b111)
-        self._mnemonic = 'STA'
-        self._argument = '%s, %s' % (self._cpu._m[self.addr], self._cpu.REGISTER_NAMES[7])
-
-    def instruction_logic(self):
-        self._cpu._m[self.addr] = self.src
-        print('Инстр. STA Выполнена')
-
-
-class InstructionLDAX(Instruction):
-    '''
-    Инструкция LDAX - передача данных между регистром A и памятью
-    '''
-    def __init__(self, cpu, xx, yyy, zzz):
-        Instruction.__init__(self, cpu, 1, 7)
-        self.dst = 0b111
-        if yyy == 0b001:
-            pair = self._cpu.get_pair1(0b00)
-        else:
-            pair = self._cpu.get_pair1(0b01)
-        self.src = self._cpu._m[pair]
-        self._mnemonic = 'LDAX'
-        self._argument = '%s, %s' % (self._cpu.REGISTER_NAMES[7], self.src)
-
-    def instruction_logic(self):
-        self._cpu.set_register(self.dst, self.src)
-        print('Инстр. LDAX Выполнена')
-
-
-class InstructionSTAX(Instruction):
-    '''
-    Инструкция STAX - передача данных между памятью и регистром A
-    '''
-    def __init__(self, cpu, xx, yyy, zzz):
-        Instruction.__init__(self, cpu, 1, 7)
-        if yyy == 0b000:
-            self.pair = self._cpu.get_pair1(0b00)
-        else:
-            self.pair = self._cpu.get_pair1(0b01)
-        self.src = self._cpu.get_register(0b111)
-        self._mnemonic = 'STAX'
-        self._argument = '%s, %s' % (self._cpu._m[self.pair], self._cpu.REGISTER_NAMES[7])
-
-    def instruction_logic(self):
-        self._cpu._m[self.pair] = self.src
-        print('Инстр. STAX Выполнена')
-
-
-class InstructionLHLD(Instruction):
-
-    def __init__(self, cpu, xx, yyy, zzz):
-        Instruction.__init__(self, cpu, 3, 16)
-        self.dst1 = 0b101
-        addr = self._cpu._m[self._cpu.pc + 1] + self._cpu._m[self._cpu.pc + 2] * 0x100
-        self.src1 = self._cpu._m[addr]
-        self.dst2 = 0b100
-        self.src2 = self._cpu._m[addr + 1]
-        self._mnemonic = 'LHLD'
-        self._argument1 = '%s, %s' % (self._cpu.REGISTER_NAMES[5], self.src1)
-        self._argument1 = '%s, %s' % (self._cpu.REGISTER_NAMES[4], self.src2)
-
-    def instruction_logic(self):
-        self._cpu.set_register(self.dst1, self.src1)
-        self._cpu.set_register(self.dst2, self.src2)
-        print('Инстр. LHLD Выполнена')
-
-
-class InstructionSHLD(Instruction):
-
-    def __init__(self, cpu, xx, yyy, zzz):
-        Instruction.__init__(self, cpu, 3, 16)
-        self.src1 = self._cpu.get_register(0b101)
-        self.src2 = self._cpu.get_register(0b100)
-        self.addr = self._cpu._m[self._cpu.pc + 1] + self._cpu._m[self._cpu.pc + 2] * 0x100
-        self._mnemonic = 'SHLD'
-        self._argument1 = '%s, %s' % (self._cpu._m[self.addr], self._cpu.REGISTER_NAMES[5])
-        self._argument1 = '%s, %s' % (self._cpu._m[self.addr + 1], self._cpu.REGISTER_NAMES[4])
-
-    def instruction_logic(self):
-        self._cpu._m[self.addr] = self.src1
-        self._cpu._m[self.addr + 1] = self.src2
-        print('Инстр. SHLD Выполнена')
-
-
-class InstructionLXI(Instruction):
-
-    def __init__(self, cpu, xx, yyy, zzz):
-        Instruction.__init__(self, cpu, 3, 10)
-        self.src = self._cpu._m[self._cpu.pc + 1] + self._cpu._m[self._cpu.pc + 2] * 0x100
-        self.dst = yyy // 2
-        self._mnemonic = 'LXI'
-        self._argument = '%s, %s' % (self._cpu.PAIR_NAMES_1[self.dst], self.src)
-
-    def instruction_logic(self):
-        self._cpu.pairs_1[self.dst].value = self.src
-        print('Инстр. LXI Выполнена')
-
-
-class InstructionSPHL(Instruction):
-
-    def __init__(self, cpu, xx, yyy, zzz):
-        Instruction.__init__(self, cpu, 1, 5)
-        self.src = self._cpu.pairs_1[2].value
-        self._mnemonic = 'SPHL'
-        self._argument = '%s, %s' % (self._cpu.PAIR_NAMES_1[3], self._cpu.PAIR_NAMES_1[2])
-
-    def instruction_logic(self):
-        self._cpu.pairs_1[3].value = self._cpu.pairs_1[2].value
-        print('Инстр. SPHL Выполнена')
-
-
-class InstructionPCHL(Instruction):
-
-    def __init__(self, cpu, xx, yyy, zzz):
-        Instruction.__init__(self, cpu, 1, 5)
-        self.src = self._cpu.pairs_1[2].value
-        self._mnemonic = 'CPHL'
-        self._argument = '%s, %s' % ('PC', self._cpu.PAIR_NAMES_1[2])
 
-    def instruction_logic(self):
-        self._cpu.pc = self._cpu.pairs_1[2].value
-        print('Инстр. PCHL Выполнена')
-
-
-class InstructionXCHG(Instruction):
-
-    def __init__(self, cpu, xx, yyy, zzz):
-        Instruction.__init__(self, cpu, 1, 5)
-        self.tmpDE = self._cpu.pairs_1[1].value
-        self.tmpHL = self._cpu.pairs_1[2].value
-        self._mnemonic = 'XCHG'
-        self._argument = '%s, %s' % (self._cpu.PAIR_NAMES_1[2], self._cpu.PAIR_NAMES_1[1])
-
-    def instruction_logic(self):
-        self._cpu.pairs_1[2].value = self.tmpDE
-        self._cpu.pairs_1[1].value = self.tmpHL
-        print('Инстр. XCHG Выполнена')
-
-
-class InstructionADD(Instruction):
-    '''
-    Инструкция ADD - прибавление значения регистра к значению регистра A
-    '''
-    def __init__(self, cpu, xx, yyy, zzz):
-        Instruction.__init__(self, cpu, 1, 4)
-        self.zzz = zzz
-        self.src = self._cpu.registers[7].value + self._cpu.registers[zzz].value
-        if self.src > 0xFF:
-            if self._cpu._C == 0:
-                self._cpu.registers[6].value = self._cpu.registers[6].value + 0b1
-                self._cpu._C = 1
-        else:
-            if self._cpu._C == 1:
-                self._cpu.registers[6].value = self._cpu.registers[6].value - 0b1
-                self._cpu._C = 0
-        self._mnemonic = 'ADD'
-        self._argument = '%s, %s' % ('A', self._cpu.REGISTER_NAMES[zzz])
-
-    def instruction_logic(self):
-        if self.zzz == 0b110:
-            self._cycles = 7
-        self._cpu.registers[7].value = self.src
-        print('Инстр. ADD Выполнена')
-
-
-class InstructionADC(Instruction):
-    '''
-    Инструкция ADC - прибавление значения регистра и значения флага C к значению регистра A
-    '''
-    def __init__(self, cpu, xx, yyy, zzz):
-        Instruction.__init__(self, cpu, 1, 4)
-        self.zzz = zzz
-        self.src = self._cpu.registers[7].value + self._cpu.registers[zzz].value + self._cpu._C
-        if self.src > 0xFF:
-            if self._cpu._C == 0:
-                self._cpu.registers[6].value = self._cpu.registers[6].value + 0b1
-                self._cpu._C = 1
-        else:
-            if self._cpu._C == 1:
-                self._cpu.registers[6].value = self._cpu.registers[6].value - 0b1
-                self._cpu._C = 0
-        self._mnemonic = 'ADD'
-        self._argument = '%s, %s' % ('A', self._cpu.REGISTER_NAMES[zzz], 'Flag_C')
-
-    def instruction_logic(self):
-        if self.zzz == 0b110:
-            self._cycles = 7
-        self._cpu.registers[7].value = self.src
-        print('Инстр. ADC Выполнена')
-
-
-class InstructionSUB(Instruction):
+class DecodeCache:
     '''
-    Инструкция SUB - вычитание значения регистра из значения регистра A
+    Кэш декодированных инструкций по ключу (адрес, байты).
+    Так как инструкции не зависят от состояния процессора, кэш можно разделять
+    между процессорами; изменённый код получает новый ключ и декодируется заново.
     '''
-    def __init__(self, cpu, xx, yyy, zzz):
-        Instruction.__init__(self, cpu, 1, 4)
-        self.zzz = zzz
-        self.src = self._cpu.registers[7].value - self._cpu.registers[zzz].value
-        if self.src < 0:
-            if self._cpu._C == 0:
-                self._cpu.registers[6].value = self._cpu.registers[6].value + 0b1
-                self._cpu._C = 1
-        else:
-            if self._cpu._C == 1:
-                self._cpu.registers[6].value = self._cpu.registers[6].value - 0b1
-                self._cpu._C = 0
-        self._mnemonic = 'SUB'
-        self._argument = '%s, %s' % ('A', self._cpu.REGISTER_NAMES[zzz])
-
-    def instruction_logic(self):
-        if self.zzz == 0b110:
-            self._cycles = 7
-        self._cpu.registers[7].value = self.src
-        print('Инстр. SUB Выполнена')
-
+    def __init__(self, max_size=0x10000):
+        self._cache = {}
+        self._max_size = max_size
 
+    def decode(self, memory, addr):
+        '''
+        Возвращает Instruction для инструкции по адресу addr в памяти memory
+        '''
+        addr &= 0xFFFF
+        length = OPCODES[memory[addr]].length
+        code = bytes(memory[addr + i] for i in range(length))
+        key = (addr, code)
+        instr = self._cache.get(key)
+        if instr is None:
+            if len(self._cache) >= self._max_size:
+                self._cache.clear()
+            instr = self._cache[key] = Instruction(addr, code)
+        return instr
+
+    def __len__(self):
+        return len(self._cache)
+
+
+DECODE_CACHE = DecodeCache()    # Общий кэш, используемый CPU.decode()
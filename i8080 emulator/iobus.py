@@ -0,0 +1,310 @@
+'''
+Шина ввода-вывода и устройства.
+IOBus хранит две таблицы по 256 обработчиков - для IN и для OUT - и подключается
+к процессору через cpu.port_in и cpu.port_out, поэтому команда IN/OUT стоит одного
+обращения к таблице и вызова обработчика. Незанятые порты читаются как 0FFH,
+запись в них игнорируется.
+
+Устройства:
+BufferedConsole - вывод, накапливаемый в буфере и записываемый в поток большими порциями;
+FileInput       - ввод из файла или байтов;
+BDOS            - вызовы CP/M BDOS. По адресу 0005H ставится переход на заглушку
+                  OUT порт / RET, поэтому вызов BDOS перехватывается обработчиком порта
+                  без проверок адреса на каждой инструкции. Обработчик проверяет, что
+                  запись сделана заглушкой; OUT в этот порт из самой программы (например
+                  OUT 0FFH) игнорируется, как запись в незанятый порт.
+
+Запуск как программы выполняет программу CP/M (.COM) без терминала:
+    python iobus.py program.com [--input file] [--cycles N]
+'''
+import argparse
+import sys
+
+CPM_START = 0x0100      # Адрес загрузки программ CP/M (TPA)
+CPM_BDOS = 0xFE00       # Адрес заглушки BDOS; слово по адресу 6 - вершина памяти для SP
+CPM_STACK = CPM_BDOS - 2    # Начальный SP: в стеке адрес возврата 0, как после вызова из CCP
+BDOS_PORT = 0xFF        # Порт, запись в который выполняет вызов BDOS
+CPM_EOF = 0x1A          # Конец файла в CP/M (^Z)
+
+
+def _no_input(port):
+    return 0xFF
+
+
+def _no_output(port, value):
+    pass
+
+
+class IOBus:
+    '''
+    Шина ввода-вывода: таблицы обработчиков портов.
+    '''
+    def __init__(self):
+        self._inputs = [_no_input] * 256
+        self._outputs = [_no_output] * 256
+
+    def register(self, port, read=None, write=None):
+        '''
+        Подключает к порту port обработчики read(port) -> байт (для IN)
+        и write(port, value) (для OUT). Незаданный обработчик не меняется.
+        '''
+        if not 0 <= port <= 0xFF:
+            raise ValueError('port must be 0..255')
+        if read is not None:
+            self._inputs[port] = read
+        if write is not None:
+            self._outputs[port] = write
+
+    def unregister(self, port):
+        '''
+        Отключает обработчики порта port
+        '''
+        self._inputs[port] = _no_input
+        self._outputs[port] = _no_output
+
+    def read(self, port):
+        return self._inputs[port](port)
+
+    def write(self, port, value):
+        self._outputs[port](port, value)
+
+    def attach(self, cpu):
+        '''
+        Направляет команды IN и OUT процессора cpu на эту шину
+        '''
+        inputs = self._inputs
+        outputs = self._outputs
+
+        def port_in(port):
+            return inputs[port](port)
+
+        def port_out(port, value):
+            outputs[port](port, value)
+        cpu.port_in = port_in
+        cpu.port_out = port_out
+
+
+class BufferedConsole:
+    '''
+    Консольный вывод. Байты накапливаются и записываются в поток (с методом write(bytes))
+    порциями по buffer_size байт, а также при flush(). Если поток не задан,
+    вывод только накапливается и доступен через getvalue().
+    '''
+    def __init__(self, stream=None, buffer_size=65536):
+        self._stream = stream
+        self._buffer = bytearray()
+        self._buffer_size = buffer_size
+        self._written = bytearray() if stream is None else None
+
+    def write(self, port, value):
+        '''
+        Обработчик OUT: выводит байт value
+        '''
+        self._buffer.append(value)
+        if len(self._buffer) >= self._buffer_size:
+            self.flush()
+
+    def write_bytes(self, data):
+        self._buffer += data
+        if len(self._buffer) >= self._buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._stream is None:
+            self._written += self._buffer
+        elif self._buffer:
+            self._stream.write(bytes(self._buffer))
+            if hasattr(self._stream, 'flush'):
+                self._stream.flush()
+        self._buffer.clear()
+
+    def getvalue(self):
+        '''
+        Возвращает весь вывод (для консоли без потока)
+        '''
+        self.flush()
+        return bytes(self._written or b'')
+
+
+class FileInput:
+    '''
+    Ввод из файла (имя или открытый двоичный файл) или из байтов.
+    Данные читаются целиком при создании.
+    '''
+    def __init__(self, source=b'', eof=CPM_EOF):
+        '''
+        :param source: Имя файла, двоичный файл или bytes
+        :param eof: Значение, читаемое после окончания данных
+        '''
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                source = f.read()
+        elif hasattr(source, 'read'):
+            source = source.read()
+        self._data = bytes(source)
+        self._pos = 0
+        self._eof = eof
+
+    def available(self):
+        return self._pos < len(self._data)
+
+    def read_byte(self):
+        '''
+        Возвращает следующий байт или значение eof, если данные кончились
+        '''
+        if self._pos >= len(self._data):
+            return self._eof
+        value = self._data[self._pos]
+        self._pos += 1
+        return value
+
+    def read(self, port):
+        '''
+        Обработчик IN: следующий байт
+        '''
+        return self.read_byte()
+
+    def status(self, port):
+        '''
+        Обработчик IN для порта состояния: 0FFH, если есть данные, иначе 0
+        '''
+        return 0xFF if self.available() else 0
+
+
+class BDOS:
+    '''
+    Вызовы CP/M BDOS для консольного ввода-вывода.
+    Поддерживаются функции 0 (выход), 1 (ввод символа), 2 (вывод символа),
+    6 (прямой ввод-вывод), 9 (вывод строки до '$'), 10 (ввод строки),
+    11 (состояние консоли) и 12 (версия). Остальные функции возвращают 0.
+    '''
+    def __init__(self, cpu, console, input=None):
+        '''
+        :param cpu: Процессор
+        :param console: BufferedConsole для вывода
+        :param input: FileInput для ввода (по умолчанию ввод пуст)
+        '''
+        self.cpu = cpu
+        self.console = console
+        self.input = input if input is not None else FileInput()
+
+    def call(self, port, value):
+        '''
+        Обработчик OUT порта BDOS: выполняет функцию из регистра C.
+        Запись не из заглушки по адресу CPM_BDOS игнорируется
+        '''
+        cpu = self.cpu
+        if cpu.pc != CPM_BDOS + 2:     # После OUT заглушки PC указывает на её RET
+            return
+        r = cpu.r
+        function = r[1]
+        result = 0
+        if function == 0:
+            cpu.pc = 0      # Возврат в CP/M: по адресу 0 стоит HLT
+        elif function == 1:
+            result = self.input.read_byte()
+            self.console.write(0, result)
+        elif function == 2:
+            self.console.write(0, r[3])
+        elif function == 6:
+            if r[3] == 0xFF:
+                result = self.input.read_byte() if self.input.available() else 0
+            else:
+                self.console.write(0, r[3])
+        elif function == 9:
+            m = cpu._m
+            addr = cpu.de
+            end = addr
+            data = m.dump()
+            while end < 0x10000 and data[end] != 0x24:  # '$'
+                end += 1
+            self.console.write_bytes(data[addr:end])
+        elif function == 10:
+            self._read_line(cpu.de)
+        elif function == 11:
+            result = 0xFF if self.input.available() else 0
+        elif function == 12:
+            result = 0x22   # CP/M 2.2
+        r[7] = result & 0xFF    # Результат возвращается в A и в L (H = B = 0)
+        r[5] = result & 0xFF
+        r[4] = 0
+        r[0] = 0
+
+    def _read_line(self, addr):
+        m = self.cpu._m
+        size = m[addr]
+        count = 0
+        while count < size and self.input.available():
+            c = self.input.read_byte()
+            if c in (0x0A, 0x0D):   # Строка заканчивается переводом строки
+                break
+            m[addr + 2 + count] = c
+            count += 1
+        m[addr + 1] = count
+
+
+def setup_cpm(m, port=BDOS_PORT):
+    '''
+    Готовит нулевую страницу CP/M в памяти m: HLT по адресу 0 (выход в CP/M
+    останавливает процессор) и переход на заглушку BDOS по адресу 5, а по адресу
+    CPM_STACK - нулевой адрес возврата, чтобы программа могла завершиться командой RET.
+    Если port задан, заглушка - OUT port / RET (вызов обрабатывает BDOS), иначе
+    только RET (вызовы BDOS ничего не делают).
+    '''
+    m.load(bytes([0x76, 0, 0, 0, 0, 0xC3, CPM_BDOS & 0xFF, CPM_BDOS >> 8]))   # HLT; JMP BDOS
+    if port is None:
+        m.load(bytes([0xC9]), CPM_BDOS)                     # RET
+    else:
+        m.load(bytes([0xD3, port, 0xC9]), CPM_BDOS)         # OUT port; RET
+    m.load(bytes(2), CPM_STACK)
+
+
+def run_cpm(image, output=None, input=None, cycles=None, runner=None):
+    '''
+    Загружает программу CP/M image в новую машину и выполняет её до выхода в CP/M
+    (или cycles тактов). output - поток для вывода (по умолчанию вывод накапливается),
+    input - FileInput. Возвращает (RunResult, BufferedConsole).
+    '''
+    from cpu import CPU
+    from memory import Memory
+    m = Memory()
+    setup_cpm(m)
+    m.load(image, CPM_START)
+    p = CPU(m)
+    p.pc = CPM_START
+    p.sp = CPM_STACK
+    console = BufferedConsole(output)
+    bus = IOBus()
+    bus.register(BDOS_PORT, write=BDOS(p, console, input).call)
+    bus.attach(p)
+    if runner is not None:
+        runner = runner(p)
+    else:
+        runner = p
+    try:
+        result = runner.run_for(cycles=float('inf') if cycles is None else cycles)
+    finally:
+        console.flush()
+    return result, console
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a CP/M .COM program without a terminal')
+    parser.add_argument('path', help='CP/M program (.COM)')
+    parser.add_argument('--input', help='file to use as console input')
+    parser.add_argument('--cycles', type=int, default=None, help='stop after this many cycles')
+    parser.add_argument('--blocks', action='store_true', help='use translated blocks')
+    args = parser.parse_args()
+    with open(args.path, 'rb') as f:
+        image = f.read()
+    runner = None
+    if args.blocks:
+        from translator import BlockCache
+        runner = BlockCache
+    stream = getattr(sys.stdout, 'buffer', sys.stdout)
+    result, console = run_cpm(image, stream, FileInput(args.input) if args.input else None, args.cycles, runner)
+    sys.stderr.write('\n%s\n' % result)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,482 @@
+import mmap
+import os
+
+MEMORY_SIZE = 0x10000   # Размер адресного пространства i8080 - 64 КБ
+ADDRESS_MASK = 0xFFFF
+PAGE_SHIFT = 8          # Страница памяти - 256 байт
+PAGE_SIZE = 1 << PAGE_SHIFT
+PAGE_COUNT = MEMORY_SIZE >> PAGE_SHIFT
+
+
 class InvalidMemoryAddressError(Exception):
     pass
 
+def _ignore_write(addr, val):
+    pass
+
 class Memory:
-    def __init__(self):
+    '''
+    Память i8080: 65536 байт.
+    Адреса при обращении через m[addr] маскируются до 16 бит, поэтому
+    выход за 0xFFFF переходит в начало памяти, как у настоящего процессора.
+
+    Для быстрого доступа процессор использует атрибуты read(addr) и write(addr, val),
+    ожидающие уже замаскированный адрес. Пока за записью никто не наблюдает, это
+    методы самого буфера и вызов не проходит через код на Python.
+
+    Поверх буфера может быть задана карта страниц (по 256 байт): страница может
+    быть ОЗУ (по умолчанию), ПЗУ, зеркалом другой области или устройством.
+    Чтение остаётся прямым обращением к буферу, пока нет страниц устройств и
+    зеркал; запись при наличии ПЗУ стоит одного просмотра таблицы страниц.
+    Операции load() и dump() работают с буфером напрямую, минуя карту.
+
+    Учёт изменённых страниц (track_dirty) отмечает в битовой карте страницы, в
+    которые шла запись; dirty_pages() перечисляет их с последней очистки, что
+    позволяет снимать снимки только изменённых страниц и перерисовывать только
+    изменённую часть экрана. Выключенный учёт ничего не стоит: запись остаётся
+    методом буфера.
+    '''
+    def __init__(self, image=None, at=0):
+        '''
+        :param image: Образ (bytes, bytearray, memoryview), загружаемый в память
+        :param at: Адрес загрузки образа
+        '''
+        self._init_buffer(bytearray(MEMORY_SIZE))
+        if image is not None:
+            self.load(image, at)
+
+    @classmethod
+    def map_file(cls, path, writable=False):
+        '''
+        Создаёт память, отображённую (mmap) на файл образа размером 64 КБ.
+        Если writable ложно, запись в память не попадает в файл, а страницы,
+        в которые ничего не записывалось, разделяются всеми машинами (и процессами),
+        отобразившими тот же файл. Если writable истинно, запись идёт прямо в файл.
+        '''
+        fd = os.open(path, os.O_RDWR if writable else os.O_RDONLY)
+        try:
+            if os.fstat(fd).st_size != MEMORY_SIZE:
+                msg = 'Error: memory image must be exactly %d bytes' % MEMORY_SIZE
+                raise InvalidMemoryAddressError(msg)
+            mm = mmap.mmap(fd, MEMORY_SIZE, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_COPY)
+        finally:
+            os.close(fd)
+        m = cls.__new__(cls)
+        m._init_buffer(mm, mm)
+        return m
+
+    def _init_buffer(self, buff, mm=None):
+        '''
+        Инициализирует память над буфером buff (bytearray или mmap)
+        '''
         # Memory
-        self._buff = bytearray(0xffff)
+        self._buff = buff
+        self._mmap = mm
+        self._view = memoryview(buff)
+        # Наблюдение за записью: кортежи обработчиков по страницам и список наблюдателей
+        self._callbacks = None
+        self._watchers = []
+        self._ranges = {}       # callback -> (обёртка, start) для watch_range() с невыровненными границами
+        # Учёт изменённых страниц: по байту на страницу (None - учёт выключен)
+        self._dirty = None
+        # Обёртки функций доступа (профилировщик, отладчик): список (владелец, обёртка read, обёртка write)
+        self._hooks = []
+        # Карта страниц: обработчики чтения и записи для каждой страницы (None - обычное ОЗУ)
+        self._read_map = [None] * PAGE_COUNT
+        self._write_map = [None] * PAGE_COUNT
+        self._mapped_reads = False
+        self._mapped_writes = False
+        self._mirrors = []      # Обработчики зеркал (delta, read, write), нужны copy()
+        self._update_access()
+
+    def copy(self):
+        '''
+        Возвращает независимую копию памяти: содержимое копируется в новый буфер,
+        карта страниц переносится (устройства остаются общими, зеркала строятся заново
+        над новым буфером). Наблюдатели за записью, учёт изменённых страниц и обёртки
+        функций доступа не копируются.
+        '''
+        m = Memory.__new__(Memory)
+        m._init_buffer(bytearray(self._buff))
+        if self._mapped_reads or self._mapped_writes:
+            rebind = {}
+            for delta, read, write in self._mirrors:
+                new_read, new_write = m._mirror_handlers(delta)
+                rebind[read] = new_read
+                rebind[write] = new_write
+            m._read_map[:] = [rebind.get(h, h) for h in self._read_map]
+            m._write_map[:] = [rebind.get(h, h) for h in self._write_map]
+            m._mirrors = [(delta, rebind[read], rebind[write]) for delta, read, write in self._mirrors]
+            m._mapped_reads = self._mapped_reads
+            m._mapped_writes = self._mapped_writes
+            m._update_access()
+        return m
+
+    def close(self):
+        '''
+        Освобождает отображение файла (для памяти, созданной map_file)
+        '''
+        if self._mmap is not None:
+            self._view.release()
+            self._mmap.close()
+            self._mmap = None
+
+    def _update_access(self):
+        '''
+        Выбирает функции read и write в зависимости от карты страниц
+        и от того, наблюдает ли кто-нибудь за записью
+        '''
+        if self._mapped_reads:
+            self.read = self._read_mapped
+        else:
+            self.read = self._buff.__getitem__
+        if self._callbacks is not None or (self._dirty is not None and self._mapped_writes):
+            self.write = self._write_watched
+        elif self._dirty is not None:
+            buff = self._buff
+            dirty = self._dirty
+
+            def write_dirty(addr, val):
+                buff[addr] = val
+                dirty[addr >> PAGE_SHIFT] = 1
+            self.write = write_dirty
+        elif self._mapped_writes:
+            self.write = self._write_mapped
+        else:
+            self.write = self._buff.__setitem__
+        for owner, wrap_read, wrap_write in self._hooks:
+            if wrap_read is not None:
+                self.read = wrap_read(self.read)
+            if wrap_write is not None:
+                self.write = wrap_write(self.write)
+
+    def hook_access(self, owner, read=None, write=None):
+        '''
+        Ставит обёртки над функциями доступа: read(функция чтения) и write(функция записи)
+        возвращают новые функции, вызывающие переданные. Обёртки применяются поверх
+        карты страниц, наблюдения и учёта изменений и сохраняются, когда те меняются.
+        Повторный вызов с тем же owner заменяет его обёртки.
+        '''
+        self._hooks = [hook for hook in self._hooks if hook[0] is not owner]
+        self._hooks.append((owner, read, write))
+        self._update_access()
+
+    def unhook_access(self, owner):
+        '''
+        Снимает обёртки, поставленные hook_access(owner, ...)
+        '''
+        self._hooks = [hook for hook in self._hooks if hook[0] is not owner]
+        self._update_access()
+
+    def _read_mapped(self, addr):
+        handler = self._read_map[addr >> PAGE_SHIFT]
+        if handler is None:
+            return self._buff[addr]
+        return handler(addr)
+
+    def _write_mapped(self, addr, val):
+        handler = self._write_map[addr >> PAGE_SHIFT]
+        if handler is None:
+            self._buff[addr] = val
+        else:
+            handler(addr, val)
+
+    def _pages(self, start, end):
+        '''
+        Проверяет, что область [start, end) выровнена по страницам, и возвращает номера её страниц
+        '''
+        if start % PAGE_SIZE or end % PAGE_SIZE or not 0 <= start < end <= MEMORY_SIZE:
+            raise ValueError('region [%s, %s) must be page aligned' % (hex(start), hex(end)))
+        return range(start >> PAGE_SHIFT, end >> PAGE_SHIFT)
+
+    def _set_pages(self, start, end, read, write):
+        for page in self._pages(start, end):
+            self._read_map[page] = read
+            self._write_map[page] = write
+        self._mapped_reads = any(h is not None for h in self._read_map)
+        self._mapped_writes = any(h is not None for h in self._write_map)
+        self._update_access()
+
+    def map_ram(self, start, end):
+        '''
+        Делает область [start, end) обычным ОЗУ
+        '''
+        self._set_pages(start, end, None, None)
+
+    def map_rom(self, start, end, image=None, on_write=None):
+        '''
+        Делает область [start, end) ПЗУ и, если задан image, загружает в неё образ.
+        Запись в ПЗУ игнорируется; если задан on_write, вызывается on_write(addr, val)
+        (например, чтобы выбросить исключение).
+        '''
+        self._pages(start, end)
+        if image is not None:
+            self.load(image, start)
+        self._set_pages(start, end, None, on_write or _ignore_write)
+
+    def map_mirror(self, start, end, target):
+        '''
+        Делает область [start, end) зеркалом области, начинающейся с адреса target:
+        чтение и запись по адресу a обращаются к адресу a - start + target.
+        '''
+        delta = start - target
+        self._pages(target, target + end - start)
+        read, write = self._mirror_handlers(delta)
+        self._set_pages(start, end, read, write)
+        self._mirrors.append((delta, read, write))
+
+    def _mirror_handlers(self, delta):
+        '''
+        Строит обработчики чтения и записи зеркала со смещением delta
+        '''
+        buff = self._buff
+        read_map = self._read_map
+        write_map = self._write_map
+        memory = self
+
+        def read(addr):
+            addr -= delta
+            handler = read_map[addr >> PAGE_SHIFT]
+            return buff[addr] if handler is None else handler(addr)
+
+        def write(addr, val):
+            addr -= delta
+            handler = write_map[addr >> PAGE_SHIFT]
+            if handler is None:
+                buff[addr] = val
+                # Изменилась страница, на которую указывает зеркало: её наблюдатели тоже уведомляются
+                page = addr >> PAGE_SHIFT
+                if memory._dirty is not None:
+                    memory._dirty[page] = 1
+                if memory._callbacks is not None:
+                    for callback in memory._callbacks[page]:
+                        callback(addr)
+            else:
+                handler(addr, val)
+        return read, write
+
+    def map_device(self, start, end, read=None, write=None):
+        '''
+        Подключает к области [start, end) устройство: чтение возвращает read(addr),
+        запись вызывает write(addr, val). Если read не задан, читается содержимое буфера;
+        если не задан write, запись игнорируется.
+        '''
+        self._set_pages(start, end, read, write or _ignore_write)
+
+    def page_kind(self, page):
+        '''
+        Возвращает тип страницы page: 'ram', 'rom' или 'mapped' (зеркало или устройство)
+        '''
+        if self._read_map[page] is None:
+            if self._write_map[page] is None:
+                return 'ram'
+            if self._write_map[page] is _ignore_write:
+                return 'rom'
+        return 'mapped'
+
+    def __len__(self):
+        return MEMORY_SIZE
 
     def __getitem__(self, addr):
-        if addr < 0x0 or addr > 0xffff:
-            msg = 'Error: list index out of range'
-            raise InvalidMemoryAddressError(msg)
-        return self._buff[addr]
+        return self.read(addr & ADDRESS_MASK)
 
     def __setitem__(self, addr, val):
-        if addr < 0x0 or addr > 0xffff:
-            msg = 'Error: list index out of range'
+        self.write(addr & ADDRESS_MASK, val & 0xFF)
+
+    def load(self, image, at=0):
+        '''
+        Записывает образ image (bytes, bytearray, memoryview или список байтов) в память по адресу at.
+        Наблюдатели за записью уведомляются о первом адресе каждой затронутой страницы,
+        наблюдатели watch_range() с невыровненными границами - о первом адресе в своей области.
+        '''
+        data = memoryview(bytes(image) if isinstance(image, (list, tuple)) else image).cast('B')
+        at &= ADDRESS_MASK
+        end = at + len(data)
+        if end > MEMORY_SIZE:
+            msg = 'Error: image of %d bytes does not fit at %s' % (len(data), hex(at))
             raise InvalidMemoryAddressError(msg)
-        self._buff[addr] = val
+        self._view[at:end] = data
+        if self._dirty is not None and end > at:
+            first = at >> PAGE_SHIFT
+            last = end - 1 >> PAGE_SHIFT
+            self._dirty[first:last + 1] = b'\x01' * (last + 1 - first)
+        callbacks = self._callbacks     # Наблюдатели могут сняться (и обнулить _callbacks) во время цикла
+        if callbacks is not None:
+            bounds = dict(self._ranges.values())
+            for page in range(at >> PAGE_SHIFT, (end - 1 >> PAGE_SHIFT) + 1):
+                first = max(at, page << PAGE_SHIFT)
+                for callback in callbacks[page]:
+                    addr = max(first, bounds.get(callback, first))
+                    if addr < end:
+                        callback(addr)
+
+    def dump(self, start=0, end=MEMORY_SIZE):
+        '''
+        Возвращает memoryview на область памяти [start, end) без копирования.
+        Для получения независимой копии используйте bytes(m.dump(...)).
+        '''
+        return self._view[start:end]
+
+    def _write_watched(self, addr, val):
+        handler = self._write_map[addr >> PAGE_SHIFT]
+        if handler is None:
+            self._buff[addr] = val
+        else:
+            handler(addr, val)
+        page = addr >> PAGE_SHIFT
+        if self._dirty is not None:
+            self._dirty[page] = 1
+        if self._callbacks is not None:
+            for callback in self._callbacks[page]:
+                callback(addr)
+
+    def _update_callbacks(self):
+        '''
+        Перестраивает кортежи обработчиков по страницам по списку наблюдателей
+        '''
+        if not self._watchers:
+            self._callbacks = None
+        else:
+            callbacks = [()] * PAGE_COUNT
+            for pages, callback in self._watchers:
+                for page in pages:
+                    callbacks[page] += (callback,)
+            self._callbacks = callbacks
+        self._update_access()
+
+    def watch_writes(self, pages, callback):
+        '''
+        Вызывает callback(addr) при каждой записи в страницы pages (номера страниц по 256 байт)
+        Повторный вызов с тем же callback добавляет страницы к уже наблюдаемым.
+        '''
+        for entry in self._watchers:
+            if entry[1] == callback:
+                new = set(pages) - entry[0]
+                entry[0].update(new)
+                break
+        else:
+            self._watchers.append((set(pages), callback))
+        self._update_callbacks()
+
+    def unwatch_writes(self, callback, pages=None):
+        '''
+        Прекращает наблюдение callback за страницами pages (по умолчанию - за всеми)
+        '''
+        for entry in self._watchers:
+            if entry[1] == callback:
+                if pages is None:
+                    entry[0].clear()
+                else:
+                    entry[0].difference_update(pages)
+                if not entry[0]:
+                    self._watchers.remove(entry)
+                break
+        self._update_callbacks()
+
+    def watch_range(self, start, end, callback):
+        '''
+        Вызывает callback(addr) при каждой записи в область [start, end), например в
+        видеопамять 2400H-3FFFH. Для области, выровненной по страницам, callback
+        вызывается напрямую, без дополнительных проверок адреса. Повторный вызов с тем
+        же callback допустим только для выровненных областей (страницы добавляются).
+        '''
+        if not 0 <= start < end <= MEMORY_SIZE:
+            raise ValueError('invalid region [%s, %s)' % (hex(start), hex(end)))
+        pages = range(start >> PAGE_SHIFT, (end - 1 >> PAGE_SHIFT) + 1)
+        handler = callback
+        unaligned = start % PAGE_SIZE or end % PAGE_SIZE
+        if callback in self._ranges or unaligned and any(entry[1] == callback for entry in self._watchers):
+            raise ValueError('callback already watches an unaligned range or other pages')
+        if unaligned:
+            def handler(addr):
+                if start <= addr < end:
+                    callback(addr)
+            self._ranges[callback] = (handler, start)
+        self.watch_writes(pages, handler)
+
+    def unwatch_range(self, callback):
+        '''
+        Прекращает наблюдение, заданное watch_range(..., callback)
+        '''
+        self.unwatch_writes(self._ranges.pop(callback, (callback,))[0])
+
+    def track_dirty(self, enabled=True):
+        '''
+        Включает (с пустой картой) или выключает учёт изменённых страниц
+        '''
+        self._dirty = bytearray(PAGE_COUNT) if enabled else None
+        self._update_access()
+
+    @property
+    def tracking_dirty(self):
+        return self._dirty is not None
+
+    def dirty_pages(self, clear=False):
+        '''
+        Возвращает номера страниц, в которые была запись с включения учёта или с
+        последней очистки (clear_dirty() или clear=True). Страницы ПЗУ и устройств
+        попадают в список при любой попытке записи.
+        '''
+        dirty = self._dirty
+        if dirty is None:
+            raise ValueError('dirty page tracking is off (use track_dirty())')
+        pages = [page for page, flag in enumerate(dirty) if flag]
+        if clear:
+            self.clear_dirty()
+        return pages
+
+    def clear_dirty(self):
+        '''
+        Очищает карту изменённых страниц (контрольная точка)
+        '''
+        if self._dirty is not None:
+            self._dirty[:] = bytes(PAGE_COUNT)
+
+
+def measure_access(memory, count=1000000):
+    '''
+    Измеряет среднее время (в наносекундах) вызова memory.read и memory.write
+    по всем адресам памяти. Возвращает пару (read_ns, write_ns).
+    '''
+    import timeit
+    addrs = [i & ADDRESS_MASK for i in range(count)]
+    read = memory.read
+    write = memory.write
+
+    def reads():
+        for a in addrs:
+            read(a)
+
+    def writes():
+        for a in addrs:
+            write(a, 0)
+    loop = timeit.timeit(lambda: [None for a in addrs], number=1)
+    read_ns = (timeit.timeit(reads, number=1) - loop) * 1e9 / count
+    write_ns = (timeit.timeit(writes, number=1) - loop) * 1e9 / count
+    return read_ns, write_ns
+
+
+def main():
+    '''
+    Сравнивает стоимость обращений к ОЗУ без карты страниц, с ПЗУ, с устройством,
+    с учётом изменённых страниц и с наблюдением за видеопамятью
+    '''
+    plain = Memory()
+    rom = Memory()
+    rom.map_rom(0x0000, 0x2000)
+    device = Memory()
+    device.map_rom(0x0000, 0x2000)
+    device.map_device(0xFF00, 0x10000, read=lambda addr: 0xFF)
+    dirty = Memory()
+    dirty.track_dirty()
+    video = Memory()
+    video.track_dirty()
+    video.watch_range(0x2400, 0x4000, lambda addr: None)
+    for name, m in (('plain RAM', plain), ('with ROM', rom), ('with ROM+device', device),
+                    ('dirty tracking', dirty), ('video watch', video)):
+        read_ns, write_ns = measure_access(m)
+        print('%-16s read %6.1f ns  write %6.1f ns' % (name, read_ns, write_ns))
+
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+'''
+Таблица кодов операций i8080.
+Для каждого из 256 кодов хранит мнемонику, операнды, длину и время выполнения.
+Таблица строится один раз при импорте модуля.
+'''
+
+REGISTER_NAMES = 'BCDEHLMA'     # Имена регистров в порядке их кодирования в поле SSS/DDD
+PAIR_NAMES_1 = ['B', 'D', 'H', 'SP']      # Регистровые пары для LXI, INX, DCX, DAD
+PAIR_NAMES_2 = ['B', 'D', 'H', 'PSW']     # Регистровые пары для PUSH, POP
+CONDITIONS = ['NZ', 'Z', 'NC', 'C', 'PO', 'PE', 'P', 'M']
+ALU_NAMES = ['ADD', 'ADC', 'SUB', 'SBB', 'ANA', 'XRA', 'ORA', 'CMP']
+ALU_IMM_NAMES = ['ADI', 'ACI', 'SUI', 'SBI', 'ANI', 'XRI', 'ORI', 'CPI']
+ROTATE_NAMES = ['RLC', 'RRC', 'RAL', 'RAR', 'DAA', 'CMA', 'STC', 'CMC']
+
+D8 = 'd8'       # Операнд - байт данных
+D16 = 'd16'     # Операнд - 16-битное слово данных
+A16 = 'a16'     # Операнд - 16-битный адрес
+
+# Группы команд, как в руководстве Intel по i8080
+GROUP_TRANSFER = 'transfer'         # Пересылка данных
+GROUP_ARITHMETIC = 'arithmetic'     # Арифметические
+GROUP_LOGICAL = 'logical'           # Логические и сдвиги
+GROUP_BRANCH = 'branch'             # Переходы, вызовы, возвраты
+GROUP_CONTROL = 'control'           # Стек, ввод-вывод, управление процессором
+GROUPS = [GROUP_TRANSFER, GROUP_ARITHMETIC, GROUP_LOGICAL, GROUP_BRANCH, GROUP_CONTROL]
+_GROUP_MNEMONICS = {
+    GROUP_TRANSFER: 'MOV MVI LXI LDA STA LHLD SHLD LDAX STAX XCHG',
+    GROUP_ARITHMETIC: 'ADD ADI ADC ACI SUB SUI SBB SBI INR DCR INX DCX DAD DAA',
+    GROUP_LOGICAL: 'ANA ANI XRA XRI ORA ORI CMP CPI RLC RRC RAL RAR CMA CMC STC',
+    GROUP_BRANCH: 'JMP CALL RET PCHL RST',
+}
+
+
+class Opcode:
+    '''
+    Описание одного кода операции.
+    '''
+    __slots__ = ('code', 'mnemonic', 'operands', 'length', 'cycles', 'cycles_taken', 'documented', 'group')
+
+    def __init__(self, code, mnemonic, operands=(), length=1, cycles=4, cycles_taken=None, documented=True):
+        '''
+        :param code: Код операции
+        :param mnemonic: Мнемоника
+        :param operands: Кортеж операндов (имена регистров или D8/D16/A16)
+        :param length: Длина инструкции в байтах
+        :param cycles: Время выполнения в тактах
+        :param cycles_taken: Время выполнения условной инструкции при выполненном условии
+        :param documented: False для недокументированных дублей
+        '''
+        self.code = code
+        self.mnemonic = mnemonic
+        self.operands = tuple(operands)
+        self.length = length
+        self.cycles = cycles
+        self.cycles_taken = cycles if cycles_taken is None else cycles_taken
+        self.documented = documented
+        self.group = opcode_group(mnemonic)
+
+    def text(self, data=0):
+        '''
+        Возвращает текстовое представление инструкции.
+        data - значение непосредственного операнда (если он есть).
+        '''
+        if not self.operands:
+            return self.mnemonic
+        args = []
+        for o in self.operands:
+            if o == D8:
+                args.append(hex_number(data & 0xFF, 2))
+            elif o == D16 or o == A16:
+                args.append(hex_number(data & 0xFFFF, 4))
+            else:
+                args.append(o)
+        return '%s %s' % (self.mnemonic, ', '.join(args))
+
+    def __repr__(self):
+        return 'Opcode(%s, %r)' % (hex(self.code), self.text())
+
+
+def hex_number(v, digits):
+    '''
+    Записывает число в шестнадцатеричном виде в нотации ассемблера Intel (например 0FFH)
+    '''
+    s = '%0*XH' % (digits, v)
+    if not s[0].isdigit():
+        s = '0' + s
+    return s
+
+
+def opcode_group(mnemonic):
+    '''
+    Возвращает группу команды (одну из GROUPS) по её мнемонике
+    '''
+    for group, mnemonics in _GROUP_MNEMONICS.items():
+        if mnemonic in mnemonics.split():
+            return group
+    if mnemonic[0] in 'JCR' and mnemonic[1:] in CONDITIONS:
+        return GROUP_BRANCH
+    return GROUP_CONTROL
+
+
+def split_opcode(opcode):
+    '''
+    Разделяет значение opcode на группы битов XX, YYY, ZZZ
+    '''
+    return opcode >> 6, (opcode >> 3) & 0b111, opcode & 0b111
+
+
+def _describe(op):
+    '''
+    Строит описание Opcode для кода op
+    '''
+    xx, yyy, zzz = split_opcode(op)
+    if xx == 0b00:
+        if zzz == 0b000:
+            return Opcode(op, 'NOP', documented=(yyy == 0))
+        if zzz == 0b001:
+            if yyy & 1 == 0:
+                return Opcode(op, 'LXI', (PAIR_NAMES_1[yyy >> 1], D16), 3, 10)
+            return Opcode(op, 'DAD', (PAIR_NAMES_1[yyy >> 1],), 1, 10)
+        if zzz == 0b010:
+            if yyy < 4:
+                return Opcode(op, 'LDAX' if yyy & 1 else 'STAX', (PAIR_NAMES_1[yyy >> 1],), 1, 7)
+            mnemonic, cycles = [('SHLD', 16), ('LHLD', 16), ('STA', 13), ('LDA', 13)][yyy - 4]
+            return Opcode(op, mnemonic, (A16,), 3, cycles)
+        if zzz == 0b011:
+            return Opcode(op, 'DCX' if yyy & 1 else 'INX', (PAIR_NAMES_1[yyy >> 1],), 1, 5)
+        if zzz == 0b100 or zzz == 0b101:
+            return Opcode(op, 'INR' if zzz == 0b100 else 'DCR', (REGISTER_NAMES[yyy],), 1, 10 if yyy == 6 else 5)
+        if zzz == 0b110:
+            return Opcode(op, 'MVI', (REGISTER_NAMES[yyy], D8), 2, 10 if yyy == 6 else 7)
+        return Opcode(op, ROTATE_NAMES[yyy])
+    if xx == 0b01:
+        if yyy == 0b110 and zzz == 0b110:
+            return Opcode(op, 'HLT', (), 1, 7)
+        return Opcode(op, 'MOV', (REGISTER_NAMES[yyy], REGISTER_NAMES[zzz]), 1, 7 if 6 in (yyy, zzz) else 5)
+    if xx == 0b10:
+        return Opcode(op, ALU_NAMES[yyy], (REGISTER_NAMES[zzz],), 1, 7 if zzz == 6 else 4)
+    if zzz == 0b000:
+        return Opcode(op, 'R' + CONDITIONS[yyy], (), 1, 5, 11)
+    if zzz == 0b001:
+        if yyy & 1 == 0:
+            return Opcode(op, 'POP', (PAIR_NAMES_2[yyy >> 1],), 1, 10)
+        if yyy == 0b001 or yyy == 0b011:
+            return Opcode(op, 'RET', (), 1, 10, documented=(yyy == 0b001))
+        if yyy == 0b101:
+            return Opcode(op, 'PCHL', (), 1, 5)
+        return Opcode(op, 'SPHL', (), 1, 5)
+    if zzz == 0b010:
+        return Opcode(op, 'J' + CONDITIONS[yyy], (A16,), 3, 10)
+    if zzz == 0b011:
+        if yyy <= 0b001:
+            return Opcode(op, 'JMP', (A16,), 3, 10, documented=(yyy == 0))
+        if yyy == 0b010:
+            return Opcode(op, 'OUT', (D8,), 2, 10)
+        if yyy == 0b011:
+            return Opcode(op, 'IN', (D8,), 2, 10)
+        if yyy == 0b100:
+            return Opcode(op, 'XTHL', (), 1, 18)
+        if yyy == 0b101:
+            return Opcode(op, 'XCHG', (), 1, 4)
+        return Opcode(op, 'DI' if yyy == 0b110 else 'EI')
+    if zzz == 0b100:
+        return Opcode(op, 'C' + CONDITIONS[yyy], (A16,), 3, 11, 17)
+    if zzz == 0b101:
+        if yyy & 1 == 0:
+            return Opcode(op, 'PUSH', (PAIR_NAMES_2[yyy >> 1],), 1, 11)
+        return Opcode(op, 'CALL', (A16,), 3, 17, documented=(yyy == 0b001))
+    if zzz == 0b110:
+        return Opcode(op, ALU_IMM_NAMES[yyy], (D8,), 2, 7)
+    return Opcode(op, 'RST', (str(yyy),), 1, 11)
+
+
+OPCODES = [_describe(op) for op in range(256)]
@@ -0,0 +1,258 @@
+'''
+Профилирование программ i8080.
+Профилировщик считает число выполнений и такты по кодам операций и по адресам
+инструкций, частоту переходов (откуда - куда) и число чтений и записей по
+страницам памяти (по 256 байт). Дополнительно он следит за вызовами CALL/RST и
+возвратами и накапливает такты по стекам вызовов для построения flamegraph.
+
+Профилирование включается подменой таблицы обработчиков процессора на обёртки
+(CPU.hook_handlers) и обёртками функций read/write памяти (Memory.hook_access),
+поэтому выключенный профилировщик ничего не стоит. Считаются инструкции,
+выполненные через таблицу обработчиков процессора (step, run, run_for, run_until);
+блоки translator выполняются мимо неё и попадают только в счётчики обращений к
+памяти (без чтения самих инструкций: их коды и операнды подставлены в блок).
+'''
+import json
+
+from dispatch import StopExecution, STOP_WAIT
+from memory import PAGE_SHIFT, PAGE_COUNT
+from opcodes import OPCODES, GROUP_BRANCH
+
+
+class Profiler:
+    '''
+    Профилировщик одного процессора.
+    '''
+    def __init__(self, symbols=None):
+        '''
+        :param symbols: Словарь {адрес: имя} для подписи адресов в отчёте и flamegraph
+        '''
+        self.symbols = dict(symbols or {})
+        self._cpu = None
+        self.opcode_counts = [0] * 256
+        self.opcode_cycles = [0] * 256
+        self.pc_counts = [0] * 0x10000
+        self.pc_cycles = [0] * 0x10000
+        self.branches = {}              # (адрес перехода << 16 | адрес назначения) -> число переходов
+        self.page_reads = [0] * PAGE_COUNT
+        self.page_writes = [0] * PAGE_COUNT
+        self.stacks = {}                # Стек вызовов (кортеж адресов) -> такты
+        self._stack = ()
+
+    def reset(self):
+        '''
+        Обнуляет все счётчики (в том числе во время профилирования)
+        '''
+        for counts in (self.opcode_counts, self.opcode_cycles, self.pc_counts, self.pc_cycles,
+                       self.page_reads, self.page_writes):
+            counts[:] = [0] * len(counts)
+        self.branches.clear()
+        self.stacks.clear()
+        self._stack = ()
+
+    def attach(self, cpu):
+        '''
+        Включает профилирование процессора cpu
+        '''
+        if self._cpu is not None:
+            self.detach()
+        self._cpu = cpu
+        cpu.hook_handlers(self, self._wrap)
+        page_reads = self.page_reads
+        page_writes = self.page_writes
+
+        def wrap_read(read):
+            def counting_read(addr):
+                page_reads[addr >> PAGE_SHIFT] += 1
+                return read(addr)
+            return counting_read
+
+        def wrap_write(write):
+            def counting_write(addr, val):
+                page_writes[addr >> PAGE_SHIFT] += 1
+                write(addr, val)
+            return counting_write
+        cpu._m.hook_access(self, wrap_read, wrap_write)
+
+    def detach(self):
+        '''
+        Выключает профилирование; счётчики сохраняются
+        '''
+        cpu = self._cpu
+        if cpu is None:
+            return
+        cpu.unhook_handlers(self)
+        cpu._m.unhook_access(self)
+        self._cpu = None
+
+    def _wrap(self, handlers):
+        '''
+        Строит таблицу обработчиков-обёрток над handlers, обновляющих счётчики
+        '''
+        opcode_counts = self.opcode_counts
+        opcode_cycles = self.opcode_cycles
+        pc_counts = self.pc_counts
+        pc_cycles = self.pc_cycles
+        branches = self.branches
+        stacks = self.stacks
+        profiler = self
+
+        def record(op, pc, cycles):
+            opcode_counts[op] += 1
+            opcode_cycles[op] += cycles
+            pc_counts[pc] += 1
+            pc_cycles[pc] += cycles
+            stack = profiler._stack
+            stacks[stack] = stacks.get(stack, 0) + cycles
+
+        def wrap(op, handler):
+            info = OPCODES[op]
+            length = info.length
+            branch = info.group == GROUP_BRANCH
+            call = branch and (info.mnemonic == 'RST' or info.mnemonic[0] == 'C')
+            ret = branch and info.mnemonic[0] == 'R' and info.mnemonic != 'RST'
+
+            def profiled(cpu):
+                pc = cpu.pc
+                try:
+                    cycles = handler(cpu)
+                except StopExecution as e:
+                    if e.reason != STOP_WAIT:   # IN неготового устройства выполнится заново
+                        record(op, pc, e.cycles)
+                    raise
+                record(op, pc, cycles)
+                if branch:
+                    target = cpu.pc
+                    if target != (pc + length) & 0xFFFF:
+                        key = pc << 16 | target
+                        branches[key] = branches.get(key, 0) + 1
+                        if call:
+                            profiler._stack = profiler._stack + (target,)
+                        elif ret and profiler._stack:
+                            profiler._stack = profiler._stack[:-1]
+                return cycles
+            return profiled
+        return [wrap(op, h) for op, h in enumerate(handlers)]
+
+    def name(self, addr):
+        '''
+        Возвращает имя адреса addr: символ, если он задан, иначе шестнадцатеричный адрес
+        '''
+        return self.symbols.get(addr, '%04X' % addr)
+
+    def top_opcodes(self, n=None):
+        '''
+        Возвращает список (код, число выполнений, такты), отсортированный по убыванию тактов
+        '''
+        items = [(op, self.opcode_counts[op], self.opcode_cycles[op]) for op in range(256) if self.opcode_counts[op]]
+        items.sort(key=lambda item: -item[2])
+        return items[:n]
+
+    def top_addresses(self, n=None):
+        '''
+        Возвращает список (адрес, число выполнений, такты), отсортированный по убыванию тактов
+        '''
+        items = [(pc, self.pc_counts[pc], self.pc_cycles[pc]) for pc in range(0x10000) if self.pc_counts[pc]]
+        items.sort(key=lambda item: -item[2])
+        return items[:n]
+
+    def top_branches(self, n=None):
+        '''
+        Возвращает список (откуда, куда, число переходов), отсортированный по убыванию числа переходов
+        '''
+        items = [(key >> 16, key & 0xFFFF, count) for key, count in self.branches.items()]
+        items.sort(key=lambda item: -item[2])
+        return items[:n]
+
+    def hot_pages(self, n=None):
+        '''
+        Возвращает список (страница, чтений, записей), отсортированный по убыванию числа обращений
+        '''
+        items = [(page, self.page_reads[page], self.page_writes[page]) for page in range(PAGE_COUNT)
+                 if self.page_reads[page] or self.page_writes[page]]
+        items.sort(key=lambda item: -(item[1] + item[2]))
+        return items[:n]
+
+    def report(self, top=20):
+        '''
+        Возвращает текстовый отчёт (список строк) по top самых затратных элементов каждого вида
+        '''
+        total = sum(self.opcode_cycles) or 1
+        lines = ['%d instructions, %d cycles' % (sum(self.opcode_counts), sum(self.opcode_cycles)), '',
+                 'Opcodes:        count       cycles      %']
+        for op, count, cycles in self.top_opcodes(top):
+            lines.append('  %02X %-8s %10d %12d %6.2f' % (op, OPCODES[op].mnemonic, count, cycles, cycles * 100.0 / total))
+        lines += ['', 'Addresses:      count       cycles      %']
+        for pc, count, cycles in self.top_addresses(top):
+            lines.append('  %-12s %10d %12d %6.2f' % (self.name(pc), count, cycles, cycles * 100.0 / total))
+        lines += ['', 'Branches:                   count']
+        for source, target, count in self.top_branches(top):
+            lines.append('  %-12s -> %-12s %10d' % (self.name(source), self.name(target), count))
+        lines += ['', 'Pages:          reads      writes']
+        for page, reads, writes in self.hot_pages(top):
+            lines.append('  %04X-%04X %10d %12d' % (page << PAGE_SHIFT, (page + 1 << PAGE_SHIFT) - 1, reads, writes))
+        return lines
+
+    def to_dict(self):
+        '''
+        Возвращает все ненулевые счётчики в виде словаря, пригодного для записи в JSON
+        '''
+        return {
+            'opcodes': [{'opcode': op, 'mnemonic': OPCODES[op].mnemonic, 'count': count, 'cycles': cycles}
+                        for op, count, cycles in self.top_opcodes()],
+            'addresses': [{'address': pc, 'name': self.name(pc), 'count': count, 'cycles': cycles}
+                          for pc, count, cycles in self.top_addresses()],
+            'branches': [{'from': source, 'to': target, 'count': count}
+                         for source, target, count in self.top_branches()],
+            'pages': [{'page': page, 'reads': reads, 'writes': writes}
+                      for page, reads, writes in self.hot_pages()],
+        }
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def folded(self, root='main'):
+        '''
+        Возвращает строки в формате "кадр;кадр;кадр такты" (folded stacks),
+        который принимают flamegraph.pl, speedscope и подобные инструменты
+        '''
+        lines = []
+        for stack, cycles in sorted(self.stacks.items()):
+            if cycles:
+                lines.append(';'.join([root] + [self.name(addr) for addr in stack]) + ' %d' % cycles)
+        return lines
+
+    def write_folded(self, path, root='main'):
+        with open(path, 'w') as f:
+            f.write('\n'.join(self.folded(root)) + '\n')
+
+
+def main():
+    '''
+    Профилирует небольшую программу: цикл, вызывающий подпрограмму копирования
+    '''
+    from cpu import CPU
+    from memory import Memory
+    program = [0x31, 0x00, 0xF0,        # LXI SP, 0F000H
+               0xCD, 0x0A, 0x00,        # loop: CALL copy
+               0xC3, 0x03, 0x00,        # JMP loop
+               0x00,                    # NOP
+               0x21, 0x00, 0x10,        # copy: LXI H, 1000H
+               0x11, 0x00, 0x20,        # LXI D, 2000H
+               0x0E, 0x40,              # MVI C, 40H
+               0x7E, 0x12, 0x23, 0x13,  # next: MOV A, M; STAX D; INX H; INX D
+               0x0D, 0xC2, 0x12, 0x00,  # DCR C; JNZ next
+               0xC9]                    # RET
+    p = CPU(Memory(bytes(program)))
+    profiler = Profiler({0x0003: 'loop', 0x000A: 'copy', 0x0012: 'next'})
+    p.set_profiler(profiler)
+    p.run_for(cycles=200000)
+    p.set_profiler(None)
+    print('\n'.join(profiler.report(10)))
+    print()
+    print('\n'.join(profiler.folded()))
+
+
+if __name__ == '__main__':
+    main()
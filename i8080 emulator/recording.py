@@ -0,0 +1,362 @@
+'''
+Запись трассы выполнения в двоичном виде.
+Каждая выполненная инструкция даёт запись фиксированного размера (RECORD_SIZE байт):
+адрес и код инструкции, состояние после её выполнения (A, F, BC, DE, HL, SP) и
+счётчик тактов после неё. Записи пишутся struct.pack_into в заранее выделенный
+буфер: в кольцевой буфер в памяти (RingRecorder - хранятся последние capacity
+инструкций) или в файл, отображённый в память (FileRecorder - файл дописывается).
+
+Запись включается подменой таблицы обработчиков процессора на обёртки
+(CPU.hook_handlers, как профилирование), поэтому выключенная запись ничего не стоит.
+Такты в записи - cpu.cycles на начало пакета плюс такты инструкций пакета до неё
+включительно: внутри run_for() cpu.cycles обновляется только в конце пакета.
+Изменение cpu.cycles между инструкциями (новый пакет, прерывание, ожидание в HLT)
+регистратор замечает сам; CPU.reset() и CPU.restore() сообщают о нём через sync().
+
+TraceReader читает записи из буфера или файла: индексация, фильтр, поиск
+адреса и сравнение двух трасс (diff) - например, с трассой эталонного эмулятора.
+'''
+import mmap
+import os
+import struct
+
+from dispatch import StopExecution, STOP_WAIT
+
+MAGIC = b'I80T'
+VERSION = 1
+# Запись: PC, код операции, A, F, (выравнивание), BC, DE, HL, SP, такты, (выравнивание)
+RECORD = struct.Struct('<HBBBxHHHHQxx')
+RECORD_SIZE = RECORD.size
+# Заголовок файла: сигнатура, версия, размер записи, число записей
+HEADER = struct.Struct('<4sHHQ')
+FIELDS = ('pc', 'opcode', 'a', 'f', 'bc', 'de', 'hl', 'sp', 'cycles')
+
+
+class TraceRecord:
+    '''
+    Одна запись трассы.
+    '''
+    __slots__ = FIELDS
+
+    def __init__(self, pc, opcode, a, f, bc, de, hl, sp, cycles):
+        self.pc = pc
+        self.opcode = opcode
+        self.a = a
+        self.f = f
+        self.bc = bc
+        self.de = de
+        self.hl = hl
+        self.sp = sp
+        self.cycles = cycles
+
+    def __iter__(self):
+        return iter((self.pc, self.opcode, self.a, self.f, self.bc, self.de, self.hl, self.sp, self.cycles))
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __repr__(self):
+        return ('TraceRecord(pc=%04X, op=%02X, A=%02X, F=%02X, BC=%04X, DE=%04X, HL=%04X, SP=%04X, cycles=%d)'
+                % tuple(self))
+
+
+def record_of(cpu, pc, opcode, cycles):
+    '''
+    Строит запись для состояния процессора cpu после инструкции opcode по адресу pc
+    '''
+    r = cpu.r
+    return TraceRecord(pc, opcode, r[7], r[6], r[0] << 8 | r[1], r[2] << 8 | r[3], r[4] << 8 | r[5], cpu.sp, cycles)
+
+
+class _Recorder:
+    '''
+    Общая часть регистраторов: обёртки обработчиков и подключение к процессору.
+    Наследник задаёт self._buffers (список из одного буфера) и метод _full(index).
+    '''
+    def __init__(self):
+        self._cpu = None
+        # Число записанных инструкций, cpu.cycles на начало пакета, число записей, после
+        # которого вызывается _full(), такты пакета до последней записанной инструкции
+        self._state = [0, 0, 0, 0]
+        self._buffers = None
+
+    @property
+    def count(self):
+        '''
+        Число записанных инструкций (за всё время, включая перезаписанные в кольце)
+        '''
+        return self._state[0]
+
+    def attach(self, cpu):
+        '''
+        Включает запись трассы процессора cpu
+        '''
+        if self._cpu is not None:
+            self.detach()
+        self._cpu = cpu
+        cpu.hook_handlers(self, self._wrap)
+        self.sync()
+
+    def detach(self):
+        '''
+        Выключает запись; записанное сохраняется
+        '''
+        if self._cpu is not None:
+            self._cpu.unhook_handlers(self)
+            self._cpu = None
+
+    def sync(self):
+        '''
+        Начинает отсчёт тактов заново от cpu.cycles (после его изменения вне пакета)
+        '''
+        if self._cpu is not None:
+            self._state[1] = self._cpu.cycles
+            self._state[3] = 0
+
+    def _wrap(self, handlers):
+        pack_into = RECORD.pack_into
+        state = self._state
+        buffers = self._buffers
+        capacity = self._capacity
+        recorder = self
+
+        def write(cpu, pc, op, c):
+            i, base, limit, offset = state
+            if i >= limit:
+                recorder._full(i)
+            if cpu.cycles != base:  # Новый пакет, прерывание или ожидание в HLT
+                base = state[1] = cpu.cycles
+                offset = 0
+            offset += c
+            r = cpu.r
+            pack_into(buffers[0], (i % capacity) * RECORD_SIZE, pc, op, r[7], r[6],
+                      r[0] << 8 | r[1], r[2] << 8 | r[3], r[4] << 8 | r[5], cpu.sp, base + offset)
+            state[0] = i + 1
+            state[3] = offset
+
+        def wrap(op, handler):
+            def recorded(cpu):
+                pc = cpu.pc
+                try:
+                    c = handler(cpu)
+                except StopExecution as e:
+                    if e.reason != STOP_WAIT:   # IN неготового устройства выполнится заново
+                        write(cpu, pc, op, e.cycles)
+                    raise
+                write(cpu, pc, op, c)
+                return c
+            return recorded
+        return [wrap(op, h) for op, h in enumerate(handlers)]
+
+
+class RingRecorder(_Recorder):
+    '''
+    Кольцевой буфер последних capacity инструкций.
+    '''
+    def __init__(self, capacity=1 << 20):
+        _Recorder.__init__(self)
+        self._capacity = capacity
+        self._buffers = [bytearray(capacity * RECORD_SIZE)]
+        self._state[2] = float('inf')
+
+    def _full(self, index):
+        pass
+
+    def reader(self):
+        '''
+        Возвращает TraceReader с сохранёнными записями в порядке выполнения (копия буфера)
+        '''
+        count = min(self._state[0], self._capacity)
+        start = self._state[0] % self._capacity if self._state[0] > self._capacity else 0
+        data = self._buffers[0]
+        ordered = data[start * RECORD_SIZE:count * RECORD_SIZE] + data[:start * RECORD_SIZE]
+        return TraceReader(bytes(ordered), count)
+
+    def save(self, path):
+        '''
+        Записывает сохранённые записи в файл формата TraceReader.open()
+        '''
+        self.reader().save(path)
+
+    def clear(self):
+        self._state[0] = 0
+
+
+class FileRecorder(_Recorder):
+    '''
+    Запись трассы в файл, отображённый в память. Файл растёт порциями по chunk записей;
+    число записей в заголовке обновляется при flush() и close().
+    '''
+    def __init__(self, path, chunk=1 << 16):
+        _Recorder.__init__(self)
+        self._path = path
+        self._chunk = chunk
+        self._capacity = 1 << 62     # Файл не перезаписывается по кругу
+        self._file = open(path, 'w+b')
+        self._file.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE, 0))
+        self._mmap = None
+        self._buffers = [None]
+        self._map(chunk)
+
+    def _map(self, records):
+        '''
+        Увеличивает файл до records записей и отображает область записей в память
+        '''
+        if self._mmap is not None:
+            self._buffers[0].release()
+            self._mmap.close()
+        self._file.truncate(HEADER.size + records * RECORD_SIZE)
+        self._file.flush()
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self._buffers[0] = memoryview(self._mmap)[HEADER.size:]
+        self._state[2] = records
+
+    def _full(self, index):
+        self._map(self._state[2] + self._chunk)
+
+    def flush(self):
+        HEADER.pack_into(self._mmap, 0, MAGIC, VERSION, RECORD_SIZE, self._state[0])
+        self._mmap.flush()
+
+    def close(self):
+        '''
+        Выключает запись, записывает заголовок и обрезает файл до записанных данных
+        '''
+        self.detach()
+        if self._mmap is None:
+            return
+        self.flush()
+        self._buffers[0].release()
+        self._mmap.close()
+        self._mmap = None
+        self._file.truncate(HEADER.size + self._state[0] * RECORD_SIZE)
+        self._file.close()
+
+
+class TraceReader:
+    '''
+    Чтение трассы: последовательность записей TraceRecord.
+    '''
+    def __init__(self, data, count=None):
+        '''
+        :param data: Буфер с записями подряд (без заголовка)
+        :param count: Число записей (по умолчанию - по размеру буфера)
+        '''
+        self._data = data
+        self._count = len(data) // RECORD_SIZE if count is None else count
+        self._mmap = None
+
+    @classmethod
+    def open(cls, path):
+        '''
+        Открывает файл трассы (FileRecorder или save()); файл отображается в память
+        '''
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError('Error: %s is not a trace file' % path)
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, count = HEADER.unpack_from(mm)
+        if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+            mm.close()
+            raise ValueError('Error: %s is not a version %d trace file' % (path, VERSION))
+        count = min(count, (size - HEADER.size) // RECORD_SIZE)
+        reader = cls(memoryview(mm)[HEADER.size:], count)
+        reader._mmap = mm
+        return reader
+
+    def close(self):
+        if self._mmap is not None:
+            self._data.release()
+            self._mmap.close()
+            self._mmap = None
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE, self._count))
+            f.write(self._data[:self._count * RECORD_SIZE])
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('trace index out of range')
+        return TraceRecord(*RECORD.unpack_from(self._data, index * RECORD_SIZE))
+
+    def __iter__(self):
+        data = self._data[:self._count * RECORD_SIZE]
+        for values in RECORD.iter_unpack(data):
+            yield TraceRecord(*values)
+
+    def filter(self, pc=None, opcode=None, predicate=None):
+        '''
+        Генератор пар (номер, запись) для записей с адресом pc и/или кодом opcode,
+        для которых predicate(запись) истинно
+        '''
+        for i, record in enumerate(self):
+            if pc is not None and record.pc != pc:
+                continue
+            if opcode is not None and record.opcode != opcode:
+                continue
+            if predicate is not None and not predicate(record):
+                continue
+            yield i, record
+
+    def find(self, pc):
+        '''
+        Возвращает номера записей инструкций по адресу pc
+        '''
+        return [i for i, record in self.filter(pc=pc)]
+
+
+def diff(a, b, fields=FIELDS):
+    '''
+    Сравнивает две трассы (последовательности записей с атрибутами FIELDS) по порядку.
+    Возвращает None, если совпадают поля fields всех записей и длины трасс,
+    иначе (номер первой отличающейся записи, список отличающихся полей,
+    запись a или None, запись b или None).
+    '''
+    i = -1
+    for i, (x, y) in enumerate(zip(a, b)):
+        different = [name for name in fields if getattr(x, name) != getattr(y, name)]
+        if different:
+            return i, different, x, y
+    i += 1
+    if len(a) != len(b):
+        return i, ['length'], a[i] if i < len(a) else None, b[i] if i < len(b) else None
+    return None
+
+
+def main():
+    '''
+    Записывает трассу демонстрационной программы и показывает последние записи
+    '''
+    import time
+    import bench
+    workload = bench.BUILTIN_WORKLOADS[0]
+    p = workload.cpu()
+    t = time.perf_counter()
+    p.run_for(instructions=200000)
+    plain = time.perf_counter() - t
+    p = workload.cpu()
+    recorder = RingRecorder(1 << 16)
+    p.set_recorder(recorder)
+    t = time.perf_counter()
+    p.run_for(instructions=200000)
+    recorded = time.perf_counter() - t
+    p.set_recorder(None)
+    print('plain %.0f ns/instruction, recording %.0f ns/instruction'
+          % (plain / 200000 * 1e9, recorded / 200000 * 1e9))
+    reader = recorder.reader()
+    print(len(reader), 'records kept')
+    for record in reader[-3:]:
+        print(record)
+
+
+if __name__ == '__main__':
+    main()
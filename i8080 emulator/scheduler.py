@@ -0,0 +1,227 @@
+'''
+Планировщик событий по тактам.
+Время измеряется тактами процессора (cpu.cycles). Устройства ставят события в
+очередь с приоритетом по моменту наступления; планировщик выполняет программу
+пачками ровно до ближайшего события (run_for), затем вызывает обработчики
+наступивших событий. Между событиями процессор работает без каких-либо проверок.
+
+Событие наступает на первой границе инструкций не раньше своего момента:
+инструкция всегда выполняется целиком, поэтому задержка не превышает времени
+одной инструкции (не более 18 тактов).
+
+Прерывания: request_interrupt(vector) запоминает запрос RST vector; он
+выполняется (cpu.interrupt), как только прерывания разрешены. Пока запрос ждёт
+команды EI, процессор проверяется после каждой инструкции (cpu.run_until;
+в это время программа выполняется интерпретатором, даже если задан runner);
+запрос принимается только после команды, следующей за EI (CPU.interrupt).
+Остановленный по HLT процессор простаивает до ближайшего события.
+'''
+import heapq
+
+from cpu import CPU, RunResult
+from dispatch import STOP_CYCLES, STOP_HALT, STOP_PREDICATE
+from memory import Memory
+
+STOP_REQUESTED = 'stopped'      # Причина остановки: вызван Scheduler.stop()
+REFERENCE_HZ = 2000000          # Тактовая частота i8080 по умолчанию
+
+
+class Event:
+    '''
+    Событие планировщика.
+    '''
+    __slots__ = ('time', 'callback', 'period', 'cancelled')
+
+    def __init__(self, time, callback, period=None):
+        '''
+        :param time: Такт, на котором наступает событие
+        :param callback: Функция callback(scheduler), вызываемая при наступлении события
+        :param period: Период в тактах для повторяющегося события (None - однократное)
+        '''
+        self.time = time
+        self.callback = callback
+        self.period = period
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __repr__(self):
+        return 'Event(time=%d, period=%r)' % (self.time, self.period)
+
+
+class Scheduler:
+    '''
+    Планировщик событий одного процессора.
+    '''
+    def __init__(self, cpu, runner=None, clock_hz=REFERENCE_HZ):
+        '''
+        :param cpu: Процессор
+        :param runner: Объект с методом run_for(cycles) - сам cpu (по умолчанию) или translator.BlockCache
+        :param clock_hz: Тактовая частота, используемая для перевода герц и секунд в такты
+        '''
+        self.cpu = cpu
+        self.runner = cpu if runner is None else runner
+        self.clock_hz = clock_hz
+        self._queue = []
+        self._sequence = 0      # Порядковый номер: события одного такта срабатывают в порядке постановки
+        self._interrupts = []   # Ожидающие запросы прерываний (векторы RST)
+        self._stop = False
+
+    @property
+    def now(self):
+        '''
+        Текущее время в тактах
+        '''
+        return self.cpu.cycles
+
+    def schedule(self, time, callback, period=None):
+        '''
+        Ставит событие на такт time. Возвращает Event (его можно отменить через cancel()).
+        '''
+        event = Event(time, callback, period)
+        self._push(event)
+        return event
+
+    def schedule_in(self, delay, callback):
+        '''
+        Ставит событие через delay тактов от текущего момента
+        '''
+        return self.schedule(self.cpu.cycles + delay, callback)
+
+    def every(self, period, callback, start=None):
+        '''
+        Ставит повторяющееся событие с периодом period тактов, впервые - на такт start
+        (по умолчанию - через период). Моменты наступления не накапливают погрешность.
+        '''
+        if period <= 0:
+            raise ValueError('period must be positive')
+        return self.schedule(self.cpu.cycles + period if start is None else start, callback, period)
+
+    def every_hz(self, frequency, callback):
+        '''
+        Ставит повторяющееся событие с частотой frequency Гц (например 60 для кадровой развёртки)
+        '''
+        return self.every(self.clock_hz // frequency, callback)
+
+    def _push(self, event):
+        heapq.heappush(self._queue, (event.time, self._sequence, event))
+        self._sequence += 1
+
+    def request_interrupt(self, vector):
+        '''
+        Запрашивает прерывание RST vector (0..7)
+        '''
+        if not 0 <= vector <= 7:
+            raise ValueError('RST vector must be 0..7')
+        self._interrupts.append(vector)
+
+    def stop(self):
+        '''
+        Останавливает run() после обработки текущих событий (можно вызывать из обработчика)
+        '''
+        self._stop = True
+
+    def next_event_time(self):
+        '''
+        Возвращает такт ближайшего события или None, если очередь пуста
+        '''
+        queue = self._queue
+        while queue and queue[0][2].cancelled:
+            heapq.heappop(queue)
+        return queue[0][0] if queue else None
+
+    def _fire(self):
+        '''
+        Вызывает обработчики всех наступивших событий
+        '''
+        queue = self._queue
+        while queue and queue[0][0] <= self.cpu.cycles:
+            time, sequence, event = heapq.heappop(queue)
+            if event.cancelled:
+                continue
+            if event.period is not None:
+                event.time = time + event.period
+                self._push(event)
+            event.callback(self)
+
+    def run(self, cycles=None, seconds=None):
+        '''
+        Выполняет программу cycles тактов (или seconds секунд при частоте clock_hz),
+        обрабатывая события и прерывания. Возвращает RunResult; причина остановки -
+        STOP_CYCLES, STOP_REQUESTED или причина, с которой остановился процессор
+        (кроме HLT, после которой процессор ждёт событий).
+        '''
+        if seconds is not None:
+            cycles = int(seconds * self.clock_hz)
+        if cycles is None:
+            raise ValueError('run() requires cycles or seconds')
+        cpu = self.cpu
+        start = cpu.cycles
+        end = start + cycles
+        instructions = 0
+        self._stop = False
+        reason = STOP_CYCLES
+        while cpu.cycles < end and not self._stop:
+            if self._interrupts and cpu.inte:
+                if cpu.interrupt(self._interrupts[0]):
+                    del self._interrupts[0]
+            target = self.next_event_time()
+            if target is None or target > end:
+                target = end
+            if target > cpu.cycles:
+                if cpu.halted:
+                    cpu.cycles = target     # Ожидание в состоянии HLT
+                else:
+                    if self._interrupts:
+                        # Запрос ждёт EI: блоки runner не останавливаются после каждой инструкции
+                        result = cpu.run_until(lambda p: p.inte, cycles=target - cpu.cycles)
+                    else:
+                        result = self.runner.run_for(cycles=target - cpu.cycles)
+                    instructions += result.instructions
+                    if result.reason not in (STOP_CYCLES, STOP_HALT, STOP_PREDICATE):
+                        reason = result.reason
+                        break
+                    if result.reason != STOP_CYCLES:
+                        continue
+            self._fire()
+        if self._stop:
+            reason = STOP_REQUESTED
+        return RunResult(instructions, cpu.cycles - start, reason)
+
+
+def main():
+    '''
+    Пример: кадровое прерывание 60 Гц (RST 1) считает кадры, основная программа ждёт в HLT.
+    Первый кадр - на нулевом такте: иначе 60-й кадр приходит за 20 тактов до конца
+    секунды и его обработчик не успевает увеличить счётчик
+    '''
+    import assembler
+    program = assembler.assemble('''
+            ORG 0
+            JMP START
+            ORG 8           ; RST 1 - кадровое прерывание
+            PUSH PSW
+            LDA FRAMES
+            INR A
+            STA FRAMES
+            POP PSW
+            EI
+            RET
+    START:  LXI SP, 1000H
+            EI
+    WAIT:   HLT
+            JMP WAIT
+    FRAMES: DB 0
+    ''')
+    m = Memory()
+    program.load(m)
+    p = CPU(m)
+    s = Scheduler(p)
+    s.every(s.clock_hz // 60, lambda scheduler: scheduler.request_interrupt(1), start=0)
+    result = s.run(seconds=1)
+    print(result, 'frames:', m[program.symbols['FRAMES']])
+
+
+if __name__ == '__main__':
+    main()
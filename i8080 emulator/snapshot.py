@@ -0,0 +1,157 @@
+'''
+Снимки состояния машины (процессор + 64 КБ памяти).
+Snapshot хранит регистры, SP, PC, счётчик тактов, признаки HLT и INTE, адрес
+команды после EI, до выполнения которой прерывание не принимается, и содержимое памяти постранично (по 256 байт). Страницы - неизменяемые объекты
+bytes, поэтому снимок, снятый относительно предыдущего (base), разделяет с ним
+все страницы, которые с тех пор не изменились, а нулевые страницы у всех
+снимков общие. Так тысячи снимков одной программы занимают немного памяти.
+Если память ведёт учёт изменённых страниц (Memory.track_dirty), снимок
+относительно base копирует и сравнивает только страницы, изменённые после него.
+
+Снимок сериализуется в компактный двоичный формат (to_bytes/from_bytes):
+заголовок фиксированного размера и образ памяти, по умолчанию сжатый zlib.
+'''
+import struct
+import zlib
+
+from memory import MEMORY_SIZE, PAGE_SHIFT, PAGE_SIZE, PAGE_COUNT
+
+MAGIC = b'I80S'
+VERSION = 2
+FLAG_COMPRESSED = 0x01
+FLAG_EI_PENDING = 0x02      # Снимок сделан сразу после EI: поле адреса после EI действительно
+# Заголовок: сигнатура, версия, признаки формата, регистры B C D E H L F A, SP, PC, такты, HLT, INTE,
+# адрес команды после EI
+HEADER = struct.Struct('<4sBB8sHHQBBH')
+ZERO_PAGE = bytes(PAGE_SIZE)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class Snapshot:
+    '''
+    Снимок состояния процессора и памяти.
+    '''
+    __slots__ = ('registers', 'sp', 'pc', 'cycles', 'halted', 'inte', 'pages', 'ei_pc')
+
+    def __init__(self, registers, sp, pc, cycles, halted, inte, pages, ei_pc=None):
+        '''
+        :param registers: bytes из 8 значений регистров в порядке CPU.r (B, C, D, E, H, L, F, A)
+        :param pages: Кортеж из 256 страниц памяти (bytes по 256 байт)
+        :param ei_pc: Адрес команды после только что выполненной EI (None - EI не ожидает)
+        '''
+        self.registers = registers
+        self.sp = sp
+        self.pc = pc
+        self.cycles = cycles
+        self.halted = halted
+        self.inte = inte
+        self.pages = pages
+        self.ei_pc = ei_pc
+
+    @classmethod
+    def capture(cls, cpu, base=None, dirty=None):
+        '''
+        Снимает состояние процессора cpu и его памяти.
+        Если задан предыдущий снимок base, неизменившиеся страницы берутся из него.
+        Если заданы также dirty - номера страниц, в которые была запись после снятия
+        base (Memory.dirty_pages()), - из памяти копируются только эти страницы.
+        '''
+        if base is not None and dirty is not None:
+            view = cpu._m.dump()
+            pages = list(base.pages)
+            for page in dirty:
+                s = page << PAGE_SHIFT
+                chunk = bytes(view[s:s + PAGE_SIZE])
+                if chunk != pages[page]:
+                    pages[page] = ZERO_PAGE if chunk == ZERO_PAGE else chunk
+            return cls(bytes(cpu.r), cpu.sp, cpu.pc, cpu.cycles, cpu.halted, cpu.inte, tuple(pages),
+                       cpu._ei_pc)
+        data = bytes(cpu._m.dump())
+        old = base.pages if base is not None else None
+        pages = []
+        for page in range(PAGE_COUNT):
+            s = page << PAGE_SHIFT
+            chunk = data[s:s + PAGE_SIZE]
+            if old is not None and chunk == old[page]:
+                chunk = old[page]
+            elif chunk == ZERO_PAGE:
+                chunk = ZERO_PAGE
+            pages.append(chunk)
+        return cls(bytes(cpu.r), cpu.sp, cpu.pc, cpu.cycles, cpu.halted, cpu.inte, tuple(pages),
+                   cpu._ei_pc)
+
+    def apply(self, cpu):
+        '''
+        Восстанавливает состояние в процессоре cpu и его памяти.
+        В память записываются только страницы, отличающиеся от снимка, поэтому
+        наблюдатели за записью (например кэш блоков) узнают только о них.
+        '''
+        cpu.r[:] = self.registers
+        cpu.sp = self.sp
+        cpu.pc = self.pc
+        cpu.cycles = self.cycles
+        cpu.halted = self.halted
+        cpu.inte = self.inte
+        cpu._ei_pc = self.ei_pc
+        m = cpu._m
+        data = bytes(m.dump())
+        for page, chunk in enumerate(self.pages):
+            s = page << PAGE_SHIFT
+            if data[s:s + PAGE_SIZE] != chunk:
+                m.load(chunk, s)
+
+    def memory(self):
+        '''
+        Возвращает образ памяти снимка (bytes, 64 КБ)
+        '''
+        return b''.join(self.pages)
+
+    def shared_pages(self, other):
+        '''
+        Возвращает число страниц, общих (один и тот же объект) с другим снимком
+        '''
+        return sum(1 for a, b in zip(self.pages, other.pages) if a is b)
+
+    def to_bytes(self, compress=True):
+        '''
+        Сериализует снимок в двоичный блок
+        '''
+        image = self.memory()
+        flags = 0
+        if compress:
+            image = zlib.compress(image, 1)
+            flags |= FLAG_COMPRESSED
+        if self.ei_pc is not None:
+            flags |= FLAG_EI_PENDING
+        header = HEADER.pack(MAGIC, VERSION, flags, self.registers, self.sp, self.pc, self.cycles,
+                             int(bool(self.halted)), int(bool(self.inte)), self.ei_pc or 0)
+        return header + image
+
+    @classmethod
+    def from_bytes(cls, blob):
+        '''
+        Восстанавливает снимок из двоичного блока, созданного to_bytes()
+        '''
+        if len(blob) < HEADER.size:
+            raise SnapshotError('Error: snapshot is truncated')
+        magic, version, flags, registers, sp, pc, cycles, halted, inte, ei_pc = HEADER.unpack_from(blob)
+        if magic != MAGIC or version != VERSION:
+            raise SnapshotError('Error: not a version %d snapshot' % VERSION)
+        image = bytes(blob[HEADER.size:])
+        if flags & FLAG_COMPRESSED:
+            image = zlib.decompress(image)
+        if len(image) != MEMORY_SIZE:
+            raise SnapshotError('Error: snapshot memory image must be exactly %d bytes' % MEMORY_SIZE)
+        pages = []
+        for page in range(PAGE_COUNT):
+            s = page << PAGE_SHIFT
+            chunk = image[s:s + PAGE_SIZE]
+            pages.append(ZERO_PAGE if chunk == ZERO_PAGE else chunk)
+        return cls(registers, sp, pc, cycles, bool(halted), inte, tuple(pages),
+                   ei_pc if flags & FLAG_EI_PENDING else None)
+
+    def __repr__(self):
+        return 'Snapshot(pc=%s, cycles=%d)' % (hex(self.pc), self.cycles)
@@ -0,0 +1,139 @@
+'''
+Трассировка выполнения программы.
+Уровни трассировки:
+TRACE_OFF - трассировка выключена, процессор работает по обычной таблице обработчиков;
+TRACE_INSTRUCTION - для каждой инструкции выводится адрес, код и мнемоника;
+TRACE_STATE - дополнительно выводится состояние процессора после инструкции.
+
+Трассировка включается подменой таблицы обработчиков процессора на обёртки,
+поэтому в выключенном состоянии она ничего не стоит.
+'''
+import sys
+from collections import deque
+
+from opcodes import OPCODES
+
+TRACE_OFF = 0
+TRACE_INSTRUCTION = 1
+TRACE_STATE = 2
+
+
+class StdoutSink:
+    '''
+    Приёмник трассы, печатающий строки в стандартный вывод.
+    '''
+    def write(self, line):
+        sys.stdout.write(line + '\n')
+
+    def flush(self):
+        sys.stdout.flush()
+
+    def close(self):
+        self.flush()
+
+
+class FileSink:
+    '''
+    Приёмник трассы, записывающий строки в файл.
+    Строки накапливаются и записываются пачками по buffer_lines штук.
+    '''
+    def __init__(self, path, buffer_lines=4096):
+        '''
+        :param path: Имя файла или открытый текстовый файл
+        :param buffer_lines: Число строк, накапливаемых перед записью
+        '''
+        if isinstance(path, str):
+            self._file = open(path, 'w')
+            self._own = True
+        else:
+            self._file = path
+            self._own = False
+        self._buffer = []
+        self._buffer_lines = buffer_lines
+
+    def write(self, line):
+        self._buffer.append(line)
+        if len(self._buffer) >= self._buffer_lines:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._buffer.append('')
+            self._file.write('\n'.join(self._buffer))
+            self._buffer = []
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        if self._own:
+            self._file.close()
+
+
+class RingBufferSink:
+    '''
+    Приёмник трассы, хранящий в памяти только последние size строк.
+    '''
+    def __init__(self, size=10000):
+        self._lines = deque(maxlen=size)
+        self.write = self._lines.append
+
+    def lines(self):
+        '''
+        Возвращает список сохранённых строк (от старых к новым)
+        '''
+        return list(self._lines)
+
+    def clear(self):
+        self._lines.clear()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class CallbackSink:
+    '''
+    Приёмник трассы, передающий каждую строку функции callback(line).
+    '''
+    def __init__(self, callback):
+        self.write = callback
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def format_instruction(cpu, pc):
+    '''
+    Возвращает строку трассы для инструкции по адресу pc: адрес, байты и мнемонику
+    '''
+    m = cpu._m
+    info = OPCODES[m[pc]]
+    data = [m[(pc + i) & 0xFFFF] for i in range(info.length)]
+    value = data[1] | data[2] << 8 if info.length == 3 else data[-1]
+    return '%04X  %-8s  %s' % (pc, ' '.join('%02X' % b for b in data), info.text(value))
+
+
+def traced_handlers(handlers, level, sink):
+    '''
+    Строит таблицу обработчиков-обёрток над handlers, которые пишут трассу уровня level в sink
+    '''
+    write = sink.write
+
+    def wrap(handler):
+        if level >= TRACE_STATE:
+            def traced(cpu):
+                write(format_instruction(cpu, cpu.pc))
+                cycles = handler(cpu)
+                write(str(cpu))
+                return cycles
+        else:
+            def traced(cpu):
+                write(format_instruction(cpu, cpu.pc))
+                return handler(cpu)
+        return traced
+    return [wrap(h) for h in handlers]
@@ -0,0 +1,231 @@
+'''
+Трансляция базовых блоков в функции Python.
+Базовый блок - последовательность инструкций, заканчивающаяся переходом
+(или другой инструкцией, которая сама устанавливает PC). Каждый блок
+компилируется в одну функцию: тексты инструкций берутся из dispatch,
+операнды и адреса подставляются как константы. Скомпилированные блоки
+хранятся в кэше по начальному адресу и выполняются одним вызовом.
+
+Кэш следит за записью в страницы памяти, содержащие оттранслированный код,
+и удаляет блоки этих страниц. Если запись попала в выполняющийся сейчас блок,
+он прерывается сразу после записавшей инструкции, и выполнение продолжается
+уже по изменённому коду.
+'''
+import re
+import time
+
+import dispatch
+from cpu import CPU, RunResult
+from dispatch import StopExecution, STOP_CYCLES, STOP_INSTRUCTIONS, STOP_WAIT
+from memory import Memory
+from opcodes import OPCODES
+
+MAX_BLOCK_LENGTH = 64   # Максимальное число инструкций в блоке
+_WRITE = re.compile(r'\bm(\.write\(|\[.*\] = )')     # Запись в память в тексте инструкции
+
+
+class BlockExit(Exception):
+    '''
+    Выбрасывается блоком, прерванным из-за записи в его собственный код.
+    PC к этому моменту указывает на следующую за записавшей инструкцию.
+    '''
+    def __init__(self, instructions, cycles):
+        Exception.__init__(self, instructions, cycles)
+        self.instructions = instructions
+        self.cycles = cycles
+
+
+class Block:
+    '''
+    Оттранслированный блок.
+    '''
+    __slots__ = ('start', 'end', 'function', 'instructions', 'max_cycles', 'pages')
+
+    def __init__(self, start, end, function, instructions, max_cycles):
+        '''
+        :param start: Адрес первой инструкции
+        :param end: Адрес, следующий за последним байтом блока
+        :param function: Функция function(cpu), выполняющая блок и возвращающая число тактов
+        :param instructions: Число инструкций в блоке
+        :param max_cycles: Наибольшее возможное время выполнения блока в тактах
+        '''
+        self.start = start
+        self.end = end
+        self.function = function
+        self.instructions = instructions
+        self.max_cycles = max_cycles
+        self.pages = set((start + i) >> 8 & 0xFF for i in range((end - start) & 0xFFFF or 0x10000))
+
+
+class BlockCache:
+    '''
+    Кэш оттранслированных блоков для одного процессора.
+    '''
+    def __init__(self, cpu, max_block_length=MAX_BLOCK_LENGTH):
+        self._cpu = cpu
+        self._max_block_length = max_block_length
+        self._blocks = {}
+        self._page_blocks = {}     # Номер страницы -> множество адресов начала блоков
+        self.translations = 0      # Число оттранслированных блоков
+        self.invalidations = 0     # Число блоков, удалённых из-за записи в память
+        self._current = None       # Выполняющийся блок
+        self._modified = [False]   # Признак записи в код выполняющегося блока
+        self._env = {'MODIFIED': self._modified, 'BlockExit': BlockExit}
+
+    def translate(self, start):
+        '''
+        Транслирует блок, начинающийся по адресу start, и помещает его в кэш.
+        Возвращает Block.
+        '''
+        m = self._cpu._m
+        pc = start
+        body = []
+        count = 0
+        cycles = 0
+        max_cycles = 0
+        jumps = False
+        while count < self._max_block_length:
+            op = m[pc]
+            info = OPCODES[op]
+            data = 0
+            if info.length == 2:
+                data = m[(pc + 1) & 0xFFFF]
+            elif info.length == 3:
+                data = m[(pc + 1) & 0xFFFF] | m[(pc + 2) & 0xFFFF] << 8
+            lines, jumps = dispatch.instruction_source(op, pc, data, cycles)
+            body += lines
+            count += 1
+            max_cycles = cycles + max(info.cycles, info.cycles_taken)
+            cycles += info.cycles
+            pc = (pc + info.length) & 0xFFFF
+            if jumps:
+                break
+            if any(_WRITE.search(line) for line in lines):
+                body += ['if MODIFIED[0]:',
+                         '    cpu.pc = 0x%04X' % pc,
+                         '    raise BlockExit(%d, %d)' % (count, cycles)]
+        if not jumps:
+            body += ['cpu.pc = 0x%04X' % pc]
+        body += ['return %d' % cycles]
+        function = dispatch.compile_function('block_%04x' % start, dispatch.prologue(body) + body, self._env)
+        block = Block(start, pc, function, count, max_cycles)
+        self._blocks[start] = block
+        new_pages = []
+        for page in block.pages:
+            if page not in self._page_blocks:
+                self._page_blocks[page] = set()
+                new_pages.append(page)
+            self._page_blocks[page].add(start)
+        if new_pages:
+            m.watch_writes(new_pages, self._on_write)
+        self.translations += 1
+        return block
+
+    def invalidate(self, page=None):
+        '''
+        Удаляет из кэша блоки, занимающие страницу page (по умолчанию - все блоки)
+        '''
+        m = self._cpu._m
+        if page is None:
+            self._blocks.clear()
+            self._page_blocks.clear()
+            m.unwatch_writes(self._on_write)
+            return
+        for start in self._page_blocks.pop(page, ()):
+            block = self._blocks.pop(start, None)
+            if block is None:
+                continue
+            self.invalidations += 1
+            for other in block.pages:
+                if other != page and other in self._page_blocks:
+                    self._page_blocks[other].discard(start)
+        m.unwatch_writes(self._on_write, [page])
+
+    def _on_write(self, addr):
+        current = self._current
+        if current is not None and (addr - current.start) & 0xFFFF < (current.end - current.start) & 0xFFFF:
+            self._modified[0] = True
+        self.invalidate(addr >> 8)
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def run_for(self, cycles=None, instructions=None):
+        '''
+        То же, что CPU.run_for(), но с выполнением оттранслированных блоков.
+        Если оставшийся бюджет меньше, чем может занять блок, инструкции выполняются
+        по одной обычными обработчиками, поэтому результат совпадает с CPU.run_for().
+        '''
+        if cycles is None and instructions is None:
+            raise ValueError('run_for() requires cycles or instructions')
+        cpu = self._cpu
+        cpu._ei_pc = None
+        cpu.halted = False
+        read = cpu._m.read
+        handlers = cpu._handlers
+        blocks = self._blocks
+        translate = self.translate
+        max_cycles = float('inf') if cycles is None else cycles
+        max_instructions = float('inf') if instructions is None else instructions
+        n = 0
+        c = 0
+        modified = self._modified
+        block = None
+        try:
+            while c < max_cycles and n < max_instructions:
+                block = blocks.get(cpu.pc)
+                if block is None:
+                    block = translate(cpu.pc)
+                if c + block.max_cycles < max_cycles and n + block.instructions <= max_instructions:
+                    self._current = block
+                    modified[0] = False     # Запись последней инструкцией прошлого блока не в счёт
+                    try:
+                        c += block.function(cpu)
+                        n += block.instructions
+                    except BlockExit as e:
+                        c += e.cycles
+                        n += e.instructions
+                else:
+                    block = self._current = None
+                    c += handlers[read(cpu.pc)](cpu)
+                    n += 1
+        except StopExecution as e:
+            self._current = None
+            if e.reason != STOP_WAIT:
+                n += block.instructions if block is not None else 1
+                c += e.cycles
+            elif block is not None:
+                # IN - последняя инструкция блока: выполнены все инструкции до неё
+                n += block.instructions - 1
+                c += block.max_cycles - OPCODES[0xDB].cycles
+            cpu.cycles += c
+            return RunResult(n, c, e.reason)
+        self._current = None
+        cpu.cycles += c
+        return RunResult(n, c, STOP_CYCLES if c >= max_cycles else STOP_INSTRUCTIONS)
+
+
+def main():
+    '''
+    Сравнивает скорость интерпретатора и трансляции блоков на простом цикле
+    '''
+    program = [0x21, 0x00, 0x00,    # LXI H, 0
+               0x51, 0x5A, 0x80,    # MOV D, C; MOV E, D; ADD B
+               0x88, 0x90, 0x47,    # ADC B; SUB B; MOV B, A
+               0x4F, 0xEB, 0xEB,    # MOV C, A; XCHG; XCHG
+               0xE9]                # PCHL
+    budget = 2000000
+    results = {}
+    for name in ('interpreter', 'blocks'):
+        p = CPU(Memory(bytes(program)))
+        runner = p if name == 'interpreter' else BlockCache(p)
+        t = time.perf_counter()
+        result = runner.run_for(cycles=budget)
+        dt = time.perf_counter() - t
+        results[name] = result.instructions / dt
+        print('%-12s %10.0f instructions/s  %s' % (name, results[name], result))
+    print('speed-up: %.2fx' % (results['blocks'] / results['interpreter']))
+
+
+if __name__ == '__main__':
+    main()
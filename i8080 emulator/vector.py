@@ -0,0 +1,594 @@
+'''
+Векторное выполнение одной программы на многих процессорах (для фаззинга и
+перебора входных данных).
+VectorCPU хранит регистры, SP, PC, такты и признаки N процессоров ("дорожек") в
+массивах NumPy, а их память - в LaneMemory: страницы по 256 байт общие для всех
+дорожек, пока дорожка в них не пишет (копирование при записи), поэтому N копий
+64 КБ занимают память только под изменённые страницы.
+
+Шаг выполняет по одной инструкции на каждой работающей дорожке. Дорожки
+группируются по PC, и каждая группа выполняется одной векторной операцией.
+Код в общих страницах одинаков у всех дорожек, поэтому обработчик для адреса
+компилируется один раз с операндами и адресами-константами (как в трансляторе
+блоков); дорожки, изменившие страницы со своим кодом, группируются по коду
+операции и читают операнды из своей памяти. Обработчики компилируются из того же
+текста инструкций (dispatch.instruction_source) и с теми же таблицами флагов
+(flags), что и обработчики CPU; условные переходы, вызовы и возвраты делят группу
+на дорожки с выполненным и невыполненным условием.
+
+Дорожка, выполнившая HLT, останавливается. IN и OUT обращаются к функциям
+port_in(lanes, ports) и port_out(lanes, ports, values) с массивами номеров дорожек.
+
+Нужен NumPy; без него модуль импортируется, но VectorCPU создать нельзя.
+Запуск как программы сверяет все коды операций со скалярным CPU и сравнивает
+скорость с N отдельными интерпретаторами:
+    python vector.py [--lanes N] [--steps N]
+'''
+import argparse
+import re
+import time
+
+import dispatch
+import flags
+from cpu import CPU
+from memory import Memory, PAGE_SHIFT, PAGE_SIZE, PAGE_COUNT
+from opcodes import OPCODES
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_CONDITIONAL = re.compile(r'cpu\.pc = (.+) if (not )?r\[6\] & (0x[0-9A-F]+) else (.+)$')
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('vector.VectorCPU requires NumPy (pip install numpy)')
+
+
+def _no_input(lanes, ports):
+    return 0xFF
+
+
+def _no_output(lanes, ports, values):
+    pass
+
+
+class LaneMemory:
+    '''
+    Память N дорожек с копированием страниц при записи.
+    Страницы хранятся в общем массиве pool; pages[lane, page] - номер страницы pool
+    для страницы page дорожки lane. Первые PAGE_COUNT страниц pool - общий образ.
+    '''
+    def __init__(self, lanes, image=None, at=0):
+        '''
+        :param lanes: Число дорожек
+        :param image: Образ, одинаковый для всех дорожек (bytes или Memory)
+        :param at: Адрес загрузки образа
+        '''
+        _require_numpy()
+        base = Memory()
+        if isinstance(image, Memory):
+            base.load(image.dump())
+        elif image is not None:
+            base.load(image, at)
+        self._pool = np.frombuffer(base.dump(), dtype=np.uint8).reshape(PAGE_COUNT, PAGE_SIZE).copy()
+        self._used = PAGE_COUNT
+        self.pages = np.tile(np.arange(PAGE_COUNT, dtype=np.int64), (lanes, 1))
+        self._flat_pool = self._pool.reshape(-1)
+        self._flat_pages = self.pages.reshape(-1)
+        self.base = bytes(base.dump())     # Общий образ; его страницы в pool не меняются
+
+    def is_private(self, lanes, addr):
+        '''
+        Возвращает массив признаков: страница адреса addr дорожки lane скопирована при записи
+        '''
+        return self._flat_pages.take(lanes << PAGE_SHIFT | addr >> PAGE_SHIFT) >= PAGE_COUNT
+
+    @property
+    def private_pages(self):
+        '''
+        Число страниц, скопированных дорожками при записи
+        '''
+        return self._used - PAGE_COUNT
+
+    def _allocate(self, count):
+        '''
+        Возвращает номера count новых страниц pool
+        '''
+        if self._used + count > len(self._pool):
+            grown = np.zeros((max(len(self._pool) * 2, self._used + count), PAGE_SIZE), dtype=np.uint8)
+            grown[:self._used] = self._pool[:self._used]
+            self._pool = grown
+            self._flat_pool = grown.reshape(-1)
+        ids = np.arange(self._used, self._used + count)
+        self._used += count
+        return ids
+
+    def read(self, lanes, addr):
+        '''
+        Возвращает массив байтов по адресам addr (массив или число) дорожек lanes
+        '''
+        page = self._flat_pages.take(lanes << PAGE_SHIFT | addr >> PAGE_SHIFT)
+        return self._flat_pool.take(page << PAGE_SHIFT | addr & 0xFF).astype(np.int64)
+
+    def write(self, lanes, addr, values):
+        '''
+        Записывает values по адресам addr дорожек lanes (каждая дорожка - один адрес)
+        '''
+        slots = lanes << PAGE_SHIFT | addr >> PAGE_SHIFT
+        page = self._flat_pages.take(slots)
+        shared = page < PAGE_COUNT
+        if shared.any():
+            new = self._allocate(int(shared.sum()))
+            self._pool[new] = self._pool[page[shared]]
+            self._flat_pages[slots[shared]] = new
+            page[shared] = new
+        self._flat_pool[page << PAGE_SHIFT | addr & 0xFF] = values
+
+    def load(self, lane, data, at=0):
+        '''
+        Записывает байты data в память дорожки lane с адреса at
+        '''
+        lanes = np.array([lane])
+        for i, value in enumerate(bytes(data)):
+            self.write(lanes, (at + i) & 0xFFFF, value)
+
+    def load_lanes(self, lanes, data, at=0):
+        '''
+        Записывает в память дорожек lanes строки матрицы data (по строке на дорожку) с адреса at
+        '''
+        data = np.asarray(data)
+        lanes = np.asarray(lanes)
+        for i in range(data.shape[1]):
+            self.write(lanes, (at + i) & 0xFFFF, data[:, i])
+
+    def dump(self, lane):
+        '''
+        Возвращает содержимое 64 КБ памяти дорожки lane (bytes)
+        '''
+        return self._pool[self.pages[lane]].tobytes()
+
+
+class _Registers:
+    '''
+    Регистры группы дорожек: читаются из массива по первому обращению,
+    записываются обратно только изменённые
+    '''
+    __slots__ = ('_regs', '_lanes', 'values', 'dirty')
+
+    def __init__(self, regs, lanes):
+        self._regs = regs
+        self._lanes = lanes
+        self.values = {}
+        self.dirty = set()
+
+    def __getitem__(self, i):
+        values = self.values
+        if i not in values:
+            values[i] = self._regs[i][self._lanes]
+        return values[i]
+
+    def __setitem__(self, i, value):
+        self.values[i] = value
+        self.dirty.add(i)
+
+
+class _LaneMemoryView:
+    '''
+    Память группы дорожек с интерфейсом Memory.read/write
+    '''
+    __slots__ = ('_memory', '_lanes')
+
+    def __init__(self, memory, lanes):
+        self._memory = memory
+        self._lanes = lanes
+
+    def read(self, addr):
+        return self._memory.read(self._lanes, addr)
+
+    def write(self, addr, value):
+        self._memory.write(self._lanes, addr, value)
+
+
+class _LaneView:
+    '''
+    Группа дорожек с интерфейсом процессора, который ожидает текст инструкций dispatch
+    '''
+    def __init__(self, machine, lanes):
+        self._machine = machine
+        self.lanes = lanes
+        self.r = _Registers(machine.r, lanes)
+        self._m = _LaneMemoryView(machine.memory, lanes)
+        self._pc = None
+        self._sp = None
+        self._inte = None
+        self.halted = False
+
+    @property
+    def pc(self):
+        if self._pc is None:
+            self._pc = self._machine.pc[self.lanes]
+        return self._pc
+
+    @pc.setter
+    def pc(self, value):
+        self._pc = value
+
+    @property
+    def sp(self):
+        if self._sp is None:
+            self._sp = self._machine.sp[self.lanes]
+        return self._sp
+
+    @sp.setter
+    def sp(self, value):
+        self._sp = value
+
+    @property
+    def inte(self):
+        return self._inte
+
+    @inte.setter
+    def inte(self, value):
+        self._inte = value
+
+    def port_in(self, ports):
+        return np.asarray(self._machine.port_in(self.lanes, ports))
+
+    def port_out(self, ports, values):
+        self._machine.port_out(self.lanes, ports, values)
+
+    def commit(self, cycles):
+        '''
+        Записывает изменённое состояние группы обратно в массивы машины
+        '''
+        machine = self._machine
+        lanes = self.lanes
+        r = self.r
+        for i in r.dirty:
+            machine.r[i][lanes] = r.values[i]
+        machine.pc[lanes] = self._pc
+        if self._sp is not None:
+            machine.sp[lanes] = self._sp
+        if self._inte is not None:
+            machine.inte[lanes] = self._inte
+        if self.halted:
+            machine.halted[lanes] = True
+        machine.cycles[lanes] += cycles
+
+
+_ENV = None
+
+
+def _env():
+    '''
+    Таблицы флагов из flags в виде массивов NumPy - глобальные имена векторных обработчиков
+    '''
+    global _ENV
+    if _ENV is None:
+        _ENV = {name: np.array(bytearray(getattr(flags, name)), dtype=np.int64)
+                for name in ('SZP', 'ADD_FLAGS', 'SUB_FLAGS', 'AND_FLAGS', 'INR_FLAGS', 'DCR_FLAGS')}
+        _ENV['DAA_TABLE'] = np.array(flags.DAA_TABLE, dtype=np.int64)
+    return _ENV
+
+
+def _compile(name, lines):
+    return dispatch.compile_function(name, dispatch.prologue(lines) + lines, _env())
+
+
+def _handler(op, pc=None, data=0):
+    '''
+    Строит векторный обработчик кода операции op: (функция handler(view), такты, условие).
+    Условие для условных переходов, вызовов и возвратов - (маска флага, инверсия,
+    обработчик при выполненном условии, его такты), иначе None.
+    Если задан pc, обработчик - для инструкции по адресу pc с операндом data:
+    адреса и операнды подставляются в текст как константы.
+    '''
+    info = OPCODES[op]
+    lines, jumps = dispatch.instruction_source(op, pc, data)
+    if pc is None:
+        name = 'lane_%02x' % op
+        next_pc = '(pc + %d) & 0xFFFF' % info.length
+    else:
+        name = 'lane_%04x' % pc
+        next_pc = '0x%04X' % ((pc + info.length) & 0xFFFF)
+    if op == 0x76:      # HLT: дорожка останавливается
+        return _compile(name, ['cpu.pc = ' + next_pc, 'cpu.halted = True']), info.cycles, None
+    match = _CONDITIONAL.match(lines[0]) if len(lines) == 1 else None
+    if match is not None:   # Jcc: cpu.pc = X if условие else Y
+        taken, negate, mask, other = match.groups()
+        return (_compile(name + '_not_taken', ['cpu.pc = ' + other]), info.cycles,
+                (int(mask, 16), bool(negate), _compile(name + '_taken', ['cpu.pc = ' + taken]), info.cycles))
+    if lines[0].startswith('if '):  # Ccc, Rcc: if условие: ... return; иначе следующая инструкция
+        condition = re.match(r'if (not )?r\[6\] & (0x[0-9A-F]+):$', lines[0])
+        end = next(i for i, line in enumerate(lines) if line.strip().startswith('return '))
+        taken = [line[4:] for line in lines[1:end]]
+        return (_compile(name + '_not_taken', lines[end + 1:]), info.cycles,
+                (int(condition.group(2), 16), bool(condition.group(1)),
+                 _compile(name + '_taken', taken), info.cycles_taken))
+    if not jumps:
+        lines = lines + ['cpu.pc = ' + next_pc]
+    return _compile(name, lines), info.cycles, None
+
+
+_HANDLERS = None    # Обработчики по кодам операций (операнды читаются из памяти дорожек)
+
+
+def _handlers():
+    global _HANDLERS
+    if _HANDLERS is None:
+        _HANDLERS = [_handler(op) for op in range(256)]
+    return _HANDLERS
+
+
+class VectorCPU:
+    '''
+    N процессоров i8080, выполняющих одну программу над разными данными.
+    '''
+    def __init__(self, lanes, image=None, at=0):
+        '''
+        :param lanes: Число дорожек
+        :param image: Образ памяти, общий для всех дорожек (bytes или Memory)
+        :param at: Адрес загрузки образа
+        '''
+        _require_numpy()
+        self._handlers = _handlers()
+        self.lanes = lanes
+        self.memory = LaneMemory(lanes, image, at)
+        self._base = self.memory.base
+        self._code = {}     # Обработчики инструкций общего образа по адресам
+        self.r = np.zeros((8, lanes), dtype=np.int64)   # Регистры в порядке CPU.r: B, C, D, E, H, L, F, A
+        self.r[6] = 0b00000010
+        self.sp = np.zeros(lanes, dtype=np.int64)
+        self.pc = np.zeros(lanes, dtype=np.int64)
+        self.cycles = np.zeros(lanes, dtype=np.int64)
+        self.halted = np.zeros(lanes, dtype=bool)
+        self.inte = np.zeros(lanes, dtype=np.int64)
+        self.port_in = _no_input        # port_in(lanes, ports) - значения для IN
+        self.port_out = _no_output      # port_out(lanes, ports, values) - OUT
+
+    @classmethod
+    def from_cpu(cls, cpu, lanes):
+        '''
+        Создаёт lanes дорожек с копией состояния и памяти процессора cpu
+        '''
+        machine = cls(lanes, cpu._m)
+        machine.r[:] = np.array(cpu.r, dtype=np.int64)[:, None]
+        machine.sp[:] = cpu.sp
+        machine.pc[:] = cpu.pc
+        machine.cycles[:] = cpu.cycles
+        machine.halted[:] = cpu.halted
+        machine.inte[:] = cpu.inte
+        return machine
+
+    def cpu(self, lane):
+        '''
+        Возвращает скалярный CPU с копией состояния и памяти дорожки lane
+        '''
+        p = CPU(Memory(self.memory.dump(lane)))
+        p.r[:] = [int(v) for v in self.r[:, lane]]
+        p.sp = int(self.sp[lane])
+        p.pc = int(self.pc[lane])
+        p.cycles = int(self.cycles[lane])
+        p.halted = bool(self.halted[lane])
+        p.inte = int(self.inte[lane])
+        return p
+
+    def _groups(self, keys, lanes):
+        '''
+        Группирует дорожки lanes по значениям keys; генератор пар (значение, дорожки)
+        '''
+        if len(keys) == 0:
+            return
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        lanes = lanes[order]
+        bounds = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        starts = [0] + bounds.tolist()
+        ends = bounds.tolist() + [len(keys)]
+        for s, e in zip(starts, ends):
+            yield int(keys[s]), lanes[s:e]
+
+    def _execute(self, entry, lanes):
+        '''
+        Выполняет обработчик entry (см. _handler) на дорожках lanes
+        '''
+        handler, cycles, conditional = entry
+        if conditional is not None:
+            mask, negate, taken, taken_cycles = conditional
+            condition = (self.r[6][lanes] & mask) != 0
+            if negate:
+                condition = ~condition
+            if condition.any():
+                view = _LaneView(self, lanes[condition])
+                taken(view)
+                view.commit(taken_cycles)
+                lanes = lanes[~condition]
+                if len(lanes) == 0:
+                    return
+        view = _LaneView(self, lanes)
+        handler(view)
+        view.commit(cycles)
+
+    def step(self):
+        '''
+        Выполняет по одной инструкции на каждой неостановленной дорожке.
+        Возвращает число выполненных инструкций.
+        '''
+        active = np.flatnonzero(~self.halted)
+        count = len(active)
+        if count == 0:
+            return 0
+        pc = self.pc[active]
+        memory = self.memory
+        if memory.private_pages:
+            # Дорожки, изменившие страницы со своим кодом, выполняются по кодам операций
+            private = memory.is_private(active, pc) | memory.is_private(active, (pc + 2) & 0xFFFF)
+            if private.any():
+                lanes = active[private]
+                handlers = self._handlers
+                for op, group in self._groups(memory.read(lanes, pc[private]).astype(np.uint8), lanes):
+                    self._execute(handlers[op], group)
+                active = active[~private]
+                pc = pc[~private]
+        # Код в общих страницах одинаков у всех дорожек: обработчики по адресам с константами
+        code = self._code
+        for address, group in self._groups(pc.astype(np.uint16), active):
+            entry = code.get(address)
+            if entry is None:
+                entry = code[address] = self._translate(address)
+            self._execute(entry, group)
+        return count
+
+    def _translate(self, address):
+        '''
+        Строит обработчик инструкции общего образа по адресу address
+        '''
+        base = self._base
+        op = base[address]
+        info = OPCODES[op]
+        data = 0
+        if info.length == 2:
+            data = base[(address + 1) & 0xFFFF]
+        elif info.length == 3:
+            data = base[(address + 1) & 0xFFFF] | base[(address + 2) & 0xFFFF] << 8
+        return _handler(op, address, data)
+
+    def run(self, steps):
+        '''
+        Выполняет до steps шагов или до остановки всех дорожек (HLT).
+        Возвращает общее число выполненных инструкций.
+        '''
+        total = 0
+        for i in range(steps):
+            n = self.step()
+            if n == 0:
+                break
+            total += n
+        return total
+
+
+def check_opcodes(lanes=64, seed=1):
+    '''
+    Сверяет каждый код операции со скалярным CPU: lanes дорожек со случайными регистрами,
+    SP и содержимым памяти около SP и HL выполняют одну инструкцию, затем состояние и
+    память каждой дорожки сравниваются с результатом CPU.step() из того же состояния.
+    Инструкция проверяется дважды: в общем образе (по одному адресу на всех дорожках)
+    и в скопированных страницах дорожек (по случайным адресам со случайными операндами).
+    Возвращает список (код операции, дорожка, описание) расхождений.
+    '''
+    rng = np.random.default_rng(seed)
+    errors = []
+    for op in range(256):
+        for shared in (True, False):
+            operands = rng.integers(0, 256, 2).astype(np.uint8).tobytes()
+            if shared:
+                machine = VectorCPU(lanes, bytes([op]) + operands, 0x8000)
+                machine.pc[:] = 0x8000
+            else:
+                machine = VectorCPU(lanes)
+                machine.pc[:] = rng.integers(0, 0x10000, lanes)
+            machine.r[:] = rng.integers(0, 256, (8, lanes))
+            machine.r[6] = machine.r[6] & 0b11010111 | 0b10
+            machine.sp[:] = rng.integers(0, 0x10000, lanes)
+            hl = machine.r[4] << 8 | machine.r[5]
+            for lane in range(lanes):
+                for addr in (int(machine.sp[lane]), int(hl[lane])):
+                    if not shared or not 0x7FFE <= addr <= 0x8003:
+                        machine.memory.load(lane, rng.integers(0, 256, 2).astype(np.uint8).tobytes(), addr)
+                if not shared:
+                    operands = rng.integers(0, 256, 2).astype(np.uint8).tobytes()
+                    machine.memory.load(lane, bytes([op]) + operands, int(machine.pc[lane]))
+            scalar = [machine.cpu(lane) for lane in range(lanes)]
+            machine.step()
+            for lane, p in enumerate(scalar):
+                try:
+                    p.step()
+                except dispatch.StopExecution as e:
+                    p.cycles += e.cycles
+                q = machine.cpu(lane)
+                for name in ('r', 'sp', 'pc', 'cycles', 'halted', 'inte'):
+                    if getattr(p, name) != getattr(q, name):
+                        errors.append((op, lane, '%s: %r != %r' % (name, getattr(q, name), getattr(p, name))))
+                if bytes(p._m.dump()) != machine.memory.dump(lane):
+                    errors.append((op, lane, 'memory'))
+    return errors
+
+
+def main():
+    _require_numpy()
+    parser = argparse.ArgumentParser(description='Vectorised i8080 lanes')
+    parser.add_argument('--lanes', type=int, default=4096, help='number of lanes in the speed test')
+    parser.add_argument('--steps', type=int, default=2000, help='steps in the speed test')
+    args = parser.parse_args()
+
+    t = time.perf_counter()
+    errors = check_opcodes()
+    print('opcode check: %d mismatches (%.1f s)' % (len(errors), time.perf_counter() - t))
+    for error in errors[:10]:
+        print('  %02X lane %d: %s' % error)
+
+    # Сумма цифр числа из HL делением на 10 (вычитанием) для разных входных данных
+    import assembler
+    program = assembler.assemble('''
+            LXI SP, 0F000H
+            MVI B, 0
+    DIGIT:  MOV A, H
+            ORA L
+            JZ DONE
+            LXI D, -10
+            MVI C, 0
+    DIV:    DAD D
+            INR C
+            JC DIV
+            LXI D, 10
+            DAD D
+            DCR C
+            MOV A, L
+            ADD B
+            MOV B, A
+            MOV L, C
+            MVI H, 0
+            JMP DIGIT
+    DONE:   MOV A, B
+            STA RESULT
+            HLT
+    RESULT: DB 0
+    ''')
+    image = program.image
+    lanes = args.lanes
+    inputs = np.arange(lanes, dtype=np.int64) * 7919 % 10000
+    machine = VectorCPU(lanes, image, program.origin)
+    machine.pc[:] = program.entry
+    machine.r[4] = inputs >> 8
+    machine.r[5] = inputs & 0xFF
+    t = time.perf_counter()
+    executed = machine.run(args.steps)
+    vector_time = time.perf_counter() - t
+    print('vector: %d lanes, %d instructions in %.2f s, %.2f MIPS'
+          % (lanes, executed, vector_time, executed / vector_time / 1e6))
+    sample = min(lanes, 64)
+    t = time.perf_counter()
+    scalar_executed = 0
+    mismatches = 0
+    for lane in range(sample):
+        m = Memory()
+        m.load(image, program.origin)
+        p = CPU(m)
+        p.pc = program.entry
+        p.r[4] = int(inputs[lane]) >> 8
+        p.r[5] = int(inputs[lane]) & 0xFF
+        result = p.run_for(instructions=args.steps)
+        scalar_executed += result.instructions
+        if m[program.symbols['RESULT']] != machine.memory.read(np.array([lane]), program.symbols['RESULT'])[0]:
+            mismatches += 1
+    scalar_time = time.perf_counter() - t
+    print('scalar: %d lanes, %d instructions in %.2f s, %.2f MIPS; %d results differ from vector lanes'
+          % (sample, scalar_executed, scalar_time, scalar_executed / scalar_time / 1e6, mismatches))
+    print('speed-up: %.1fx' % ((executed / vector_time) / (scalar_executed / scalar_time)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Модули эмулятора лежат плоско в каталоге "i8080 emulator" и импортируются по имени
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'i8080 emulator'))
@@ -0,0 +1,60 @@
+'''
+Ассемблер: кодирование, метки и директивы EQU/SET.
+'''
+import pytest
+
+import assembler
+from assembler import AssemblerError
+
+
+def test_forward_label_and_equ():
+    program = assembler.assemble('''
+    COUNT   EQU 3
+            MVI C, COUNT
+            JMP DONE
+    DONE:   HLT
+    ''')
+    assert program.image == bytes([0x0E, 0x03, 0xC3, 0x05, 0x00, 0x76])
+    assert program.symbols['DONE'] == 5
+
+
+def test_set_uses_value_at_each_line():
+    program = assembler.assemble('''
+    X       SET 1
+            MVI A, X
+    X       SET 2
+            MVI B, X
+    X       SET X + 1
+            MVI C, X
+    ''')
+    assert program.image == bytes([0x3E, 0x01, 0x06, 0x02, 0x0E, 0x03])
+    assert program.symbols['X'] == 3
+
+
+def test_set_symbol_used_before_definition():
+    with pytest.raises(AssemblerError):
+        assembler.assemble('''
+            MVI A, X
+    X       SET 2
+    ''')
+
+
+def test_equ_cannot_be_redefined():
+    with pytest.raises(AssemblerError):
+        assembler.assemble('''
+    X       EQU 1
+    X       EQU 2
+    ''')
+
+
+@pytest.mark.parametrize('source', ['L:      NOP', 'SP      EQU 1', '        NOP\nm:      JMP 0'])
+def test_register_name_cannot_be_label(source):
+    with pytest.raises(AssemblerError, match='cannot be a label'):
+        assembler.assemble(source)
+
+
+def test_ds_count_must_not_be_negative():
+    with pytest.raises(AssemblerError, match='negative'):
+        assembler.assemble('        DS -1')
+    program = assembler.assemble('        DS 0\n        NOP')
+    assert program.image == b'\x00'
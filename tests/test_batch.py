@@ -0,0 +1,67 @@
+'''
+Пакетное выполнение: задания из каталога и манифеста на обоих уровнях выполнения.
+'''
+import json
+
+import pytest
+
+import assembler
+import batch
+
+COUNT = '''
+        MVI A, 0
+        LXI H, 2000H
+LOOP:   ADD M
+        INX H
+        DCR C
+        JNZ LOOP
+        STA 3000H
+        HLT
+'''
+
+
+@pytest.fixture
+def jobs_dir(tmp_path):
+    image = assembler.assemble(COUNT).image
+    for i in range(5):
+        (tmp_path / ('count%d.bin' % i)).write_bytes(image)
+    manifest = [{'name': 'sum%d' % i, 'image': 'count%d.bin' % i, 'registers': {'C': i + 1},
+                 'memory': {'0x2000': [1, 2, 3, 4, 5]}}
+                for i in range(5)]
+    manifest.append({'name': 'budget', 'image': 'count0.bin', 'registers': {'C': 0}, 'cycles': 50})
+    (tmp_path / 'jobs.json').write_text(json.dumps({'jobs': manifest}))
+    return tmp_path
+
+
+def _results(results):
+    results = sorted(results, key=lambda r: r['name'])
+    for r in results:
+        assert 'error' not in r, r
+        del r['seconds']
+    return results
+
+
+def test_manifest(jobs_dir):
+    jobs = batch.find_jobs(str(jobs_dir / 'jobs.json'))
+    assert [job.name for job in jobs] == ['sum0', 'sum1', 'sum2', 'sum3', 'sum4', 'budget']
+    assert jobs[2].registers == {'C': 3}
+    assert jobs[2].memory == {0x2000: bytes([1, 2, 3, 4, 5])}
+    assert jobs[5].cycles == 50
+    assert len(batch.find_jobs(str(jobs_dir))) == 5
+
+
+@pytest.mark.parametrize('tier', batch.TIERS)
+def test_jobs_share_one_cpu(jobs_dir, tier):
+    jobs = batch.find_jobs(str(jobs_dir / 'jobs.json'))
+    results = _results(batch.run_batch(jobs, workers=1, tier=tier))
+    sums = {r['name']: r['registers']['A'] for r in results if r['halted']}
+    assert sums == {'sum0': 1, 'sum1': 3, 'sum2': 6, 'sum3': 10, 'sum4': 15}
+    budget = results[0]
+    assert (budget['name'], budget['reason'], budget['halted']) == ('budget', 'cycles', False)
+
+
+def test_tiers_and_processes_agree(jobs_dir):
+    jobs = batch.find_jobs(str(jobs_dir / 'jobs.json'))
+    reference = _results(batch.run_batch(jobs, workers=1))
+    for tier in batch.TIERS:
+        assert _results(batch.run_batch(jobs, workers=2, chunk_size=2, tier=tier)) == reference
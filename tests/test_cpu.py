@@ -0,0 +1,56 @@
+'''
+Процессор: продолжение выполнения после HLT.
+'''
+import pytest
+
+import assembler
+from cpu import CPU
+from dispatch import StopExecution, STOP_CYCLES, STOP_HALT
+from memory import Memory
+from scheduler import Scheduler
+from translator import BlockCache
+
+PROGRAM = '''
+        HLT
+LOOP:   NOP
+        JMP LOOP
+'''
+
+
+def _cpu():
+    m = Memory()
+    assembler.assemble(PROGRAM).load(m)
+    return CPU(m)
+
+
+@pytest.mark.parametrize('blocks', [False, True])
+def test_run_for_resumes_after_hlt(blocks):
+    p = _cpu()
+    runner = BlockCache(p) if blocks else p
+    result = runner.run_for(cycles=100)
+    assert (result.reason, p.halted, p.pc) == (STOP_HALT, True, 1)
+    result = runner.run_for(cycles=100)
+    assert result.reason == STOP_CYCLES
+    assert not p.halted
+
+
+def test_run_until_and_step_clear_halted():
+    p = _cpu()
+    with pytest.raises(StopExecution):
+        p.step()
+    assert p.halted
+    p.step()
+    assert not p.halted
+    p.pc = 0
+    p.run_for(instructions=1)
+    assert p.halted
+    p.run_until(instructions=1)
+    assert not p.halted
+
+
+def test_scheduler_runs_resumed_cpu():
+    p = _cpu()
+    p.run_for(cycles=100)
+    p.run_for(instructions=1)       # Выполнение продолжено мимо HLT
+    result = Scheduler(p).run(cycles=1000)
+    assert result.instructions > 0
@@ -0,0 +1,226 @@
+'''
+Отладчик: команды интерактивной оболочки и пакеты сервера GDB.
+'''
+import socket
+import threading
+
+import pytest
+
+import assembler
+from cpu import CPU
+from debugger import Debugger, DebuggerShell, GDBServer
+from memory import Memory
+
+PROGRAM = '''
+        ORG 0
+        LXI SP, 1000H
+        MVI B, 0
+LOOP:   CALL SUB
+        INR B
+        MOV A, B
+        STA 2000H
+        CPI 10
+        JNZ LOOP
+        HLT
+SUB:    PUSH B
+        MVI C, 3
+INNER:  DCR C
+        JNZ INNER
+        POP B
+        RET
+'''
+
+
+def _debugger():
+    program = assembler.assemble(PROGRAM)
+    m = Memory()
+    program.load(m)
+    return Debugger(CPU(m), program.symbols), program.symbols
+
+
+@pytest.fixture
+def shell(capsys):
+    d, symbols = _debugger()
+    s = DebuggerShell(d)
+
+    def run(line):
+        capsys.readouterr()
+        s.onecmd(line)
+        return capsys.readouterr().out
+    run.debugger = d
+    run.symbols = symbols
+    return run
+
+
+def test_shell_break_and_continue(shell):
+    d, s = shell.debugger, shell.symbols
+    assert 'Breakpoint(%04X' % s['SUB'] in shell('break SUB')
+    out = shell('continue')
+    assert 'breakpoint %04X' % s['SUB'] in out
+    assert d.cpu.pc == s['SUB']
+    shell('continue')
+    assert d.cpu.pc == s['SUB'] and d.cpu.r[0] == 1     # B
+    assert 'hits=2' in shell('info breakpoints')
+    shell('delete SUB')
+    assert shell('info') == ''
+    shell('c')
+    assert d.cpu.halted and d.cpu.r[0] == 10
+
+
+def test_shell_conditional_break(shell):
+    d, s = shell.debugger, shell.symbols
+    shell('break LOOP if b == 5')
+    shell('continue')
+    assert d.cpu.pc == s['LOOP'] and d.cpu.r[0] == 5
+
+
+def test_shell_step_next_finish(shell):
+    d, s = shell.debugger, shell.symbols
+    shell('step 2')
+    assert d.cpu.pc == s['LOOP']
+    shell('next')       # CALL выполняется целиком
+    assert d.cpu.pc == s['LOOP'] + 3 and d.cpu.sp == 0x1000
+    shell('break INNER')
+    shell('continue')
+    assert d.cpu.pc == s['INNER']
+    shell('delete')
+    shell('finish')
+    assert d.cpu.pc == s['LOOP'] + 3 and d.cpu.sp == 0x1000
+    assert d.cpu.r[1] == 0      # C: подпрограмма отработала до RET
+
+
+def test_shell_watch_and_memory(shell):
+    d = shell.debugger
+    shell('watch 2000H')
+    out = shell('continue')
+    assert 'watchpoint' in out and 'at 2000' in out
+    assert d.cpu._m[0x2000] == 1
+    assert shell('x 2000H 4') == '2000  01 00 00 00\n'
+    shell('delete')
+    assert d.watchpoints == [] and shell('info') == ''
+
+
+def test_shell_registers_and_set(shell):
+    d = shell.debugger
+    shell('set a 42H')
+    shell('set hl 1234H')
+    assert d.cpu.r[7] == 0x42 and d.cpu.hl == 0x1234
+    assert shell('registers') == shell('info registers') == '%s\n' % d.cpu
+    assert shell('set q 1').startswith('Error:')
+    assert shell('disassemble 0 2') == '0000  31 00 10  LXI SP, 1000H\n0003  06 00     MVI B, 00H\n'
+
+
+class _Client:
+    '''
+    Клиент протокола GDB: пакеты с контрольной суммой и подтверждениями
+    '''
+    def __init__(self, server):
+        self.thread = threading.Thread(target=server.serve)
+        self.thread.start()
+        self.socket = socket.create_connection(('127.0.0.1', server.port), timeout=10)
+        self.buffer = b''
+
+    def _read(self):
+        data = self.socket.recv(4096)
+        assert data
+        self.buffer += data
+
+    def send(self, packet, checksum=None):
+        data = packet.encode('latin-1')
+        checksum = sum(data) & 0xFF if checksum is None else checksum
+        self.socket.sendall(b'$%s#%02x' % (data, checksum))
+        while not self.buffer:
+            self._read()
+        ack, self.buffer = self.buffer[:1], self.buffer[1:]
+        return ack
+
+    def reply(self):
+        while b'#' not in self.buffer or len(self.buffer) < self.buffer.index(b'#') + 3:
+            self._read()
+        end = self.buffer.index(b'#')
+        assert self.buffer[:1] == b'$'
+        body = self.buffer[1:end]
+        assert int(self.buffer[end + 1:end + 3], 16) == sum(body) & 0xFF
+        self.buffer = self.buffer[end + 3:]
+        self.socket.sendall(b'+')
+        return body.decode('latin-1')
+
+    def request(self, packet):
+        assert self.send(packet) == b'+'
+        return self.reply()
+
+    def close(self):
+        assert self.request('D') == 'OK'
+        self.socket.close()
+        self.thread.join(10)
+        assert not self.thread.is_alive()
+
+
+@pytest.fixture
+def gdb():
+    d, symbols = _debugger()
+    server = GDBServer(d, 0)
+    client = _Client(server)
+    client.debugger = d
+    client.symbols = symbols
+    yield client
+    client.close()
+    server.close()
+
+
+def test_gdb_checksum(gdb):
+    assert gdb.send('?', checksum=0) == b'-'    # Пакет с неверной суммой отвергается
+    assert gdb.request('?') == 'S05'
+
+
+def test_gdb_registers(gdb):
+    d = gdb.debugger
+    assert gdb.request('g') == '0002' + '00' * 6 + '0000' + '0000'    # В F всегда установлен бит 1
+    d.set_register('a', 0x12)
+    d.set_register('hl', 0xABCD)
+    d.set_register('sp', 0x1234)
+    assert gdb.request('g') == '1202' + '00' * 4 + 'abcd' + '3412' + '0000'
+    assert gdb.request('p9') == '0000'
+    assert gdb.request('P0=42') == 'OK' and d.cpu.r[7] == 0x42
+    assert gdb.request('pa') == 'E01'
+
+
+def test_gdb_memory(gdb):
+    d = gdb.debugger
+    assert gdb.request('m0,4') == '31001006'
+    assert gdb.request('M3000,2:abcd') == 'OK'
+    assert d.read_memory(0x3000, 2) == b'\xab\xcd'
+    assert gdb.request('m3000,2') == 'abcd'
+
+
+def test_gdb_breakpoint_continue_step(gdb):
+    d, s = gdb.debugger, gdb.symbols
+    assert gdb.request('Z0,%x,1' % s['SUB']) == 'OK'
+    assert gdb.request('c') == 'S05'
+    assert d.cpu.pc == s['SUB']
+    assert gdb.request('p9') == '%02x%02x' % (s['SUB'] & 0xFF, s['SUB'] >> 8)
+    assert gdb.request('s') == 'S05'
+    assert d.cpu.pc == s['SUB'] + 1
+    assert gdb.request('z0,%x,1' % s['SUB']) == 'OK'
+    assert gdb.request('Z2,2000,1') == 'OK'
+    assert gdb.request('c') == 'T05watch:2000;'
+    assert d.cpu._m[0x2000] == 1
+    assert gdb.request('z2,2000,1') == 'OK'
+    assert gdb.request('c') == 'S05'
+    assert d.cpu.halted
+
+
+def test_gdb_interrupt():
+    program = assembler.assemble('LOOP: JMP LOOP')
+    m = Memory()
+    program.load(m)
+    d = Debugger(CPU(m))
+    server = GDBServer(d, 0)
+    server.SLICE = 1000
+    client = _Client(server)
+    assert client.send('c') == b'+'
+    client.socket.sendall(b'\x03')
+    assert client.reply() == 'S02'
+    assert d.cpu.cycles > 0
+    client.close()
+    server.close()
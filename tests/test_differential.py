@@ -0,0 +1,127 @@
+'''
+Дифференциальная проверка уровней выполнения (differential.run_lockstep):
+трансляция блоков и векторный процессор против интерпретатора на нагрузках bench.
+'''
+import pytest
+
+import bench
+import differential
+from cpu import RunResult
+from dispatch import STOP_CYCLES, STOP_INSTRUCTIONS, STOP_HALT
+from translator import BlockCache
+
+WORKLOADS = bench.BUILTIN_WORKLOADS + list(bench.GROUP_WORKLOADS.values())
+
+
+class VectorTier:
+    '''
+    Векторный процессор (lanes одинаковых дорожек) с интерфейсом run_for() для
+    differential: состояние берётся из cpu и после выполнения записывается обратно
+    '''
+    def __init__(self, cpu, lanes=3):
+        np = pytest.importorskip('numpy')
+        import vector
+        self._np = np
+        self._cpu = cpu
+        self._machine = vector.VectorCPU.from_cpu(cpu, lanes)
+        self._machine.port_in = self._port_in
+        self._machine.port_out = self._port_out
+
+    def _port_in(self, lanes, ports):
+        ports = self._np.broadcast_to(ports, lanes.shape)
+        return self._np.array([self._cpu.port_in(int(port)) for port in ports])
+
+    def _port_out(self, lanes, ports, values):
+        ports = self._np.broadcast_to(ports, lanes.shape)
+        values = self._np.broadcast_to(values, lanes.shape)
+        for port, value in zip(ports, values):
+            self._cpu.port_out(int(port), int(value))
+
+    def run_for(self, cycles=None, instructions=None):
+        machine = self._machine
+        start = int(machine.cycles[0])
+        n = 0
+        reason = STOP_INSTRUCTIONS
+        while instructions is None or n < instructions:
+            if cycles is not None and machine.cycles[0] - start >= cycles:
+                reason = STOP_CYCLES
+                break
+            if not machine.step():
+                break
+            n += 1
+            if machine.halted[0]:
+                reason = STOP_HALT
+                break
+        first = machine.cpu(0)
+        for lane in range(1, machine.lanes):   # Все дорожки выполняют одно и то же
+            other = machine.cpu(lane)
+            assert (other.r, other.pc, other.sp, other.cycles) == (first.r, first.pc, first.sp, first.cycles)
+        cpu = self._cpu
+        cpu.r[:] = first.r
+        cpu.sp, cpu.pc, cpu.cycles = first.sp, first.pc, first.cycles
+        cpu.halted, cpu.inte = first.halted, first.inte
+        cpu._m.load(first._m.dump())
+        return RunResult(n, cpu.cycles - start, reason)
+
+
+@pytest.mark.parametrize('workload', WORKLOADS, ids=lambda w: w.name)
+def test_blocks_match_interpreter(workload):
+    assert differential.run_lockstep(workload.cpu(), BlockCache, instructions=200000) is None
+
+
+@pytest.mark.parametrize('workload', WORKLOADS, ids=lambda w: w.name)
+def test_vector_matches_interpreter(workload):
+    assert differential.run_lockstep(workload.cpu(), VectorTier, instructions=3000, interval=500) is None
+
+
+def _broken_tier(opcode):
+    '''
+    Уровень, у которого инструкция opcode выполняется неверно (не меняет флаги)
+    '''
+    def tier(cpu):
+        handler = cpu._handlers[opcode]
+
+        def broken(p):
+            f = p.r[6]
+            cycles = handler(p)
+            p.r[6] = f
+            return cycles
+        cpu._handlers = list(cpu._handlers)
+        cpu._handlers[opcode] = broken
+        return cpu
+    return tier
+
+
+def test_divergence_points_at_faulty_instruction():
+    import assembler
+    program = assembler.assemble('''
+            LXI SP, 1000H
+            MVI B, 0
+            MVI C, 10
+    LOOP:   INR B
+            DCR C
+            JNZ LOOP
+            HLT
+    ''')
+    from cpu import CPU
+    from memory import Memory
+    m = Memory()
+    program.load(m)
+    p = CPU(m)
+    p.pc = program.entry
+    divergence = differential.run_lockstep(p, _broken_tier(0x0D), instructions=1000, interval=100)
+    assert divergence is not None
+    assert divergence.index == 4
+    assert divergence.text.startswith('DCR')
+    assert 'f' in divergence.fields
+
+
+def test_trace_reference_matches():
+    from recording import RingRecorder
+    workload = WORKLOADS[0]
+    p = workload.cpu()
+    recorder = RingRecorder(1 << 14)
+    p.set_recorder(recorder)
+    p.run_for(instructions=5000)
+    p.set_recorder(None)
+    assert differential.check_trace(workload.cpu(), recorder.reader(), interval=250) is None
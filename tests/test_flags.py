@@ -0,0 +1,36 @@
+'''
+Таблицы флагов: выборочные значения из описания i8080.
+'''
+import flags
+from flags import FLAG_S, FLAG_Z, FLAG_A, FLAG_P, FLAG_C, FLAG_ONE
+
+
+def test_szp():
+    assert flags.SZP[0] == FLAG_ONE | FLAG_Z | FLAG_P
+    assert flags.SZP[0x80] == FLAG_ONE | FLAG_S
+    assert flags.SZP[0x03] == FLAG_ONE | FLAG_P
+
+
+def test_add():
+    # 3AH + C6H = 00H с переносом из обоих полубайтов
+    assert flags.ADD_FLAGS[0x3A << 8 | 0xC6] == FLAG_ONE | FLAG_Z | FLAG_A | FLAG_P | FLAG_C
+    assert flags.ADD_FLAGS[1 << 16 | 0x0F << 8 | 0x00] == FLAG_ONE | FLAG_A
+
+
+def test_sub():
+    # SUB A: ноль, перенос из бита 3 при сложении с дополнением, без заёма
+    assert flags.SUB_FLAGS[0x3E << 8 | 0x3E] == FLAG_ONE | FLAG_Z | FLAG_A | FLAG_P
+    f = flags.SUB_FLAGS[0x02 << 8 | 0x05]
+    assert f & FLAG_C and f & FLAG_S
+
+
+def test_and_aux_carry():
+    assert flags.AND_FLAGS[0x08 << 8 | 0x00] & FLAG_A
+    assert not flags.AND_FLAGS[0x07 << 8 | 0x07] & FLAG_A
+
+
+def test_daa():
+    # 9BH: прибавляется 66H, A = 01H, C = 1, A = 1
+    value = flags.DAA_TABLE[0x9B]
+    assert value >> 8 == 0x01
+    assert value & FLAG_C and value & FLAG_A
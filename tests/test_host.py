@@ -0,0 +1,52 @@
+'''
+Выполнение в asyncio: ожидание ввода не оставляет лишних записей в трассе и профиле.
+'''
+import asyncio
+
+import assembler
+import host
+from cpu import CPU
+from memory import Memory
+from profiling import Profiler
+from recording import RingRecorder
+
+PROGRAM = '''
+        LXI SP, 1000H
+NEXT:   IN 0
+        CPI 1AH
+        JZ DONE
+        OUT 1
+        JMP NEXT
+DONE:   HLT
+'''
+
+
+def test_run_async_records_waiting_in_once():
+    program = assembler.assemble(PROGRAM)
+    m = Memory()
+    program.load(m)
+    p = CPU(m)
+    recorder = RingRecorder()
+    profiler = Profiler()
+    p.set_recorder(recorder)
+    p.set_profiler(profiler)
+    machine = host.Machine(p)
+    device = host.AsyncInput()
+    output = host.AsyncOutput()
+    machine.bus.register(0, read=device.read)
+    machine.bus.register(1, write=output.write)
+
+    async def feed():
+        task = asyncio.ensure_future(machine.run_async(1000))
+        for c in b'abc':
+            await asyncio.sleep(0.001)
+            device.feed([c])
+        await asyncio.sleep(0.001)
+        device.close()
+        return await task
+
+    result = asyncio.run(feed())
+    assert output.getvalue() == b'abc'
+    assert recorder.count == result.instructions == 1 + 5 * 3 + 3 + 1
+    assert sum(profiler.opcode_counts) == result.instructions
+    assert profiler.opcode_counts[0xDB] == 4
@@ -0,0 +1,48 @@
+'''
+Запуск программ CP/M: выход из программы командой RET.
+'''
+import assembler
+import bench
+from dispatch import STOP_HALT
+from iobus import run_cpm
+from translator import BlockCache
+
+PROGRAM = '''
+        ORG 100H
+        MVI C, 2        ; BDOS: вывод символа
+        MVI E, 'A'
+        CALL 5
+        RET             ; Возврат в CP/M
+'''
+
+
+def test_ret_returns_to_cpm():
+    image = assembler.assemble(PROGRAM).image
+    for runner in (None, BlockCache):
+        result, console = run_cpm(image, cycles=100000, runner=runner)
+        assert (result.instructions, result.reason) == (8, STOP_HALT)    # 4 + JMP BDOS; OUT; RET + HLT
+        assert console.getvalue() == b'A'
+
+
+def test_com_workload_ret_halts(tmp_path):
+    path = tmp_path / 'ret.com'
+    path.write_bytes(assembler.assemble(PROGRAM).image)
+    p = bench.load_workload(str(path)).cpu()
+    result = p.run_for(cycles=100000)
+    assert (result.instructions, result.reason) == (7, STOP_HALT)        # 4 + JMP BDOS; RET + HLT
+    assert p.pc == 1
+
+
+def test_guest_out_to_bdos_port_is_not_a_call():
+    image = assembler.assemble('''
+            ORG 100H
+            MVI C, 2
+            MVI E, 'B'
+            OUT 0FFH        ; Не вызов BDOS
+            CALL 5
+            RET
+    ''').image
+    for runner in (None, BlockCache):
+        result, console = run_cpm(image, cycles=100000, runner=runner)
+        assert result.reason == STOP_HALT
+        assert console.getvalue() == b'B'
@@ -0,0 +1,63 @@
+'''
+Память: уведомления наблюдателей при загрузке образа.
+'''
+import pytest
+
+import assembler
+from cpu import CPU
+from memory import Memory
+from translator import BlockCache
+
+
+def test_load_notifies_unaligned_range():
+    m = Memory()
+    seen = []
+    m.watch_range(0x2410, 0x2420, seen.append)
+    m.load(bytes(256), 0x2400)
+    m.load(bytes(8), 0x2400)        # Область не затронута
+    m.load(bytes(4), 0x2418)
+    assert seen == [0x2410, 0x2418]
+    m.unwatch_range(seen.append)
+    m.load(bytes(256), 0x2400)
+    assert seen == [0x2410, 0x2418]
+
+
+def test_load_notifies_aligned_range_per_page():
+    m = Memory()
+    seen = []
+    m.watch_range(0x2400, 0x2600, seen.append)
+    m.load(bytes(0x100), 0x2480)
+    assert seen == [0x2480, 0x2500]
+
+
+def test_load_under_block_cache():
+    m = Memory()
+    p = CPU(m)
+    blocks = BlockCache(p)
+    m.load(assembler.assemble('MVI A, 1\nINR A\nHLT').image)
+    blocks.run_for(cycles=100)
+    assert len(blocks) > 0
+    m.load(bytes(0x10000))      # Снимает последнего наблюдателя посреди загрузки
+    assert len(blocks) == 0
+    p.pc = 0
+    m.load(assembler.assemble('MVI A, 5\nHLT').image)
+    blocks.run_for(cycles=100)
+    assert p.r[7] == 5
+
+
+def test_watch_range_rejects_duplicate_unaligned_callback():
+    m = Memory()
+    seen = []
+    m.watch_range(0x2410, 0x2420, seen.append)
+    with pytest.raises(ValueError):
+        m.watch_range(0x3010, 0x3020, seen.append)
+    with pytest.raises(ValueError):
+        m.watch_range(0x3000, 0x3100, seen.append)
+    m.unwatch_range(seen.append)
+    m[0x2410] = 1
+    assert seen == []
+    assert m._callbacks is None
+    m.watch_range(0x2400, 0x2500, seen.append)
+    m.watch_range(0x3000, 0x3100, seen.append)     # Выровненные области объединяются
+    m[0x3000] = 1
+    assert seen == [0x3000]
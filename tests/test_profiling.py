@@ -0,0 +1,90 @@
+'''
+Профилировщик: счётчики обращений к памяти на обоих уровнях выполнения и
+совместная работа с другими обёртками таблицы обработчиков и функций доступа к памяти.
+'''
+import pytest
+
+import assembler
+import bench
+import dispatch
+from cpu import CPU
+from debugger import Debugger, WATCH_READ, STOP_WATCHPOINT
+from memory import Memory
+from profiling import Profiler
+from recording import RingRecorder
+from translator import BlockCache
+
+
+def _profile(blocks):
+    workload = [w for w in bench.BUILTIN_WORKLOADS if w.name == 'memcopy'][0]
+    p = workload.cpu()
+    profiler = Profiler()
+    p.set_profiler(profiler)
+    runner = BlockCache(p) if blocks else p
+    runner.run_for(instructions=20000)
+    p.set_profiler(None)
+    return profiler
+
+
+def test_block_tier_memory_accesses_are_counted():
+    interpreter = _profile(False)
+    blocks = _profile(True)
+    assert sum(blocks.page_writes) == sum(interpreter.page_writes) > 0
+    # Блоки не читают коды и операнды своих инструкций, остальные чтения считаются
+    assert 0 < sum(blocks.page_reads) < sum(interpreter.page_reads)
+
+
+def test_counters_survive_access_changes():
+    p = CPU(Memory())
+    profiler = Profiler()
+    p.set_profiler(profiler)
+    p._m.track_dirty()      # Перестраивает функции доступа
+    p._m.write(0x1234, 1)
+    p._m.read(0x1234)
+    assert profiler.page_writes[0x12] == 1
+    assert profiler.page_reads[0x12] == 1
+    p.set_profiler(None)
+    p._m.write(0x1234, 2)
+    assert profiler.page_writes[0x12] == 1
+
+
+def test_profiler_detach_keeps_debugger_read_watch():
+    program = assembler.assemble('''
+            LXI SP, 1000H
+    LOOP:   NOP
+            NOP
+            LDA 2000H
+            JMP LOOP
+    ''')
+    m = Memory()
+    program.load(m)
+    p = CPU(m)
+    debugger = Debugger(p)
+    debugger.add_watchpoint(0x2000, kind=WATCH_READ)
+    profiler = Profiler()
+    p.set_profiler(profiler)
+    p.set_profiler(None)
+    debugger.cont(cycles=1000)
+    assert debugger.stop_info[0] == STOP_WATCHPOINT
+
+
+@pytest.mark.parametrize('recorder_first', [True, False])
+def test_wrappers_detach_in_any_order(recorder_first):
+    p = CPU(Memory())
+    recorder = RingRecorder()
+    profiler = Profiler()
+    debugger = Debugger(p)
+    p.set_recorder(recorder)
+    p.set_profiler(profiler)
+    p.run_for(instructions=10)
+    assert (recorder.count, profiler.opcode_counts[0]) == (10, 10)
+    if recorder_first:
+        p.set_recorder(None)
+        p.set_profiler(None)
+    else:
+        p.set_profiler(None)
+        p.set_recorder(None)
+    p.run_for(instructions=10)
+    assert (recorder.count, profiler.opcode_counts[0]) == (10, 10)
+    debugger.detach()
+    assert p._handlers is dispatch.HANDLERS
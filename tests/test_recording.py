@@ -0,0 +1,64 @@
+'''
+Регистратор трассы: такты в записях совпадают с cpu.cycles.
+'''
+import assembler
+from cpu import CPU
+from memory import Memory
+from opcodes import OPCODES
+from recording import RingRecorder
+from scheduler import Scheduler
+
+PROGRAM = '''
+        ORG 0
+        JMP START
+        ORG 8
+        PUSH PSW        ; RST 1
+        POP PSW
+        EI
+        RET
+START:  LXI SP, 1000H
+        EI
+WAIT:   HLT
+        JMP WAIT
+'''
+PERIOD = 1000
+
+
+def _cpu():
+    m = Memory()
+    assembler.assemble(PROGRAM).load(m)
+    return CPU(m)
+
+
+def test_cycles_follow_interrupts_and_hlt():
+    p = _cpu()
+    recorder = RingRecorder()
+    p.set_recorder(recorder)
+    scheduler = Scheduler(p)
+    scheduler.every(PERIOD, lambda s: s.request_interrupt(1))
+    scheduler.run(cycles=5 * PERIOD + 100)
+    records = list(recorder.reader())
+    # Процессор ждёт в HLT до события, затем RST (11 тактов) и PUSH PSW (11 тактов)
+    assert [r.cycles for r in records if r.pc == 8] == [k * PERIOD + 22 for k in range(1, 6)]
+    cycles = 0
+    for r in records:
+        assert r.cycles >= cycles + OPCODES[r.opcode].cycles
+        cycles = r.cycles
+
+
+def test_cycles_after_batches_steps_and_restore():
+    p = _cpu()
+    recorder = RingRecorder()
+    p.set_recorder(recorder)
+    start = p.snapshot()
+    p.run_for(instructions=2)
+    p.step()
+    p.cycles += 100
+    p.run_for(instructions=1)
+    assert [r.cycles for r in recorder.reader()] == [10, 20, 24, 131]
+    assert p.cycles == 131
+    p.restore(start)
+    p.run_for(instructions=1)
+    p.reset()
+    p.run_for(instructions=1)
+    assert [r.cycles for r in recorder.reader()][4:] == [10, 10]
@@ -0,0 +1,75 @@
+'''
+Планировщик: прерывания и задержка после EI.
+'''
+import pytest
+
+import assembler
+from cpu import CPU
+from dispatch import StopExecution, STOP_WAIT
+from memory import Memory
+from scheduler import Scheduler
+from translator import BlockCache
+
+PROGRAM = '''
+        ORG 0
+        JMP START
+        ORG 8
+        INR B           ; RST 1
+        EI
+        RET
+        ORG 40H
+START:  LXI SP, 1000H
+        EI
+LOOP:   JMP LOOP
+'''
+
+
+def _machine():
+    program = assembler.assemble(PROGRAM)
+    m = Memory()
+    program.load(m)
+    for addr in range(0xFF0, 0xFFE):
+        m[addr] = 0xAA
+    return CPU(m)
+
+
+def test_interrupt_waits_one_instruction_after_ei():
+    p = _machine()
+    p.run_for(instructions=2)       # JMP START; LXI SP
+    p.step()                        # EI
+    assert p.inte
+    assert not p.interrupt(1)
+    p.step()                        # JMP LOOP
+    assert p.interrupt(1)
+    assert p.pc == 0x08
+
+
+@pytest.mark.parametrize('blocks', [False, True])
+def test_ei_ret_does_not_nest_interrupts(blocks):
+    p = _machine()
+    scheduler = Scheduler(p, BlockCache(p) if blocks else None)
+    for _ in range(5):
+        scheduler.request_interrupt(1)
+    scheduler.run(cycles=2000)
+    assert p.r[0] == 5
+    assert p.sp == 0x1000
+    # Кадры прерываний не вкладываются: ниже 0xFFE стек не опускается
+    assert bytes(p._m[addr] for addr in range(0xFF0, 0xFFE)) == b'\xaa' * 14
+
+
+def _wait(port):
+    raise StopExecution(STOP_WAIT, 0)
+
+
+@pytest.mark.parametrize('pending', [False, True])
+def test_stop_reason_is_returned(pending):
+    m = Memory()
+    assembler.assemble('LXI SP, 1000H\nIN 1\nHLT').load(m)
+    p = CPU(m)
+    p.port_in = _wait
+    scheduler = Scheduler(p)
+    if pending:
+        scheduler.request_interrupt(1)  # Прерывания запрещены: выполнение с проверкой после каждой команды
+    result = scheduler.run(cycles=1000)
+    assert (result.instructions, result.reason) == (1, STOP_WAIT)
+    assert not p.halted
@@ -0,0 +1,103 @@
+'''
+Снимки состояния: сериализация, снимки по изменённым страницам и fork.
+'''
+import pytest
+
+import assembler
+from cpu import CPU
+from memory import Memory
+from snapshot import Snapshot, SnapshotError
+
+PROGRAM = '''
+        LXI SP, 1000H
+        LXI H, 2000H
+LOOP:   INR M
+        INX H
+        MOV A, L
+        CPI 40H
+        JNZ LOOP
+        EI
+        NOP
+        HLT
+'''
+
+
+def _cpu():
+    m = Memory()
+    assembler.assemble(PROGRAM).load(m)
+    return CPU(m)
+
+
+def _state(p):
+    return list(p.r), p.sp, p.pc, p.cycles, p.halted, p.inte, p._ei_pc, bytes(p._m.dump())
+
+
+def _run_to_ei(p):
+    p.run_until(lambda cpu: cpu.inte)
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_bytes_round_trip(compress):
+    p = _cpu()
+    _run_to_ei(p)
+    blob = p.snapshot().to_bytes(compress)
+    q = CPU(Memory())
+    q.restore(blob)
+    assert _state(q) == _state(p)
+    assert q._ei_pc is not None
+
+
+def test_restore_keeps_ei_delay():
+    p = _cpu()
+    _run_to_ei(p)
+    state = p.snapshot()
+    for restored in (state, Snapshot.from_bytes(state.to_bytes())):
+        q = CPU(Memory())
+        q.restore(restored)
+        assert not q.interrupt(1)
+        q.step()
+        assert q.interrupt(1)
+
+
+def test_restore_clears_ei_delay():
+    p = _cpu()
+    state = p.snapshot()
+    _run_to_ei(p)
+    p.restore(state.to_bytes())
+    assert p._ei_pc is None
+
+
+def test_bad_blob():
+    with pytest.raises(SnapshotError):
+        Snapshot.from_bytes(b'I80S')
+    blob = bytearray(_cpu().snapshot().to_bytes())
+    blob[4] = 1     # Прежняя версия формата
+    with pytest.raises(SnapshotError):
+        Snapshot.from_bytes(bytes(blob))
+
+
+def test_dirty_snapshot_matches_full_capture():
+    p = _cpu()
+    p._m.track_dirty()
+    base = p.snapshot()
+    p.run_for(instructions=50)
+    dirty = p._m.dirty_pages(clear=True)
+    incremental = p.snapshot(base, dirty)
+    full = Snapshot.capture(p)
+    assert incremental.memory() == full.memory()
+    assert incremental.shared_pages(base) == 255       # Изменилась только страница 20H
+    q = _cpu()
+    q.restore(incremental)
+    assert _state(q) == _state(p)
+
+
+def test_fork_is_independent():
+    p = _cpu()
+    _run_to_ei(p)
+    q = p.fork()
+    assert _state(q) == _state(p)
+    q.run_for(cycles=100)
+    assert q.halted and not p.halted
+    assert q.cycles > p.cycles
+    q._m[0x2000] = 0x55
+    assert p._m[0x2000] == 1
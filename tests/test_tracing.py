@@ -0,0 +1,103 @@
+'''
+Трассировка: строки трассы и приёмники.
+'''
+import io
+
+import assembler
+import dispatch
+import tracing
+from cpu import CPU
+from memory import Memory
+
+PROGRAM = 'MVI A, 12H\nLXI H, 1234H\nINR A\nHLT'
+LINES = ['0000  3E 12     MVI A, 12H',
+         '0002  21 34 12  LXI H, 1234H',
+         '0005  3C        INR A',
+         '0006  76        HLT']
+
+
+def _cpu():
+    m = Memory()
+    assembler.assemble(PROGRAM).load(m)
+    return CPU(m)
+
+
+def test_instruction_trace():
+    p = _cpu()
+    sink = tracing.RingBufferSink()
+    p.set_trace(tracing.TRACE_INSTRUCTION, sink)
+    result = p.run_for(cycles=1000)
+    assert result.instructions == 4
+    assert sink.lines() == LINES
+
+
+def test_state_trace_follows_each_instruction():
+    p = _cpu()
+    sink = tracing.RingBufferSink()
+    p.set_trace(tracing.TRACE_STATE, sink)
+    p.run_for(cycles=1000)
+    lines = sink.lines()
+    assert lines[0::2] == LINES
+    assert lines[1].startswith('B=0; C=0; D=0; E=0; H=0; L=0; F=2; A=18; PC=2;')
+    assert 'H=18; L=52;' in lines[3]
+    assert 'A=19; PC=6;' in lines[5]
+    assert len(lines) == 7      # HLT останавливает выполнение до строки состояния
+
+
+def test_trace_off_restores_plain_handlers():
+    p = _cpu()
+    sink = tracing.RingBufferSink()
+    p.set_trace(tracing.TRACE_INSTRUCTION, sink)
+    p.step()
+    p.set_trace(tracing.TRACE_OFF)
+    assert p._handlers is dispatch.HANDLERS
+    p.run_for(cycles=1000)
+    assert sink.lines() == LINES[:1]
+
+
+def test_ring_buffer_keeps_last_lines():
+    p = _cpu()
+    sink = tracing.RingBufferSink(size=2)
+    p.set_trace(tracing.TRACE_INSTRUCTION, sink)
+    p.run_for(cycles=1000)
+    assert sink.lines() == LINES[2:]
+    sink.clear()
+    assert sink.lines() == []
+
+
+def test_callback_and_stdout_sinks(capsys):
+    lines = []
+    p = _cpu()
+    p.set_trace(tracing.TRACE_INSTRUCTION, tracing.CallbackSink(lines.append))
+    p.run_for(cycles=1000)
+    assert lines == LINES
+    p = _cpu()
+    p.set_trace(tracing.TRACE_INSTRUCTION, tracing.StdoutSink())
+    p.run_for(cycles=1000)
+    assert capsys.readouterr().out == '\n'.join(LINES) + '\n'
+
+
+def test_file_sink_buffers_lines(tmp_path):
+    path = tmp_path / 'trace.txt'
+    sink = tracing.FileSink(str(path), buffer_lines=3)
+    p = _cpu()
+    p.set_trace(tracing.TRACE_INSTRUCTION, sink)
+    p.run_for(cycles=1000)
+    assert path.read_text() == '\n'.join(LINES[:3]) + '\n'     # Четвёртая строка ещё в буфере
+    sink.close()
+    assert path.read_text() == '\n'.join(LINES) + '\n'
+    stream = io.StringIO()
+    sink = tracing.FileSink(stream)
+    sink.write('x')
+    sink.close()
+    assert stream.getvalue() == 'x\n' and not stream.closed
+
+
+def test_traced_handlers_wrap_table():
+    lines = []
+    handlers = tracing.traced_handlers(dispatch.HANDLERS, tracing.TRACE_INSTRUCTION,
+                                       tracing.CallbackSink(lines.append))
+    p = _cpu()
+    cycles = handlers[0x3E](p)
+    assert (cycles, p.r[7], p.pc) == (7, 0x12, 2)
+    assert lines == LINES[:1]
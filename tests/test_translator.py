@@ -0,0 +1,78 @@
+'''
+Трансляция блоков: самомодифицирующийся код.
+'''
+import assembler
+from cpu import CPU
+from memory import Memory
+from translator import BlockCache
+
+
+def _machine(source, mirror=False):
+    program = assembler.assemble(source)
+    m = Memory()
+    program.load(m)
+    if mirror:
+        m.map_mirror(0x8000, 0x9000, 0x0000)
+    p = CPU(m)
+    p.pc = program.entry
+    return p
+
+
+def _run_both(source, mirror=False):
+    states = []
+    for blocks in (False, True):
+        p = _machine(source, mirror)
+        runner = BlockCache(p) if blocks else p
+        result = runner.run_for(cycles=100000)
+        states.append(((result.instructions, result.cycles, result.reason), list(p.r), p.pc, p.sp, bytes(p._m.dump())))
+    return states
+
+
+def test_store_into_running_block():
+    interpreter, blocks = _run_both('''
+            LXI SP, 1000H
+            MVI C, 3
+    LOOP:   LXI H, PATCH
+            MVI M, 14H      ; INR B -> INR D
+    PATCH:  INR B
+            DCR C
+            JNZ LOOP
+            HLT
+    ''')
+    assert interpreter == blocks
+
+
+def test_store_through_mirror_invalidates_target_page():
+    interpreter, blocks = _run_both('''
+            LXI SP, 1000H
+            MVI C, 3
+            JMP LOOP
+    LOOP:
+    PATCH:  INR B
+            DCR C
+            JZ DONE
+            LXI H, 8000H + PATCH
+            MVI M, 14H      ; INR B -> INR D через зеркало
+            JMP LOOP
+    DONE:   HLT
+    ''', mirror=True)
+    assert interpreter == blocks
+    assert blocks[1][0] == 1 and blocks[1][2] == 2     # B = 1, D = 2
+
+
+def test_final_jump_store_does_not_exit_next_block():
+    # CALL записывает адрес возврата в собственный блок; следующий блок с записью
+    # (STA) должен выполниться целиком, без лишней трансляции с середины
+    p = _machine('''
+            LXI SP, ENTRY + 3
+            JMP ENTRY
+    ENTRY:  CALL SUB
+    SUB:    MVI A, 1
+            STA 0800H
+            HLT
+    ''')
+    cache = BlockCache(p)
+    result = cache.run_for(cycles=1000)
+    assert result.reason == 'halt'
+    assert p._m[0x800] == 1
+    assert cache.translations == 3
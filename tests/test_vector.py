@@ -0,0 +1,12 @@
+'''
+Векторный процессор: сверка каждого кода операции со скалярным CPU.
+'''
+import pytest
+
+pytest.importorskip('numpy')
+
+import vector    # noqa: E402
+
+
+def test_opcodes_match_scalar_cpu():
+    assert vector.check_opcodes(lanes=16) == []